@@ -0,0 +1,309 @@
+# server/ai_backends.py
+# Reply backends for the AI chat.
+#
+# - RuleBasedBackend: the built-in keyword rules (default, always available).
+# - ModelBackend: a local CPU model (intent classifier, small LLM, ...) that
+#   runs offline in a dedicated process pool. Requests are batched (up to
+#   AI_MODEL_WORKERS batches run at once), the queue depth is bounded and
+#   every request has a timeout; whenever the model cannot answer in time
+#   we fall back to the rule engine. A pool whose worker died is replaced;
+#   after AI_MODEL_MAX_POOL_FAILURES pools in a row broke without finishing
+#   a batch (factory raises, model crashes on load) the model is switched
+#   off for the life of the process and every reply comes from the rules.
+#
+# Configure in server/.env:
+#     AI_BACKEND=rules | model
+#     AI_MODEL_ENTRYPOINT=package.module:factory
+#         factory() is called once per worker process and must return an
+#         object with predict_batch(items: list[dict]) -> list[str | None].
+#         Each item is {"message": str, "history": [{"role", "content"}, ...]};
+#         None means "no answer" and the rule engine is used for that item.
+import os
+import abc
+import asyncio
+import importlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+log = logging.getLogger("mendly.ai_backends")
+
+AI_BACKEND = (os.getenv("AI_BACKEND") or "rules").lower().strip()
+AI_MODEL_ENTRYPOINT = os.getenv("AI_MODEL_ENTRYPOINT", "")
+AI_MODEL_WORKERS = int(os.getenv("AI_MODEL_WORKERS", "1"))
+AI_MODEL_BATCH_SIZE = int(os.getenv("AI_MODEL_BATCH_SIZE", "8"))
+AI_MODEL_BATCH_WAIT_MS = float(os.getenv("AI_MODEL_BATCH_WAIT_MS", "10"))
+AI_MODEL_MAX_QUEUE = int(os.getenv("AI_MODEL_MAX_QUEUE", "64"))
+AI_MODEL_TIMEOUT_SEC = float(os.getenv("AI_MODEL_TIMEOUT_SEC", "2.0"))
+AI_MODEL_MAX_POOL_FAILURES = int(os.getenv("AI_MODEL_MAX_POOL_FAILURES", "3"))
+
+# (message, history) -> reply; history items expose .role / .content
+FallbackFn = Callable[[str, Sequence[Any]], str]
+
+
+class ReplyBackend(abc.ABC):
+    name = "base"
+
+    @abc.abstractmethod
+    async def generate(self, message: str, history: Sequence[Any]) -> str:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class RuleBasedBackend(ReplyBackend):
+    name = "rules"
+
+    def __init__(self, rules: FallbackFn) -> None:
+        self.rules = rules
+
+    async def generate(self, message: str, history: Sequence[Any]) -> str:
+        # pure-Python keyword rules: microseconds, fine on the event loop
+        return self.rules(message, history)
+
+
+# ---------- worker-process side ----------
+
+_worker_model: Any = None
+
+
+def _load_entrypoint(entrypoint: str) -> Any:
+    module_name, _, attr = entrypoint.partition(":")
+    if not module_name or not attr:
+        raise ValueError(f"AI_MODEL_ENTRYPOINT must look like 'module:factory', got {entrypoint!r}")
+    factory = getattr(importlib.import_module(module_name), attr)
+    return factory()
+
+
+def _init_worker(entrypoint: str) -> None:
+    global _worker_model
+    _worker_model = _load_entrypoint(entrypoint)
+
+
+def _infer_batch(items: List[Dict[str, Any]]) -> List[Optional[str]]:
+    if _worker_model is None:
+        return [None] * len(items)
+    return list(_worker_model.predict_batch(items))
+
+
+# ---------- API-process side ----------
+
+class ModelBackend(ReplyBackend):
+    name = "model"
+
+    def __init__(
+        self,
+        entrypoint: str,
+        fallback: FallbackFn,
+        workers: int = AI_MODEL_WORKERS,
+        batch_size: int = AI_MODEL_BATCH_SIZE,
+        batch_wait_ms: float = AI_MODEL_BATCH_WAIT_MS,
+        max_queue: int = AI_MODEL_MAX_QUEUE,
+        timeout_sec: float = AI_MODEL_TIMEOUT_SEC,
+        max_pool_failures: int = AI_MODEL_MAX_POOL_FAILURES,
+    ) -> None:
+        self.entrypoint = entrypoint
+        self.fallback = fallback
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = max(0.0, batch_wait_ms) / 1000.0
+        self.max_queue = max(1, max_queue)
+        self.timeout_sec = timeout_sec
+        self.max_pool_failures = max(1, max_pool_failures)
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._queue: Optional["asyncio.Queue[Tuple[Dict[str, Any], asyncio.Future]]"] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending = 0
+        # pools that broke since the last batch that went through
+        self._pool_failures = 0
+        self.disabled = False
+
+        self.stats: Dict[str, int] = {
+            "model_replies": 0,
+            "fallback_queue_full": 0,
+            "fallback_timeout": 0,
+            "fallback_error": 0,
+            "fallback_no_answer": 0,
+            "fallback_disabled": 0,
+            "batches": 0,
+            "pool_restarts": 0,
+        }
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._batcher is not None and not self._batcher.done():
+            return
+
+        self._get_pool()
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._batcher = loop.create_task(self._run_batches())
+        log.info(
+            "[ai_backends] model backend started (%s, workers=%s, batch=%s)",
+            self.entrypoint,
+            self.workers,
+            self.batch_size,
+        )
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.entrypoint,),
+            )
+        return self._pool
+
+    def _drop_pool(self, pool: ProcessPoolExecutor) -> None:
+        # a worker died (OOM, segfault in native code): the executor is
+        # unusable from now on, the next batch gets a fresh one
+        if self._pool is pool:
+            self._pool = None
+            self.stats["pool_restarts"] += 1
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._pool_failures += 1
+            if self._pool_failures >= self.max_pool_failures and not self.disabled:
+                self.disabled = True
+                log.error(
+                    "[ai_backends] model pool broke %s times in a row (%s); "
+                    "model backend disabled, using rules",
+                    self._pool_failures,
+                    self.entrypoint,
+                )
+
+    async def _next_batch(self) -> List[Tuple[Dict[str, Any], asyncio.Future]]:
+        assert self._queue is not None
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batches(self) -> None:
+        # at most `workers` batches in the pool at once; while all are busy
+        # the queue keeps filling, so the next batches are fuller
+        slots = asyncio.Semaphore(self.workers)
+        while True:
+            await slots.acquire()
+            try:
+                batch = await self._next_batch()
+            except BaseException:
+                slots.release()
+                raise
+            # callers that already timed out don't need model time
+            batch = [(item, fut) for item, fut in batch if not fut.done()]
+            if not batch:
+                slots.release()
+                continue
+
+            task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _run_batch(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        if self.disabled:
+            # queued before the model was switched off: answer from the rules
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_result(None)
+            return
+
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        try:
+            results = await loop.run_in_executor(pool, _infer_batch, [item for item, _ in batch])
+            self.stats["batches"] += 1
+            self._pool_failures = 0
+        except BrokenProcessPool as e:
+            log.warning("Model worker process died (batch of %s): %r; restarting pool", len(batch), e)
+            self._drop_pool(pool)
+            results = [None] * len(batch)
+        except Exception as e:
+            log.warning("Model batch of %s failed: %r", len(batch), e)
+            results = [None] * len(batch)
+
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def generate(self, message: str, history: Sequence[Any]) -> str:
+        if self.disabled:
+            self.stats["fallback_disabled"] += 1
+            return self.fallback(message, history)
+
+        if self._pending >= self.max_queue:
+            self.stats["fallback_queue_full"] += 1
+            return self.fallback(message, history)
+
+        try:
+            self._ensure_started()
+        except Exception as e:
+            log.warning("Model backend unavailable: %r", e)
+            self.stats["fallback_error"] += 1
+            return self.fallback(message, history)
+
+        assert self._queue is not None
+        item = {
+            "message": message,
+            "history": [{"role": m.role, "content": m.content} for m in history],
+        }
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+
+        self._pending += 1
+        try:
+            self._queue.put_nowait((item, fut))
+            result = await asyncio.wait_for(fut, self.timeout_sec)
+        except asyncio.TimeoutError:
+            self.stats["fallback_timeout"] += 1
+            return self.fallback(message, history)
+        except Exception as e:
+            log.warning("Model reply failed: %r", e)
+            self.stats["fallback_error"] += 1
+            return self.fallback(message, history)
+        finally:
+            self._pending -= 1
+
+        if not result:
+            self.stats["fallback_no_answer"] += 1
+            return self.fallback(message, history)
+
+        self.stats["model_replies"] += 1
+        return str(result)
+
+    def close(self) -> None:
+        if self._batcher is not None:
+            self._batcher.cancel()
+            self._batcher = None
+        for task in list(self._in_flight):
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def load_backend(rules: FallbackFn) -> ReplyBackend:
+    """
+    Build the backend selected by AI_BACKEND. Anything unexpected
+    (unknown name, missing entrypoint) falls back to the rules.
+    """
+    if AI_BACKEND == "model":
+        if not AI_MODEL_ENTRYPOINT:
+            log.warning("[ai_backends] AI_BACKEND=model but AI_MODEL_ENTRYPOINT is empty; using rules.")
+            return RuleBasedBackend(rules)
+        return ModelBackend(AI_MODEL_ENTRYPOINT, fallback=rules)
+
+    if AI_BACKEND != "rules":
+        log.warning("[ai_backends] unknown AI_BACKEND=%r; using rules.", AI_BACKEND)
+    return RuleBasedBackend(rules)
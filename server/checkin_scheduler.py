@@ -0,0 +1,243 @@
+# server/checkin_scheduler.py
+# Check-in reminder scheduler (replaces dbo.EnqueueDailyCheckinReminders).
+#
+# Every dbo.CheckinSchedule row carries next_fire_at: the next UTC instant
+# of local_hour:local_minute in the user's timezone (UserSettings.timezone,
+# IANA name, SCHEDULER_DEFAULT_TZ when empty). Each pass only touches rows
+# that fire within SCHEDULER_LOOKAHEAD_MIN (or were never computed), so the
+# cost is proportional to the reminders due, not to the schedule table.
+#
+# Reminders are enqueued with scheduled_at = fire time, so the notification
+# worker sends them on the minute. The (user_id, purpose, slot, fire_date)
+# filtered unique index on dbo.NotificationQueue makes a re-run or a second
+# scheduler harmless.
+#
+# Changing a schedule or a user's timezone must reset next_fire_at to NULL
+# (positive_notifications_routes does so when the timezone is saved).
+#
+# The same process also runs the tip scheduler (server/tip_scheduler.py)
+# and, every RETENTION_INTERVAL_SEC, queue / audit retention (server/retention.py).
+#
+# Run from the project root:
+#     python -m server.checkin_scheduler           # loop forever
+#     python -m server.checkin_scheduler --once    # single pass (cron)
+import os
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, date, time as dtime, timedelta, timezone, tzinfo
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from .db import SessionLocal
+from .notification_templates import dump_params
+from .retention import RETENTION_INTERVAL_SEC, run_retention_pass
+from .tip_scheduler import run_tip_pass
+from .utils.timezones import user_zone
+
+log = logging.getLogger("mendly.checkin_scheduler")
+
+SCHEDULER_CHUNK_SIZE = int(os.getenv("SCHEDULER_CHUNK_SIZE", "2000"))
+# enqueue reminders that fire within this window; keep it above the interval
+SCHEDULER_LOOKAHEAD_MIN = int(os.getenv("SCHEDULER_LOOKAHEAD_MIN", "30"))
+SCHEDULER_INTERVAL_SEC = int(os.getenv("SCHEDULER_INTERVAL_SEC", "300"))
+# fires missed by more than this (scheduler was down) are skipped, not sent late
+SCHEDULER_MISSED_GRACE_MIN = int(os.getenv("SCHEDULER_MISSED_GRACE_MIN", "30"))
+
+
+def _as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def next_fire(tz: tzinfo, hour: int, minute: int, after: datetime) -> Tuple[datetime, date]:
+    """
+    First local hour:minute in tz strictly after `after`.
+    Returns (fire time in UTC, local fire date).
+    """
+    local_day = after.astimezone(tz).date()
+    while True:
+        fire = datetime.combine(local_day, dtime(hour, minute), tzinfo=tz).astimezone(timezone.utc)
+        if fire > after:
+            return fire, local_day
+        local_day += timedelta(days=1)
+
+
+def _plan(rows, now: datetime, horizon: datetime) -> Tuple[List[dict], List[dict]]:
+    """
+    Reminders to enqueue and the new next_fire_at for every schedule row.
+    """
+    missed_before = now - timedelta(minutes=SCHEDULER_MISSED_GRACE_MIN)
+    jobs: List[dict] = []
+    updates: List[dict] = []
+    for r in rows:
+        tz = user_zone(r.timezone)
+        h, m = int(r.local_hour), int(r.local_minute)
+        if r.next_fire_at is None:
+            fire, fire_date = next_fire(tz, h, m, now - timedelta(seconds=1))
+        else:
+            fire = _as_utc(r.next_fire_at)
+            fire_date = fire.astimezone(tz).date()
+
+        while fire <= horizon:
+            if fire >= missed_before:
+                jobs.append(
+                    {
+                        "user_id": str(r.user_id),
+                        "slot": r.slot_name,
+                        "fire_date": fire_date.isoformat(),
+                        "scheduled_at": fire.isoformat(),
+                        "params": dump_params({"slot": r.slot_name}),
+                    }
+                )
+            fire, fire_date = next_fire(tz, h, m, fire)
+
+        updates.append({"schedule_id": str(r.schedule_id), "next_fire_at": fire.isoformat()})
+    return jobs, updates
+
+
+def _next_chunk(db, horizon: datetime, unset: bool, n: int):
+    # two simple predicates instead of "IS NULL OR <=" so both can seek
+    # IX_CheckinSchedule_NextFire
+    where = "cs.next_fire_at IS NULL" if unset else "cs.next_fire_at <= :horizon"
+    return db.execute(
+        text(
+            f"""
+            SELECT TOP (:n)
+                cs.schedule_id, cs.user_id, cs.slot_name,
+                cs.local_hour, cs.local_minute, cs.next_fire_at,
+                s.timezone
+            FROM dbo.CheckinSchedule cs
+            LEFT JOIN dbo.UserSettings s ON s.user_id = cs.user_id
+            WHERE cs.enabled = 1
+              AND {where}
+            ORDER BY cs.next_fire_at
+            """
+        ),
+        {"n": n, "horizon": horizon},
+    ).fetchall()
+
+
+def _store(db, jobs: List[dict], updates: List[dict]) -> int:
+    inserted = 0
+    if jobs:
+        res = db.execute(
+            text(
+                """
+                INSERT INTO dbo.NotificationQueue
+                    (user_id, token_id, purpose, template_id, params_json,
+                     scheduled_at, status, slot, fire_date)
+                SELECT j.user_id, NULL, N'checkin_reminder', N'checkin_reminder', j.params,
+                       j.scheduled_at, N'pending', j.slot, j.fire_date
+                FROM OPENJSON(:jobs) WITH (
+                        user_id      UNIQUEIDENTIFIER '$.user_id',
+                        slot         NVARCHAR(20)     '$.slot',
+                        fire_date    DATE             '$.fire_date',
+                        scheduled_at DATETIMEOFFSET   '$.scheduled_at',
+                        params       NVARCHAR(400)    '$.params'
+                     ) j
+                JOIN dbo.Users u ON u.user_id = j.user_id AND u.is_deleted = 0
+                WHERE NOT EXISTS (
+                        SELECT 1 FROM dbo.NotificationQueue q
+                        WHERE q.user_id = j.user_id
+                          AND q.purpose = N'checkin_reminder'
+                          AND q.slot = j.slot
+                          AND q.fire_date = j.fire_date
+                )
+                """
+            ),
+            {"jobs": json.dumps(jobs)},
+        )
+        inserted = res.rowcount or 0
+
+    db.execute(
+        text(
+            """
+            UPDATE cs
+            SET next_fire_at = u.next_fire_at
+            FROM dbo.CheckinSchedule cs
+            JOIN OPENJSON(:updates) WITH (
+                    schedule_id  UNIQUEIDENTIFIER '$.schedule_id',
+                    next_fire_at DATETIMEOFFSET   '$.next_fire_at'
+                 ) u
+              ON u.schedule_id = cs.schedule_id
+            """
+        ),
+        {"updates": json.dumps(updates)},
+    )
+    db.commit()
+    return inserted
+
+
+def run_scheduler_pass(
+    chunk_size: int = SCHEDULER_CHUNK_SIZE,
+    lookahead_min: int = SCHEDULER_LOOKAHEAD_MIN,
+) -> Dict[str, float]:
+    """
+    Enqueue every reminder firing before now + lookahead. Returns metrics.
+    """
+    t0 = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    horizon = now + timedelta(minutes=lookahead_min)
+    stats: Dict[str, float] = {"schedules": 0, "planned": 0, "enqueued": 0, "chunks": 0}
+
+    with SessionLocal() as db:
+        # unset rows first (new users), then rows firing within the window;
+        # every processed row moves past the horizon, so both loops end
+        for unset in (True, False):
+            retried = False
+            while True:
+                rows = _next_chunk(db, horizon, unset, chunk_size)
+                if not rows:
+                    break
+                jobs, updates = _plan(rows, now, horizon)
+                try:
+                    stats["enqueued"] += _store(db, jobs, updates)
+                except IntegrityError as e:
+                    # another scheduler enqueued the same fire first; the
+                    # NOT EXISTS guard skips it when the chunk is re-read
+                    db.rollback()
+                    if retried:
+                        raise
+                    retried = True
+                    log.warning("Duplicate reminder while storing chunk, retrying: %r", e)
+                    continue
+                retried = False
+                stats["schedules"] += len(rows)
+                stats["planned"] += len(jobs)
+                stats["chunks"] += 1
+
+    stats["elapsed_sec"] = round(time.perf_counter() - t0, 3)
+    log.info("[checkin_scheduler] pass finished: %s", stats)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Mendly check-in reminder / tip scheduler")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--interval", type=int, default=SCHEDULER_INTERVAL_SEC)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    next_retention = 0.0
+    while True:
+        passes = [run_scheduler_pass, run_tip_pass]
+        if RETENTION_INTERVAL_SEC > 0 and time.monotonic() >= next_retention:
+            next_retention = time.monotonic() + RETENTION_INTERVAL_SEC
+            passes.append(run_retention_pass)
+        for run_pass in passes:
+            try:
+                run_pass()
+            except Exception as e:
+                log.exception("Scheduler pass %s failed: %r", run_pass.__name__, e)
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# server/conversations.py
+import os
+import json
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+
+log = logging.getLogger("mendly.conversations")
+
+# Same bound the chat route used for client-supplied history
+MAX_TURNS = int(os.getenv("AI_CONVERSATION_MAX_TURNS", "30"))
+# How many conversations we keep hot in this process
+CACHE_SIZE = int(os.getenv("AI_CONVERSATION_CACHE_SIZE", "5000"))
+
+
+@dataclass
+class ConversationState:
+    conversation_id: str
+    user_id: str
+    # (role, content) – only the last MAX_TURNS are kept
+    turns: Deque[Tuple[str, str]] = field(default_factory=lambda: deque(maxlen=MAX_TURNS))
+    # total number of turns ever stored (next turn_no)
+    turn_count: int = 0
+
+
+class ConversationStore:
+    """
+    Server-held AI chat conversations.
+
+    Turns are persisted in dbo.AIInteractions (purpose='chat', one row
+    per turn) and the last MAX_TURNS of recently used conversations are
+    kept in a per-process LRU cache, so a normal turn needs no DB read.
+    A cache miss (restart, other worker process) reloads from the DB, and
+    so does a conversation another process has added turns to since.
+    """
+
+    def __init__(self, cache_size: int = CACHE_SIZE) -> None:
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ---------- cache ----------
+
+    def _cache_get(self, conversation_id: str) -> Optional[ConversationState]:
+        with self._lock:
+            state = self._cache.get(conversation_id)
+            if state is not None:
+                self._cache.move_to_end(conversation_id)
+            return state
+
+    def _cache_put(self, state: ConversationState) -> None:
+        with self._lock:
+            self._cache[state.conversation_id] = state
+            self._cache.move_to_end(state.conversation_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---------- public API ----------
+
+    def create(self, user_id: str) -> ConversationState:
+        state = ConversationState(conversation_id=str(uuid.uuid4()), user_id=str(user_id))
+        self._cache_put(state)
+        return state
+
+    def get(self, db: Session, conversation_id: str, user_id: str) -> Optional[ConversationState]:
+        """
+        Return the conversation if it exists and belongs to user_id
+        (None for ids that are not UUIDs).
+        """
+        try:
+            cid = str(uuid.UUID(str(conversation_id)))
+        except ValueError:
+            return None
+        state = self._cache_get(cid)
+        if state is not None:
+            return state if state.user_id.lower() == str(user_id).lower() else None
+
+        rows = db.execute(
+            text(
+                """
+                SELECT TOP (:n) role, output_text, turn_no
+                FROM dbo.AIInteractions
+                WHERE conversation_id = :cid
+                  AND user_id = :uid
+                  AND purpose = N'chat'
+                ORDER BY turn_no DESC
+                """
+            ),
+            {"n": MAX_TURNS, "cid": cid, "uid": user_id},
+        ).fetchall()
+
+        if not rows:
+            return None
+
+        state = ConversationState(
+            conversation_id=cid,
+            user_id=str(user_id),
+            turn_count=int(rows[0].turn_no) + 1,
+        )
+        for r in reversed(rows):
+            state.turns.append((r.role, r.output_text))
+
+        self._cache_put(state)
+        return state
+
+    def history(self, state: ConversationState) -> List[Tuple[str, str]]:
+        """
+        Snapshot of the cached turns (record() may extend them concurrently).
+        """
+        with self._lock:
+            return list(state.turns)
+
+    def record(self, state: ConversationState, turns: List[Tuple[str, str]]) -> List[int]:
+        """
+        Store (role, content) turns and append them to the cached state.
+        Returns their turn_no values.
+
+        turn_no is allocated in SQL under a key-range lock on the
+        conversation, so several API processes never collide on
+        UX_AIInteractions_Conversation_Turn. Raises when the turns could
+        not be stored; the cached state is then left unchanged.
+        """
+        if not turns:
+            return []
+        with SessionLocal() as db:
+            rows = db.execute(
+                text(
+                    """
+                    INSERT INTO dbo.AIInteractions
+                        (user_id, purpose, conversation_id, turn_no, role, output_text)
+                    OUTPUT inserted.turn_no
+                    SELECT :uid, N'chat', :cid, base.next_no + t.seq, t.role, t.content
+                    FROM OPENJSON(:turns) WITH (
+                            seq     INT            '$.seq',
+                            role    NVARCHAR(20)   '$.role',
+                            content NVARCHAR(MAX)  '$.content'
+                         ) t
+                    CROSS JOIN (
+                        SELECT ISNULL(MAX(turn_no) + 1, 0) AS next_no
+                        FROM dbo.AIInteractions WITH (UPDLOCK, HOLDLOCK)
+                        WHERE conversation_id = :cid
+                    ) base
+                    """
+                ),
+                {
+                    "uid": state.user_id,
+                    "cid": state.conversation_id,
+                    "turns": json.dumps(
+                        [{"seq": i, "role": r, "content": c} for i, (r, c) in enumerate(turns)],
+                        ensure_ascii=False,
+                    ),
+                },
+            ).fetchall()
+            db.commit()
+        numbers = sorted(int(r.turn_no) for r in rows)
+
+        with self._lock:
+            if numbers[0] != state.turn_count:
+                # another process added turns: reload from the DB next time
+                self._cache.pop(state.conversation_id, None)
+            state.turns.extend(turns)
+            state.turn_count = numbers[-1] + 1
+        return numbers
+
+
+conversation_store = ConversationStore()
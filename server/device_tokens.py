@@ -0,0 +1,109 @@
+# server/device_tokens.py
+# Housekeeping for dbo.UserDeviceTokens.
+#
+# - deactivate_tokens(): called by the notification worker with the tokens
+#   FCM rejected as UNREGISTERED / INVALID_ARGUMENT, one UPDATE per batch.
+# - sweep_stale_tokens(): deactivates tokens whose last_seen is older than
+#   DEVICE_TOKEN_MAX_AGE_DAYS (the app re-registers on every start, which
+#   refreshes last_seen), in small batches so it never holds long locks.
+#
+# Both clear tip_topic; release_tip_topics() then unsubscribes the tokens
+# from their tip topic, so an inactive device stops getting broadcasts.
+import os
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .firebase_client import unsubscribe_from_topic
+
+log = logging.getLogger("mendly.device_tokens")
+
+DEVICE_TOKEN_MAX_AGE_DAYS = int(os.getenv("DEVICE_TOKEN_MAX_AGE_DAYS", "60"))
+DEVICE_TOKEN_SWEEP_BATCH = int(os.getenv("DEVICE_TOKEN_SWEEP_BATCH", "1000"))
+
+
+_DEACTIVATE_SET = """
+    SET is_active = 0,
+        tip_topic = NULL,
+        tip_sync_failures = 0,
+        tip_sync_retry_at = NULL
+    OUTPUT deleted.fcm_token, deleted.tip_topic
+"""
+
+
+def deactivate_tokens(db: Session, tokens: Iterable[str]) -> List:
+    """
+    Mark the given FCM tokens inactive. Returns the deactivated rows
+    (fcm_token, tip_topic) for release_tip_topics() after the commit.
+    Does not commit.
+    """
+    unique = sorted({t for t in tokens if t})
+    if not unique:
+        return []
+    return db.execute(
+        text(
+            f"""
+            UPDATE t
+            {_DEACTIVATE_SET}
+            FROM dbo.UserDeviceTokens t
+            JOIN OPENJSON(:tokens) WITH (fcm_token NVARCHAR(512) '$') x
+              ON x.fcm_token = t.fcm_token
+            WHERE t.is_active = 1
+            """
+        ),
+        {"tokens": json.dumps(unique)},
+    ).fetchall()
+
+
+def release_tip_topics(rows: Iterable) -> None:
+    """
+    Unsubscribe deactivated tokens from the tip topic they were on.
+    Best effort: FCM drops unregistered tokens from topics by itself.
+    """
+    by_topic: Dict[str, List[str]] = defaultdict(list)
+    for r in rows:
+        if r.tip_topic:
+            by_topic[r.tip_topic].append(r.fcm_token)
+    for topic, tokens in by_topic.items():
+        failed = unsubscribe_from_topic(tokens, topic)
+        if failed:
+            log.debug("[device_tokens] %s/%s tokens not unsubscribed from %s", failed, len(tokens), topic)
+
+
+def sweep_stale_tokens(
+    db: Session,
+    max_age_days: int = DEVICE_TOKEN_MAX_AGE_DAYS,
+    batch_size: int = DEVICE_TOKEN_SWEEP_BATCH,
+) -> int:
+    """
+    Deactivate tokens not seen for max_age_days, batch_size rows per
+    transaction. Returns the total number of tokens deactivated.
+    """
+    total = 0
+    while True:
+        rows = db.execute(
+            text(
+                f"""
+                UPDATE TOP (:n) dbo.UserDeviceTokens
+                {_DEACTIVATE_SET}
+                WHERE is_active = 1
+                  AND last_seen < DATEADD(DAY, -:days, SYSDATETIMEOFFSET())
+                """
+            ),
+            {"n": batch_size, "days": max_age_days},
+        ).fetchall()
+        db.commit()
+        # a stale token may still be valid: take it off its tip topic
+        release_tip_topics(rows)
+        changed = len(rows)
+        total += changed
+        if changed < batch_size:
+            break
+
+    if total:
+        log.info("[device_tokens] deactivated %s tokens not seen for %s days", total, max_age_days)
+    return total
@@ -0,0 +1,337 @@
+# server/email_outbox.py
+# Transactional email outbox.
+#
+# Routes never talk to SMTP: enqueue_email() inserts a dbo.EmailOutbox row
+# in the caller's session (committed with the caller's own changes) and
+# email_sender.notify() wakes a background sender. The sender claims due
+# rows with a lease (several API processes never send the same row), sends
+# them over one persistent authenticated SMTP session
+# (utils.email.SmtpConnection) and writes all outcomes of a batch with one
+# executemany. Transient failures retry with exponential backoff; 5xx
+# rejections and rows past EMAIL_MAX_ATTEMPTS end up 'dead'.
+#
+# Mail that is useless after a deadline (password reset codes) carries
+# expires_at and is marked 'expired' instead of being sent late. Bodies
+# are blanked once a row is finished (sent / dead / expired), so codes
+# don't sit in the table; retention.py deletes finished rows later.
+#
+# Local stand-in for tests / benchmarks: python -m server.fake_smtp
+import os
+import time
+import random
+import socket
+import smtplib
+import logging
+import argparse
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from .db import SessionLocal
+from .utils.email import SmtpConnection, build_message, smtp_configured
+
+log = logging.getLogger("mendly.email_outbox")
+
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+# resync when nobody called notify() (other processes, retries)
+EMAIL_POLL_SEC = float(os.getenv("EMAIL_POLL_SEC", "10"))
+EMAIL_LEASE_SECONDS = int(os.getenv("EMAIL_LEASE_SECONDS", "300"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_RETRY_BASE_SECONDS = int(os.getenv("EMAIL_RETRY_BASE_SEC", "30"))
+EMAIL_RETRY_MAX_SECONDS = int(os.getenv("EMAIL_RETRY_MAX_SEC", "3600"))
+# close the SMTP session after this long without mail
+EMAIL_IDLE_CLOSE_SEC = float(os.getenv("EMAIL_IDLE_CLOSE_SEC", "120"))
+# 0: API processes only enqueue; run python -m server.email_outbox instead
+EMAIL_SENDER_IN_PROCESS = os.getenv("EMAIL_SENDER_IN_PROCESS", "1") == "1"
+SENDER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"[:100]
+
+
+# statuses a row never leaves; their body is blanked
+EMAIL_DONE_STATUSES = ("sent", "dead", "expired")
+_DONE_SQL = ", ".join(f"N'{s}'" for s in EMAIL_DONE_STATUSES)
+
+
+def enqueue_email(
+    db, to_email: str, subject: str, body: str, expires_at: Optional[datetime] = None
+) -> None:
+    """
+    Add an email to the outbox. Does not commit: the row becomes visible
+    with the caller's commit (call email_sender.notify() after it).
+    A row still unsent at expires_at is dropped as 'expired'.
+    """
+    db.execute(
+        text(
+            """
+            INSERT INTO dbo.EmailOutbox (to_email, subject, body, expires_at)
+            VALUES (:to_email, :subject, :body, :expires_at)
+            """
+        ),
+        {"to_email": to_email, "subject": subject[:300], "body": body, "expires_at": expires_at},
+    )
+
+
+class EmailUpdate(NamedTuple):
+    email_id: str
+    status: str  # sent / pending (retry) / dead / expired
+    error: Optional[str] = None
+    retry_in: Optional[int] = None
+
+
+def _retry_delay(attempts: int) -> int:
+    delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return max(1, int(delay * random.uniform(0.8, 1.2)))
+
+
+def _permanent(exc: BaseException) -> bool:
+    # 5xx: the server will never accept this message / recipient
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPAuthenticationError):
+        return False  # fix the credentials, then the rows go out
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code >= 500
+    return False
+
+
+def _session_broken(exc: BaseException) -> bool:
+    # no point trying the rest of the batch on this session
+    # (smtplib errors are OSErrors too; only socket-level ones count here)
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPAuthenticationError)):
+        return True
+    return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+def _failure(row, exc: BaseException) -> EmailUpdate:
+    err = f"{type(exc).__name__}: {exc}"[:500]
+    if _permanent(exc) or int(row.attempts) >= EMAIL_MAX_ATTEMPTS:
+        return EmailUpdate(row.email_id, "dead", err)
+    return EmailUpdate(row.email_id, "pending", err, _retry_delay(int(row.attempts)))
+
+
+def _expired(row, now: datetime) -> bool:
+    if row.expires_at is None:
+        return False
+    expires_at = row.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at <= now
+
+
+def _claim(db, n: int) -> List:
+    rows = db.execute(
+        text(
+            """
+            WITH due AS (
+                SELECT TOP (:n) *
+                FROM dbo.EmailOutbox WITH (ROWLOCK, READPAST, UPDLOCK)
+                WHERE (status = N'pending' AND scheduled_at <= SYSDATETIMEOFFSET())
+                   OR (status = N'sending' AND lease_until < SYSDATETIMEOFFSET())
+                ORDER BY scheduled_at
+            )
+            UPDATE due
+            SET status = N'sending',
+                attempts = attempts + 1,
+                lease_until = DATEADD(SECOND, :lease, SYSDATETIMEOFFSET()),
+                claimed_by = :sender
+            OUTPUT inserted.email_id, inserted.to_email, inserted.subject,
+                   inserted.body, inserted.expires_at, inserted.attempts
+            """
+        ),
+        {"n": n, "lease": EMAIL_LEASE_SECONDS, "sender": SENDER_ID},
+    ).fetchall()
+    db.commit()
+    return rows
+
+
+def _store(db, updates: List[EmailUpdate]) -> None:
+    if not updates:
+        return
+    db.execute(
+        text(
+            f"""
+            UPDATE dbo.EmailOutbox
+            SET status = :status,
+                error = :error,
+                scheduled_at = CASE WHEN :retry_in IS NOT NULL
+                    THEN DATEADD(SECOND, :retry_in, SYSDATETIMEOFFSET())
+                    ELSE scheduled_at END,
+                sent_at = CASE WHEN :status IN ({_DONE_SQL})
+                    THEN SYSDATETIMEOFFSET() ELSE sent_at END,
+                body = CASE WHEN :status IN ({_DONE_SQL}) THEN N'' ELSE body END,
+                lease_until = NULL,
+                claimed_by = NULL
+            WHERE email_id = :eid
+              AND status = N'sending'
+              AND claimed_by = :sender
+            """
+        ),
+        [
+            {
+                "eid": u.email_id,
+                "status": u.status,
+                "error": u.error,
+                "retry_in": u.retry_in,
+                "sender": SENDER_ID,
+            }
+            for u in updates
+        ],
+    )
+    db.commit()
+
+
+class EmailOutboxSender:
+    """
+    Background thread draining dbo.EmailOutbox over one SMTP session.
+
+    Started lazily by notify() (and by main.lifespan), stopped by stop().
+    """
+
+    def __init__(
+        self,
+        batch_size: int = EMAIL_BATCH_SIZE,
+        poll_seconds: float = EMAIL_POLL_SEC,
+        enabled: bool = EMAIL_SENDER_IN_PROCESS,
+    ) -> None:
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._smtp = SmtpConnection()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_send = 0.0
+
+        self.sent = 0
+        self.failed = 0
+        self.expired = 0
+
+    def notify(self) -> None:
+        """
+        New mail was committed: send it now instead of at the next poll.
+        """
+        self._ensure_started()
+        self._wake.set()
+
+    def process_batch(self) -> int:
+        """
+        Claim and send one batch. Returns how many rows were claimed.
+        """
+        with SessionLocal() as db:
+            rows = _claim(db, self.batch_size)
+        if not rows:
+            return 0
+
+        updates: List[EmailUpdate] = []
+        broken: Optional[BaseException] = None
+        now = datetime.now(timezone.utc)
+        for row in rows:
+            if _expired(row, now):
+                updates.append(EmailUpdate(row.email_id, "expired", "expired before it could be sent"))
+                continue
+            if broken is not None:
+                # session is gone: retry the rest later without trying them
+                updates.append(_failure(row, broken))
+                continue
+            try:
+                self._smtp.send(build_message(row.to_email, row.subject, row.body))
+                updates.append(EmailUpdate(row.email_id, "sent"))
+            except Exception as e:
+                updates.append(_failure(row, e))
+                if _session_broken(e):
+                    self._smtp.close()
+                    broken = e
+        self._last_send = time.monotonic()
+
+        with SessionLocal() as db:
+            _store(db, updates)
+
+        ok = sum(1 for u in updates if u.status == "sent")
+        expired = sum(1 for u in updates if u.status == "expired")
+        self.sent += ok
+        self.expired += expired
+        self.failed += len(updates) - ok - expired
+        if ok + expired < len(updates):
+            log.warning(
+                "[email_outbox] %s/%s emails failed: %s",
+                len(updates) - ok - expired,
+                len(updates),
+                next(u.error for u in updates if u.status not in ("sent", "expired")),
+            )
+        return len(rows)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            # cleared before the claim: a notify() during the batch is not lost
+            self._wake.clear()
+            try:
+                if self.process_batch() >= self.batch_size:
+                    continue
+            except Exception as e:
+                log.exception("Error in email outbox sender: %r", e)
+            if time.monotonic() - self._last_send > EMAIL_IDLE_CLOSE_SEC:
+                self._smtp.close()
+            self._wake.wait(self.poll_seconds)
+        self._smtp.close()
+
+    def _ensure_started(self) -> None:
+        if not self.enabled:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if not smtp_configured():
+                log.warning("[email_outbox] EMAIL/EMAILPASSWORD missing; emails stay queued.")
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+            self._thread.start()
+            log.info("[email_outbox] sender %s started (batch=%s)", SENDER_ID, self.batch_size)
+
+    def start(self) -> None:
+        self._ensure_started()
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stop after the batch in flight. Called from main.lifespan on shutdown.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+
+email_sender = EmailOutboxSender()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Standalone sender process: python -m server.email_outbox
+    """
+    parser = argparse.ArgumentParser(description="Mendly email outbox sender")
+    parser.add_argument("--batch-size", type=int, default=EMAIL_BATCH_SIZE)
+    parser.add_argument("--poll", type=float, default=EMAIL_POLL_SEC)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    sender = EmailOutboxSender(batch_size=max(1, args.batch_size), poll_seconds=args.poll, enabled=True)
+    sender.start()
+    try:
+        while sender.running():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sender.stop()
+
+
+if __name__ == "__main__":
+    main()
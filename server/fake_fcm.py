@@ -0,0 +1,185 @@
+# server/fake_fcm.py
+# Local FCM stand-in for load tests (stdlib only).
+#
+# Speaks the protocol of firebase_client.HttpTransport; point the worker at
+# it with FCM_TRANSPORT=http FCM_HTTP_URL=http://127.0.0.1:9119
+#
+#     python -m server.fake_fcm --port 9119 --latency-ms 40 \
+#         --error-rate 0.01 --unregistered-rate 0.002
+#
+# Per message: UNAVAILABLE with --error-rate, UNREGISTERED with
+# --unregistered-rate, and always UNREGISTERED for tokens starting with
+# "bad-". GET /stats returns the counters.
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+log = logging.getLogger("mendly.fake_fcm")
+
+
+class FakeFcm:
+    """
+    Response behaviour and counters shared by all handler threads.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        unregistered_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.unregistered_rate = unregistered_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts: Counter = Counter()
+        self.started_at = time.time()
+
+    def _sleep(self) -> None:
+        delay = self.latency_ms + (self._rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _respond(self, token: Optional[str]) -> Dict[str, Any]:
+        with self._lock:
+            roll = self._rng.random()
+        if (token or "").startswith("bad-") or roll < self.unregistered_rate:
+            code, message = "UNREGISTERED", "Requested entity was not found."
+        elif roll < self.unregistered_rate + self.error_rate:
+            code, message = "UNAVAILABLE", "The service is currently unavailable."
+        else:
+            return {"message_id": f"projects/fake/messages/{uuid.uuid4().hex}"}
+        return {"error": {"code": code, "message": message}}
+
+    def _count(self, responses: List[Dict[str, Any]], kind: str) -> None:
+        with self._lock:
+            self.counts[f"{kind}_requests"] += 1
+            for r in responses:
+                self.counts["messages"] += 1
+                self.counts[r["error"]["code"].lower() if "error" in r else "ok"] += 1
+
+    def send_batch(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        self._sleep()
+        responses = [self._respond(m.get("token")) for m in messages]
+        self._count(responses, "batch")
+        return responses
+
+    def send_topic(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        self._sleep()
+        resp = self._respond(None)
+        self._count([resp], "topic")
+        return resp
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        elapsed = time.time() - self.started_at
+        counts["uptime_sec"] = round(elapsed, 1)
+        counts["messages_per_sec"] = round(counts.get("messages", 0) / elapsed, 1) if elapsed else 0.0
+        return counts
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+            self.started_at = time.time()
+
+
+def _handler(fake: FakeFcm):
+    class FakeFcmHandler(BaseHTTPRequestHandler):
+        # keep-alive, like the real FCM endpoint
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self) -> None:  # noqa: N802
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except Exception:
+                self._send(400, {"error": {"code": "INVALID_ARGUMENT", "message": "bad json"}})
+                return
+            if self.path.startswith("/batch"):
+                self._send(200, {"responses": fake.send_batch(body.get("messages") or [])})
+            elif self.path.startswith("/topic"):
+                self._send(200, fake.send_topic(body))
+            else:
+                self._send(404, {"error": {"code": "NOT_FOUND", "message": self.path}})
+
+        def do_GET(self) -> None:  # noqa: N802
+            if self.path.startswith("/stats"):
+                self._send(200, fake.stats())
+            else:
+                self._send(404, {"error": {"code": "NOT_FOUND", "message": self.path}})
+
+        def _send(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return FakeFcmHandler
+
+
+def start_fake_fcm(fake: FakeFcm, port: int = 9119, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve `fake` from a daemon thread; port 0 picks a free port
+    (read it back from server.server_address).
+    """
+    server = ThreadingHTTPServer((host, port), _handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-fcm", daemon=True).start()
+    log.info("[fake_fcm] listening on http://%s:%s", host, server.server_address[1])
+    return server
+
+
+def add_fake_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra random latency, 0..N ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of UNAVAILABLE responses")
+    parser.add_argument("--unregistered-rate", type=float, default=0.0, help="share of UNREGISTERED responses")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def fake_from_args(args: argparse.Namespace) -> FakeFcm:
+    return FakeFcm(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        unregistered_rate=args.unregistered_rate,
+        seed=args.seed,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local FCM stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9119)
+    add_fake_args(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = start_fake_fcm(fake_from_args(args), args.port, args.host)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
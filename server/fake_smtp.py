@@ -0,0 +1,136 @@
+# server/fake_smtp.py
+# Local SMTP stand-in (aiosmtpd) for the email outbox.
+#
+#     pip install aiosmtpd
+#     python -m server.fake_smtp --port 8025 --latency-ms 20 --fail-rate 0.01
+#
+# Point the outbox at it with
+#     SMTP_HOST=127.0.0.1 SMTP_PORT=8025 SMTP_STARTTLS=0 SMTP_LOGIN=0
+#
+# Messages are counted and dropped. --fail-rate answers "451 try again
+# later" (a transient failure) to that share of messages.
+#
+# Throughput benchmark, one persistent session vs a new connection per
+# message (the old send_email behaviour):
+#     python -m server.fake_smtp --bench 2000
+#     python -m server.fake_smtp --bench 2000 --reconnect-each
+import time
+import random
+import asyncio
+import logging
+import argparse
+import threading
+from typing import Any, Dict, List, Optional
+
+log = logging.getLogger("mendly.fake_smtp")
+
+
+class FakeSmtpHandler:
+    """
+    aiosmtpd handler: optional latency and transient failures, counters.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, fail_rate: float = 0.0, seed: Optional[int] = None) -> None:
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.started_at = time.time()
+
+    async def handle_DATA(self, server: Any, session: Any, envelope: Any) -> str:  # noqa: N802
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+        with self._lock:
+            if self._rng.random() < self.fail_rate:
+                self.rejected += 1
+                return "451 4.3.0 Try again later"
+            self.accepted += 1
+        return "250 Message accepted for delivery"
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = time.time() - self.started_at
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "uptime_sec": round(elapsed, 1),
+                "accepted_per_sec": round(self.accepted / elapsed, 1) if elapsed else 0.0,
+            }
+
+
+def start_fake_smtp(handler: FakeSmtpHandler, port: int = 8025, host: str = "127.0.0.1"):
+    """
+    Run the stand-in in aiosmtpd's own thread; returns the Controller
+    (call .stop() when done).
+    """
+    try:
+        from aiosmtpd.controller import Controller  # type: ignore
+    except ImportError as e:
+        raise RuntimeError("fake_smtp needs aiosmtpd: pip install aiosmtpd") from e
+
+    controller = Controller(handler, hostname=host, port=port)
+    controller.start()
+    log.info("[fake_smtp] listening on %s:%s", host, port)
+    return controller
+
+
+def bench(n: int, host: str, port: int, reconnect_each: bool) -> Dict[str, Any]:
+    """
+    Send n messages over SmtpConnection and time it.
+    """
+    from .utils.email import SmtpConnection, build_message
+
+    conn = SmtpConnection(host=host, port=port, starttls=False, login=False)
+    failed = 0
+    t0 = time.perf_counter()
+    for i in range(n):
+        try:
+            conn.send(build_message(f"bench{i}@example.invalid", "Mendly bench", "Hello from the benchmark."))
+        except Exception:
+            failed += 1
+        if reconnect_each:
+            conn.close()
+    conn.close()
+    elapsed = time.perf_counter() - t0
+    return {
+        "messages": n,
+        "failed": failed,
+        "connections": conn.connects,
+        "elapsed_sec": round(elapsed, 3),
+        "messages_per_sec": round(n / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local SMTP stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of 451 responses")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--bench", type=int, default=0, help="send N messages, print stats, exit")
+    parser.add_argument("--reconnect-each", action="store_true", help="bench: new session per message")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    handler = FakeSmtpHandler(args.latency_ms, args.fail_rate, args.seed)
+    controller = start_fake_smtp(handler, args.port, args.host)
+    try:
+        if args.bench > 0:
+            result = bench(args.bench, args.host, args.port, args.reconnect_each)
+            result["server"] = handler.stats()
+            print(result)
+            return
+        while True:
+            time.sleep(30)
+            log.info("[fake_smtp] %s", handler.stats())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,29 @@
 # server/firebase_client.py
+# FCM access for the API and the notification worker.
+#
+# FCM_TRANSPORT selects where batch / multicast / topic sends go:
+#   firebase (default)  real FCM through firebase_admin
+#   http                a FCM stand-in speaking the small JSON protocol of
+#                       HttpTransport, e.g. python -m server.fake_fcm
+#                       (load tests: server/notification_loadtest.py)
 import os
+import json
 import logging
-from typing import Optional, Dict
+import threading
+import http.client
+import urllib.parse
+from dataclasses import dataclass, field
+from typing import Any, Optional, Dict, List
 
 import firebase_admin  # type: ignore
 from firebase_admin import credentials, messaging  # type: ignore
 
 log = logging.getLogger("mendly.firebase")
 
+FCM_TRANSPORT = (os.getenv("FCM_TRANSPORT") or "firebase").lower().strip()
+FCM_HTTP_URL = os.getenv("FCM_HTTP_URL", "http://127.0.0.1:9119")
+FCM_HTTP_TIMEOUT = float(os.getenv("FCM_HTTP_TIMEOUT_SEC", "30"))
+
 # Path to your Firebase service account JSON file
 # Configure in server/.env: FCM_CREDENTIALS=server/firebase-key.json
 FCM_CREDENTIALS = os.getenv("FCM_CREDENTIALS", "server/firebase-key.json")
@@ -59,3 +75,339 @@ def send_push_to_token(
     resp = messaging.send(msg)
     log.info("[firebase] Sent push to token %s... -> %s", token[:12], resp)
     return resp
+
+
+# FCM accepts at most 500 messages per send_each call
+FCM_BATCH_LIMIT = 500
+
+
+@dataclass
+class PushMessage:
+    token: str
+    title: str
+    body: str
+    data: Dict[str, str] = field(default_factory=dict)
+
+
+# FCM error codes meaning "this token will never work again"
+INVALID_TOKEN_CODES = frozenset({"UNREGISTERED", "INVALID_ARGUMENT", "SENDER_ID_MISMATCH"})
+
+
+@dataclass
+class SendResult:
+    ok: bool
+    message_id: Optional[str] = None
+    error: Optional[str] = None
+    # FCM error code (UNREGISTERED, INVALID_ARGUMENT, UNAVAILABLE, ...)
+    error_code: Optional[str] = None
+
+    @property
+    def token_invalid(self) -> bool:
+        return not self.ok and self.error_code in INVALID_TOKEN_CODES
+
+
+def classify_error(exc: BaseException) -> str:
+    """
+    Map a firebase_admin exception to an FCM error code.
+    """
+    if isinstance(exc, messaging.UnregisteredError):
+        return "UNREGISTERED"
+    if isinstance(exc, messaging.SenderIdMismatchError):
+        return "SENDER_ID_MISMATCH"
+    if isinstance(exc, messaging.QuotaExceededError):
+        return "QUOTA_EXCEEDED"
+    if isinstance(exc, messaging.ThirdPartyAuthError):
+        return "THIRD_PARTY_AUTH_ERROR"
+    code = getattr(exc, "code", None)
+    return str(code).upper() if code else "UNKNOWN"
+
+
+def _to_fcm_message(m: PushMessage) -> "messaging.Message":
+    return messaging.Message(
+        notification=messaging.Notification(title=m.title, body=m.body),
+        token=m.token,
+        data={k: str(v) for k, v in (m.data or {}).items()},
+    )
+
+
+def send_push_batch(messages: List[PushMessage]) -> List[SendResult]:
+    """
+    Send many pushes with messaging.send_each (one HTTP call per 500
+    messages). Returns one SendResult per input message, in order.
+    If FCM is not configured, every message reports 'fcm_disabled'.
+    """
+    if not messages:
+        return []
+
+    if _transport is not None:
+        return _transport.send_batch(messages)
+
+    if not FCM_ENABLED:
+        log.info(
+            "[firebase] Skipping batch of %s pushes because FCM is disabled (no credentials).",
+            len(messages),
+        )
+        return [SendResult(ok=True, message_id="fcm_disabled") for _ in messages]
+
+    results: List[SendResult] = []
+    for i in range(0, len(messages), FCM_BATCH_LIMIT):
+        chunk = messages[i : i + FCM_BATCH_LIMIT]
+        try:
+            batch = messaging.send_each([_to_fcm_message(m) for m in chunk])
+        except Exception as e:
+            # whole call failed (network, auth...) -> every message failed;
+            # that says nothing about the individual tokens, so no error_code
+            log.warning("[firebase] send_each failed for %s messages: %r", len(chunk), e)
+            results.extend(SendResult(ok=False, error=str(e)) for _ in chunk)
+            continue
+
+        for r in batch.responses:
+            if r.success:
+                results.append(SendResult(ok=True, message_id=r.message_id))
+            else:
+                results.append(
+                    SendResult(
+                        ok=False,
+                        error=str(r.exception),
+                        error_code=classify_error(r.exception),
+                    )
+                )
+
+        log.info(
+            "[firebase] send_each: %s ok, %s failed",
+            batch.success_count,
+            batch.failure_count,
+        )
+
+    return results
+
+
+def send_push_multicast(
+    tokens: List[str],
+    title: str,
+    body: str,
+    data: Optional[Dict[str, str]] = None,
+) -> List[SendResult]:
+    """
+    Send the same push to several devices (e.g. all of one user's
+    devices) with messaging.send_each_for_multicast. Duplicate tokens
+    are sent once; returns one SendResult per unique token, in order.
+    """
+    unique = list(dict.fromkeys(t for t in tokens if t))
+    if not unique:
+        return []
+
+    if _transport is not None:
+        return _transport.send_batch(
+            [PushMessage(token=t, title=title, body=body, data=dict(data or {})) for t in unique]
+        )
+
+    if not FCM_ENABLED:
+        log.info(
+            "[firebase] Skipping multicast to %s devices because FCM is disabled (no credentials).",
+            len(unique),
+        )
+        return [SendResult(ok=True, message_id="fcm_disabled") for _ in unique]
+
+    results: List[SendResult] = []
+    for i in range(0, len(unique), FCM_BATCH_LIMIT):
+        chunk = unique[i : i + FCM_BATCH_LIMIT]
+        msg = messaging.MulticastMessage(
+            tokens=chunk,
+            notification=messaging.Notification(title=title, body=body),
+            data={k: str(v) for k, v in (data or {}).items()},
+        )
+        try:
+            batch = messaging.send_each_for_multicast(msg)
+        except Exception as e:
+            log.warning("[firebase] multicast to %s devices failed: %r", len(chunk), e)
+            results.extend(SendResult(ok=False, error=str(e)) for _ in chunk)
+            continue
+
+        for r in batch.responses:
+            if r.success:
+                results.append(SendResult(ok=True, message_id=r.message_id))
+            else:
+                results.append(
+                    SendResult(
+                        ok=False,
+                        error=str(r.exception),
+                        error_code=classify_error(r.exception),
+                    )
+                )
+
+    return results
+
+
+# ---------- topics (broadcast content) ----------
+
+# FCM accepts at most 1000 tokens per subscribe / unsubscribe call
+FCM_TOPIC_BATCH_LIMIT = 1000
+
+
+def send_push_topic(
+    topic: str,
+    title: str,
+    body: str,
+    data: Optional[Dict[str, str]] = None,
+) -> SendResult:
+    """
+    One message to every device subscribed to `topic`.
+    """
+    if _transport is not None:
+        return _transport.send_topic(topic, title, body, data)
+
+    if not FCM_ENABLED:
+        log.info("[firebase] Skipping push to topic %s because FCM is disabled (no credentials).", topic)
+        return SendResult(ok=True, message_id="fcm_disabled")
+
+    msg = messaging.Message(
+        notification=messaging.Notification(title=title, body=body),
+        topic=topic,
+        data={k: str(v) for k, v in (data or {}).items()},
+    )
+    try:
+        resp = messaging.send(msg)
+    except Exception as e:
+        return SendResult(ok=False, error=str(e), error_code=classify_error(e))
+    log.info("[firebase] Sent push to topic %s -> %s", topic, resp)
+    return SendResult(ok=True, message_id=resp)
+
+
+def _topic_management(fn, tokens: List[str], topic: str) -> int:
+    if not tokens:
+        return 0
+    if _transport is not None or not FCM_ENABLED:
+        # nothing gets (un)subscribed without firebase_admin (the HTTP
+        # stand-in has no subscriptions): report every token as failed so
+        # callers don't record a subscription that doesn't exist
+        return len(tokens)
+    failed = 0
+    for i in range(0, len(tokens), FCM_TOPIC_BATCH_LIMIT):
+        chunk = tokens[i : i + FCM_TOPIC_BATCH_LIMIT]
+        try:
+            resp = fn(chunk, topic)
+            failed += resp.failure_count
+        except Exception as e:
+            log.warning("[firebase] topic %s update failed for %s tokens: %r", topic, len(chunk), e)
+            failed += len(chunk)
+    return failed
+
+
+def subscribe_to_topic(tokens: List[str], topic: str) -> int:
+    """
+    Subscribe tokens to a topic. Returns how many failed.
+    """
+    return _topic_management(messaging.subscribe_to_topic, tokens, topic)
+
+
+def unsubscribe_from_topic(tokens: List[str], topic: str) -> int:
+    """
+    Unsubscribe tokens from a topic. Returns how many failed.
+    """
+    return _topic_management(messaging.unsubscribe_from_topic, tokens, topic)
+
+
+# ---------- pluggable transport ----------
+
+
+class HttpTransport:
+    """
+    Sends through an HTTP FCM stand-in instead of firebase_admin.
+
+        POST /batch  {"messages": [{"token", "title", "body", "data"}, ...]}
+                  -> {"responses": [{"message_id": ...}
+                                    | {"error": {"code": ..., "message": ...}}, ...]}
+        POST /topic  {"topic", "title", "body", "data"}  -> same single response
+
+    One keep-alive connection per sending thread, so the worker's thread
+    pool behaves like it does against FCM.
+    """
+
+    def __init__(self, base_url: str, timeout: float = FCM_HTTP_TIMEOUT) -> None:
+        url = urllib.parse.urlsplit(base_url)
+        self.host = url.hostname or "127.0.0.1"
+        self.port = url.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        data = json.dumps(body).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self._local.conn = conn
+            try:
+                conn.request("POST", path, body=data, headers=headers)
+                resp = conn.getresponse()
+                payload = resp.read()
+            except (http.client.HTTPException, OSError):
+                # stale keep-alive connection: reconnect once
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+                continue
+            if resp.status != 200:
+                raise RuntimeError(f"FCM stand-in returned HTTP {resp.status}")
+            return json.loads(payload or b"{}")
+        raise RuntimeError("unreachable")
+
+    @staticmethod
+    def _result(r: Dict[str, Any]) -> SendResult:
+        err = r.get("error")
+        if err:
+            return SendResult(ok=False, error=err.get("message") or err.get("code"), error_code=err.get("code"))
+        return SendResult(ok=True, message_id=r.get("message_id"))
+
+    def send_batch(self, messages: List[PushMessage]) -> List[SendResult]:
+        results: List[SendResult] = []
+        for i in range(0, len(messages), FCM_BATCH_LIMIT):
+            chunk = messages[i : i + FCM_BATCH_LIMIT]
+            try:
+                resp = self._post(
+                    "/batch",
+                    {
+                        "messages": [
+                            {"token": m.token, "title": m.title, "body": m.body, "data": m.data or {}}
+                            for m in chunk
+                        ]
+                    },
+                )
+            except Exception as e:
+                # same contract as send_each failing as a whole: no error_code
+                log.warning("[firebase] stand-in batch of %s messages failed: %r", len(chunk), e)
+                results.extend(SendResult(ok=False, error=str(e)) for _ in chunk)
+                continue
+            responses = resp.get("responses") or []
+            if len(responses) != len(chunk):
+                results.extend(SendResult(ok=False, error="malformed stand-in response") for _ in chunk)
+                continue
+            results.extend(self._result(r) for r in responses)
+        return results
+
+    def send_topic(self, topic: str, title: str, body: str, data: Optional[Dict[str, str]] = None) -> SendResult:
+        try:
+            resp = self._post("/topic", {"topic": topic, "title": title, "body": body, "data": data or {}})
+        except Exception as e:
+            return SendResult(ok=False, error=str(e))
+        return self._result(resp)
+
+
+_transport: Optional[HttpTransport] = None
+
+
+def set_transport(transport: Optional[HttpTransport]) -> None:
+    """
+    Route batch, multicast and topic sends through `transport`
+    (None -> back to firebase_admin).
+    """
+    global _transport
+    _transport = transport
+
+
+if FCM_TRANSPORT == "http":
+    set_transport(HttpTransport(FCM_HTTP_URL))
+    log.info("[firebase] using FCM stand-in at %s", FCM_HTTP_URL)
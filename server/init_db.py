@@ -13,6 +13,8 @@ load_dotenv(dotenv_path=env_path, override=True)
 
 DB_NAME = "Mendly"
 SCHEMA_FILE = Path(__file__).with_name("mendly_schema.sql")
+# guarded ALTER / CREATE statements for databases created by an older schema file
+UPGRADE_FILE = Path(__file__).with_name("mendly_schema_upgrade.sql")
 
 
 def _build_master_engine():
@@ -54,7 +56,8 @@ def ensure_database_and_schema():
     """
     1) Ensure Mendly DB exists.
     2) Apply schema file (GO-aware).
-       Skip only if dbo.Users exists and dbo.Users.Role exists (mode=missing).
+       If dbo.Users and dbo.Users.Role already exist (mode=missing), apply
+       the upgrade file instead so existing databases pick up new columns/tables.
     """
     print("[init_db] starting...")
 
@@ -83,7 +86,9 @@ def ensure_database_and_schema():
             users_exists = conn.execute(text("SELECT OBJECT_ID('dbo.Users','U')")).scalar_one()
             role_exists = conn.execute(text("SELECT COL_LENGTH('dbo.Users','Role')")).scalar_one()
             if users_exists is not None and role_exists is not None:
-                print("[init_db] schema exists -> skipping (mode=missing)")
+                print("[init_db] schema exists -> applying upgrades (mode=missing)")
+                _run_sql_with_go(conn, UPGRADE_FILE.read_text(encoding="utf-8"))
+                print("[init_db] upgrades applied ok")
                 return
 
         print(f"[init_db] applying schema file (mode={mode})...")
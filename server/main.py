@@ -29,7 +29,9 @@ from .routers import (
     psychologists_routes,
     psychologist_routes,
 )
-from .notification_worker import start_worker
+from .notification_worker import start_worker, stop_worker
+from .mood_snapshots import snapshot_buffer
+from .email_outbox import email_sender
 
 log = logging.getLogger("mendly.startup")
 logging.basicConfig(level=logging.INFO)
@@ -40,6 +42,7 @@ DB_PING_TIMEOUT_SEC = float(os.getenv("DB_PING_TIMEOUT_SEC", "1.5"))
 
 NOTIF_WORKER_ENABLED = os.getenv("NOTIF_WORKER_ENABLED", "0") == "1"
 NOTIF_WORKER_INTERVAL_SEC = int(os.getenv("NOTIF_WORKER_INTERVAL_SEC", "60"))
+NOTIF_WORKER_DRAIN_SEC = float(os.getenv("NOTIF_WORKER_DRAIN_SEC", "20"))
 
 # If you want strict origins, set CORS_ALLOW_ALL=0 in server/.env
 CORS_ALLOW_ALL = os.getenv("CORS_ALLOW_ALL", "1") == "1"
@@ -95,20 +98,38 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     if DB_WARMUP_ON_STARTUP:
         await asyncio.to_thread(_safe_db_warmup)
 
-    # Start worker only after DB is ready
+    # Start worker only after DB is ready.
+    # Safe in every uvicorn process: jobs are claimed with a lease, so
+    # several workers never send the same row. For production prefer the
+    # standalone process (python -m server.notification_worker) and keep
+    # NOTIF_WORKER_ENABLED=0 here.
+    worker_thread = None
     if NOTIF_WORKER_ENABLED:
         def _run_worker():
             start_worker(interval_seconds=NOTIF_WORKER_INTERVAL_SEC)
 
-        t = threading.Thread(target=_run_worker, daemon=True)
-        t.start()
+        worker_thread = threading.Thread(target=_run_worker, daemon=True)
+        worker_thread.start()
         log.info(
-            "[startup] notification worker thread started (interval=%ss)",
+            "[startup] notification worker thread started (resync interval=%ss)",
             NOTIF_WORKER_INTERVAL_SEC,
         )
 
+    # Drains dbo.EmailOutbox (also mail queued while the API was down)
+    await asyncio.to_thread(email_sender.start)
+
     yield
 
+    # Let the worker finish the batch it is sending
+    if worker_thread is not None:
+        stop_worker()
+        await asyncio.to_thread(worker_thread.join, NOTIF_WORKER_DRAIN_SEC)
+
+    # Write any coalesced AI chat mood snapshots that are still buffered
+    await asyncio.to_thread(snapshot_buffer.stop)
+    await asyncio.to_thread(email_sender.stop)
+    ai_routes.reply_backend.close()
+
 
 app = FastAPI(lifespan=lifespan)
 
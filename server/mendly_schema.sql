@@ -57,9 +57,29 @@ CREATE TABLE dbo.UserSettings (
 
     last_phq2_date DATE NULL,
 
-    last_photo_memory_date DATE NULL
+    last_photo_memory_date DATE NULL,
+
+    -- IANA name (e.g. 'Asia/Jerusalem'); NULL -> SCHEDULER_DEFAULT_TZ
+    timezone NVARCHAR(64) NULL,
+
+    -- next tip time, maintained by server/tip_scheduler.py
+    next_positive_at DATETIMEOFFSET NULL,
+
+    -- opt-in: no pushes between these local hours; NULL -> NOTIF_QUIET_START_HOUR /
+    -- NOTIF_QUIET_END_HOUR (unset: no quiet hours). Users with their own quiet hours
+    -- or cap get direct tips instead of topic broadcasts (tip_topics.py)
+    quiet_start_hour TINYINT NULL CONSTRAINT CK_UserSettings_QuietStart CHECK (quiet_start_hour < 24),
+    quiet_end_hour   TINYINT NULL CONSTRAINT CK_UserSettings_QuietEnd CHECK (quiet_end_hour < 24),
+
+    -- pushes per rolling 24 hours; NULL -> NOTIF_MAX_PUSHES_PER_DAY
+    max_pushes_per_day TINYINT NULL
 );
 GO
+CREATE INDEX IX_UserSettings_NextPositive
+    ON dbo.UserSettings(next_positive_at)
+    INCLUDE (positive_notif_interval_minutes)
+    WHERE positive_notif_enabled = 1;
+GO
 
 ------------------------------------------------------------
 -- 3) UserDeviceTokens  (جديد موصى به لـ FCM)
@@ -73,9 +93,19 @@ CREATE TABLE dbo.UserDeviceTokens (
     fcm_token       NVARCHAR(512)    NOT NULL UNIQUE,
     app_version     NVARCHAR(20)     NULL,
     last_seen       DATETIMEOFFSET   NOT NULL CONSTRAINT DF_UserDeviceTokens_LastSeen DEFAULT SYSDATETIMEOFFSET(),
-    is_active       BIT              NOT NULL CONSTRAINT DF_UserDeviceTokens_Active DEFAULT (1)
+    is_active       BIT              NOT NULL CONSTRAINT DF_UserDeviceTokens_Active DEFAULT (1),
+    language        NVARCHAR(10)     NULL,
+    -- FCM topic this device is subscribed to for broadcast tips (tip_topics.py)
+    tip_topic       NVARCHAR(200)    NULL,
+    -- failed topic (un)subscribe calls in a row; next retry not before tip_sync_retry_at
+    tip_sync_failures TINYINT        NOT NULL CONSTRAINT DF_UserDeviceTokens_TipSyncFailures DEFAULT (0),
+    tip_sync_retry_at DATETIMEOFFSET NULL
 );
 CREATE INDEX IX_UserDeviceTokens_User ON dbo.UserDeviceTokens(user_id, is_active);
+-- stale-token sweep (device_tokens.sweep_stale_tokens)
+CREATE INDEX IX_UserDeviceTokens_Active_LastSeen ON dbo.UserDeviceTokens(last_seen) WHERE is_active = 1;
+CREATE INDEX IX_UserDeviceTokens_TipTopic ON dbo.UserDeviceTokens(tip_topic) WHERE is_active = 1 AND tip_topic IS NOT NULL;
+CREATE INDEX IX_UserDeviceTokens_TipSyncRetry ON dbo.UserDeviceTokens(tip_sync_retry_at) WHERE is_active = 1 AND tip_sync_retry_at IS NOT NULL;
 
 ------------------------------------------------------------
 -- 4) CheckinSchedule
@@ -91,8 +121,12 @@ CREATE TABLE dbo.CheckinSchedule (
     enabled         BIT              NOT NULL CONSTRAINT DF_CheckinSchedule_Enabled DEFAULT (1),
     created_at      DATETIMEOFFSET   NOT NULL CONSTRAINT DF_CheckinSchedule_Created DEFAULT SYSDATETIMEOFFSET(),
     updated_at      DATETIMEOFFSET   NOT NULL CONSTRAINT DF_CheckinSchedule_Updated DEFAULT SYSDATETIMEOFFSET(),
+    -- next UTC fire time, maintained by server/checkin_scheduler.py;
+    -- set back to NULL when the slot time or the user's timezone changes
+    next_fire_at    DATETIMEOFFSET   NULL,
     CONSTRAINT UQ_CheckinSchedule_UserSlot UNIQUE (user_id, slot_name)
 );
+CREATE INDEX IX_CheckinSchedule_NextFire ON dbo.CheckinSchedule(next_fire_at) WHERE enabled = 1;
 GO
 
 ------------------------------------------------------------
@@ -217,9 +251,26 @@ CREATE TABLE dbo.AuditLogs (
 );
 CREATE INDEX IX_AuditLogs_User_Ts ON dbo.AuditLogs(user_id, ts DESC);
 
+------------------------------------------------------------
+-- 9b) NotificationTemplates  (server/notification_templates.py)
+------------------------------------------------------------
+IF OBJECT_ID('dbo.NotificationTemplates','U') IS NOT NULL DROP TABLE dbo.NotificationTemplates;
+CREATE TABLE dbo.NotificationTemplates (
+    template_id     NVARCHAR(60)     NOT NULL CONSTRAINT PK_NotificationTemplates PRIMARY KEY,
+    title           NVARCHAR(200)    NOT NULL,
+    body            NVARCHAR(1000)   NOT NULL,   -- str.format placeholders, e.g. {slot}
+    updated_at      DATETIMEOFFSET   NOT NULL CONSTRAINT DF_NotificationTemplates_Updated DEFAULT SYSDATETIMEOFFSET()
+);
+INSERT INTO dbo.NotificationTemplates (template_id, title, body) VALUES
+    (N'checkin_reminder', N'Mendly check-in',                   N'Take 30 seconds to log your {slot} mood today.'),
+    (N'weekly_summary',   N'Your Mendly week',                  N'Your weekly mood summary is ready. Take a look at your journey.'),
+    (N'tip',              N'Mendly • A small positive moment',  N'Take one small positive pause with Mendly today.'),
+    (N'test_positive',    N'Mendly • Test positive message',    N'{body}');
+
 ------------------------------------------------------------
 -- 10) NotificationQueue
 ------------------------------------------------------------
+IF OBJECT_ID('dbo.NotificationDeliveries','U') IS NOT NULL DROP TABLE dbo.NotificationDeliveries;
 IF OBJECT_ID('dbo.NotificationQueue','U') IS NOT NULL DROP TABLE dbo.NotificationQueue;
 CREATE TABLE dbo.NotificationQueue (
     job_id          UNIQUEIDENTIFIER NOT NULL CONSTRAINT PK_NotificationQueue PRIMARY KEY DEFAULT NEWSEQUENTIALID(),
@@ -228,102 +279,195 @@ CREATE TABLE dbo.NotificationQueue (
     token_id        UNIQUEIDENTIFIER NULL
                       CONSTRAINT FK_NotificationQueue_Device FOREIGN KEY REFERENCES dbo.UserDeviceTokens(token_id) ON DELETE SET NULL,
     purpose         NVARCHAR(40)     NOT NULL CHECK (purpose IN (N'checkin_reminder',N'tip',N'weekly_summary')),
-    payload_json    NVARCHAR(MAX)    NOT NULL,
+    -- text comes from dbo.NotificationTemplates at send time;
+    -- payload_json only for rows written before templates
+    template_id     NVARCHAR(60)     NULL,
+    params_json     NVARCHAR(400)    NULL,
+    payload_json    NVARCHAR(MAX)    NULL,
     scheduled_at    DATETIMEOFFSET   NOT NULL,
     sent_at         DATETIMEOFFSET   NULL,
     status          NVARCHAR(20)     NOT NULL CONSTRAINT DF_NotificationQueue_Status DEFAULT (N'pending')
-                       CHECK (status IN (N'pending',N'sent',N'failed')),
-    error           NVARCHAR(500)    NULL
+                       CHECK (status IN (N'pending',N'sending',N'sent',N'coalesced',N'failed',N'dead',N'no_device',N'expired',N'capped')),
+    error           NVARCHAR(500)    NULL,
+    attempts        INT              NOT NULL CONSTRAINT DF_NotificationQueue_Attempts DEFAULT (0),
+    -- worker lease: status='sending' rows belong to claimed_by until lease_until
+    lease_until     DATETIMEOFFSET   NULL,
+    claimed_by      NVARCHAR(100)    NULL,
+    -- scheduled reminders: which slot / local day this job is for
+    slot            NVARCHAR(20)     NULL,
+    fire_date       DATE             NULL
 );
 CREATE INDEX IX_NotificationQueue_Status_Sched ON dbo.NotificationQueue(status, scheduled_at);
+-- per-purpose claims / TTL sweeps (notification_purposes registry)
+CREATE INDEX IX_NotificationQueue_Purpose_Status_Sched ON dbo.NotificationQueue(purpose, status, scheduled_at);
+-- per-user daily push cap (notification_policies.load_policies)
+CREATE INDEX IX_NotificationQueue_User_Sent
+    ON dbo.NotificationQueue(user_id, sent_at)
+    WHERE status = N'sent';
+-- one reminder per user, purpose, slot and local day
+CREATE UNIQUE INDEX UX_NotificationQueue_Fire
+    ON dbo.NotificationQueue(user_id, purpose, slot, fire_date)
+    WHERE fire_date IS NOT NULL;
+
+------------------------------------------------------------
+-- 10b) NotificationDeliveries  (per-device outcome of a job)
+------------------------------------------------------------
+-- token_id has no FK: tokens are deactivated, not deleted, and a second
+-- cascade path from Users is not allowed.
+CREATE TABLE dbo.NotificationDeliveries (
+    job_id          UNIQUEIDENTIFIER NOT NULL
+                      CONSTRAINT FK_NotificationDeliveries_Job FOREIGN KEY REFERENCES dbo.NotificationQueue(job_id) ON DELETE CASCADE,
+    token_id        UNIQUEIDENTIFIER NOT NULL,
+    status          NVARCHAR(20)     NOT NULL CHECK (status IN (N'sent',N'failed',N'invalid')),
+    error_code      NVARCHAR(40)     NULL,
+    message_id      NVARCHAR(200)    NULL,
+    attempted_at    DATETIMEOFFSET   NOT NULL CONSTRAINT DF_NotificationDeliveries_Attempted DEFAULT SYSDATETIMEOFFSET(),
+    CONSTRAINT PK_NotificationDeliveries PRIMARY KEY (job_id, token_id)
+);
+
+------------------------------------------------------------
+-- 10c) BroadcastQueue  (one FCM topic message per segment)
+------------------------------------------------------------
+IF OBJECT_ID('dbo.BroadcastQueue','U') IS NOT NULL DROP TABLE dbo.BroadcastQueue;
+CREATE TABLE dbo.BroadcastQueue (
+    broadcast_id    UNIQUEIDENTIFIER NOT NULL CONSTRAINT PK_BroadcastQueue PRIMARY KEY DEFAULT NEWSEQUENTIALID(),
+    topic           NVARCHAR(200)    NOT NULL,
+    purpose         NVARCHAR(40)     NOT NULL CHECK (purpose IN (N'tip')),
+    template_id     NVARCHAR(60)     NULL,
+    params_json     NVARCHAR(400)    NULL,
+    payload_json    NVARCHAR(MAX)    NULL,
+    scheduled_at    DATETIMEOFFSET   NOT NULL,
+    sent_at         DATETIMEOFFSET   NULL,
+    status          NVARCHAR(20)     NOT NULL CONSTRAINT DF_BroadcastQueue_Status DEFAULT (N'pending')
+                       CHECK (status IN (N'pending',N'sending',N'sent',N'dead',N'expired')),
+    error           NVARCHAR(500)    NULL,
+    message_id      NVARCHAR(200)    NULL,
+    attempts        INT              NOT NULL CONSTRAINT DF_BroadcastQueue_Attempts DEFAULT (0),
+    lease_until     DATETIMEOFFSET   NULL,
+    claimed_by      NVARCHAR(100)    NULL,
+    CONSTRAINT UQ_BroadcastQueue_Topic_Sched UNIQUE (topic, scheduled_at)
+);
+CREATE INDEX IX_BroadcastQueue_Status_Sched ON dbo.BroadcastQueue(status, scheduled_at);
 GO
 
 ------------------------------------------------------------
--- Stored procedure: enqueue daily check-in reminders
+-- 10d) Archive tables  (server/retention.py, RETENTION_MODE=archive)
 ------------------------------------------------------------
-CREATE OR ALTER PROCEDURE dbo.EnqueueDailyCheckinReminders
-    @slot_name NVARCHAR(20)   -- 'morning' / 'noon' / 'evening'
-AS
-BEGIN
-    SET NOCOUNT ON;
+-- filled with DELETE ... OUTPUT INTO, so no CHECK / FOREIGN KEY
+-- constraints and no triggers here
+IF OBJECT_ID('dbo.NotificationQueueArchive','U') IS NOT NULL DROP TABLE dbo.NotificationQueueArchive;
+CREATE TABLE dbo.NotificationQueueArchive (
+    job_id          UNIQUEIDENTIFIER NOT NULL CONSTRAINT PK_NotificationQueueArchive PRIMARY KEY NONCLUSTERED,
+    user_id         UNIQUEIDENTIFIER NOT NULL,
+    token_id        UNIQUEIDENTIFIER NULL,
+    purpose         NVARCHAR(40)     NOT NULL,
+    template_id     NVARCHAR(60)     NULL,
+    params_json     NVARCHAR(400)    NULL,
+    payload_json    NVARCHAR(MAX)    NULL,
+    scheduled_at    DATETIMEOFFSET   NOT NULL,
+    sent_at         DATETIMEOFFSET   NULL,
+    status          NVARCHAR(20)     NOT NULL,
+    error           NVARCHAR(500)    NULL,
+    attempts        INT              NOT NULL,
+    slot            NVARCHAR(20)     NULL,
+    fire_date       DATE             NULL,
+    archived_at     DATETIMEOFFSET   NOT NULL CONSTRAINT DF_NotificationQueueArchive_Archived DEFAULT SYSDATETIMEOFFSET()
+);
+CREATE CLUSTERED INDEX CX_NotificationQueueArchive_Sched ON dbo.NotificationQueueArchive(scheduled_at);
+CREATE INDEX IX_NotificationQueueArchive_User ON dbo.NotificationQueueArchive(user_id, scheduled_at);
+
+IF OBJECT_ID('dbo.NotificationDeliveriesArchive','U') IS NOT NULL DROP TABLE dbo.NotificationDeliveriesArchive;
+CREATE TABLE dbo.NotificationDeliveriesArchive (
+    job_id          UNIQUEIDENTIFIER NOT NULL,
+    token_id        UNIQUEIDENTIFIER NOT NULL,
+    status          NVARCHAR(20)     NOT NULL,
+    error_code      NVARCHAR(40)     NULL,
+    message_id      NVARCHAR(200)    NULL,
+    attempted_at    DATETIMEOFFSET   NOT NULL,
+    CONSTRAINT PK_NotificationDeliveriesArchive PRIMARY KEY (job_id, token_id)
+);
 
-    DECLARE @now   DATETIMEOFFSET = SYSDATETIMEOFFSET();
-    DECLARE @today DATE           = CONVERT(date, @now);
+IF OBJECT_ID('dbo.BroadcastQueueArchive','U') IS NOT NULL DROP TABLE dbo.BroadcastQueueArchive;
+CREATE TABLE dbo.BroadcastQueueArchive (
+    broadcast_id    UNIQUEIDENTIFIER NOT NULL CONSTRAINT PK_BroadcastQueueArchive PRIMARY KEY,
+    topic           NVARCHAR(200)    NOT NULL,
+    purpose         NVARCHAR(40)     NOT NULL,
+    template_id     NVARCHAR(60)     NULL,
+    params_json     NVARCHAR(400)    NULL,
+    payload_json    NVARCHAR(MAX)    NULL,
+    scheduled_at    DATETIMEOFFSET   NOT NULL,
+    sent_at         DATETIMEOFFSET   NULL,
+    status          NVARCHAR(20)     NOT NULL,
+    error           NVARCHAR(500)    NULL,
+    message_id      NVARCHAR(200)    NULL,
+    attempts        INT              NOT NULL,
+    archived_at     DATETIMEOFFSET   NOT NULL CONSTRAINT DF_BroadcastQueueArchive_Archived DEFAULT SYSDATETIMEOFFSET()
+);
 
-    INSERT INTO dbo.NotificationQueue (
-          user_id,
-          token_id,
-          purpose,
-          payload_json,
-          scheduled_at,
-          status
-    )
-    SELECT
-        cs.user_id,
-        NULL,  
-        N'checkin_reminder',
-        N'{
-            "slot": "' + @slot_name + N'",
-            "title": "Mendly check-in",
-            "body":  "Take 30 seconds to log your ' + @slot_name + N' mood today."
-          }',
-        @now,
-        N'pending'
-    FROM dbo.CheckinSchedule cs
-    WHERE cs.enabled   = 1
-      AND cs.slot_name = @slot_name
-      -- avoid duplicate reminders for same user/slot/date
-      AND NOT EXISTS (
-            SELECT 1
-            FROM dbo.NotificationQueue q
-            WHERE q.user_id  = cs.user_id
-              AND q.purpose  = N'checkin_reminder'
-              AND CONVERT(date, q.scheduled_at) = @today
-              AND q.payload_json LIKE '%"slot":"' + @slot_name + '"%'
-      );
-END
+IF OBJECT_ID('dbo.AuditLogsArchive','U') IS NOT NULL DROP TABLE dbo.AuditLogsArchive;
+CREATE TABLE dbo.AuditLogsArchive (
+    audit_id    BIGINT           NOT NULL CONSTRAINT PK_AuditLogsArchive PRIMARY KEY,
+    user_id     UNIQUEIDENTIFIER NULL,
+    actor       NVARCHAR(40)     NOT NULL,
+    action      NVARCHAR(80)     NOT NULL,
+    resource    NVARCHAR(120)    NULL,
+    ts          DATETIMEOFFSET   NOT NULL,
+    archived_at DATETIMEOFFSET   NOT NULL CONSTRAINT DF_AuditLogsArchive_Archived DEFAULT SYSDATETIMEOFFSET()
+);
 GO
 
 ------------------------------------------------------------
--- NEW: Stored procedure: enqueue positive notifications (tips)
--- One "tip" per user per day, for users with positive_notif_enabled = 1
+-- 10e) EmailOutbox  (sent by server/email_outbox.py)
 ------------------------------------------------------------
-CREATE OR ALTER PROCEDURE dbo.EnqueuePositiveNotifications
-AS
-BEGIN
-    SET NOCOUNT ON;
+IF OBJECT_ID('dbo.EmailOutbox','U') IS NOT NULL DROP TABLE dbo.EmailOutbox;
+CREATE TABLE dbo.EmailOutbox (
+    email_id        UNIQUEIDENTIFIER NOT NULL CONSTRAINT PK_EmailOutbox PRIMARY KEY DEFAULT NEWSEQUENTIALID(),
+    to_email        NVARCHAR(255)    NOT NULL,
+    subject         NVARCHAR(300)    NOT NULL,
+    -- blanked once the row is sent / dead / expired
+    body            NVARCHAR(MAX)    NOT NULL,
+    status          NVARCHAR(20)     NOT NULL CONSTRAINT DF_EmailOutbox_Status DEFAULT (N'pending')
+                       CHECK (status IN (N'pending',N'sending',N'sent',N'dead',N'expired')),
+    attempts        INT              NOT NULL CONSTRAINT DF_EmailOutbox_Attempts DEFAULT (0),
+    -- next attempt (pushed out on retries)
+    scheduled_at    DATETIMEOFFSET   NOT NULL CONSTRAINT DF_EmailOutbox_Sched DEFAULT SYSDATETIMEOFFSET(),
+    -- not sent after this -> 'expired' (password reset codes)
+    expires_at      DATETIMEOFFSET   NULL,
+    created_at      DATETIMEOFFSET   NOT NULL CONSTRAINT DF_EmailOutbox_Created DEFAULT SYSDATETIMEOFFSET(),
+    sent_at         DATETIMEOFFSET   NULL,
+    error           NVARCHAR(500)    NULL,
+    lease_until     DATETIMEOFFSET   NULL,
+    claimed_by      NVARCHAR(100)    NULL
+);
+CREATE INDEX IX_EmailOutbox_Status_Sched ON dbo.EmailOutbox(status, scheduled_at);
+GO
 
-    DECLARE @now   DATETIMEOFFSET = SYSDATETIMEOFFSET();
-    DECLARE @today DATE           = CONVERT(date, @now);
+------------------------------------------------------------
+-- 10f) NotificationWake  (one row; bumped when another process enqueues
+--      a job that is due now, polled by server/notification_worker.py)
+------------------------------------------------------------
+IF OBJECT_ID('dbo.NotificationWake','U') IS NOT NULL DROP TABLE dbo.NotificationWake;
+CREATE TABLE dbo.NotificationWake (
+    wake_id         TINYINT          NOT NULL CONSTRAINT PK_NotificationWake PRIMARY KEY
+                       CONSTRAINT CK_NotificationWake_Single CHECK (wake_id = 1),
+    seq             BIGINT           NOT NULL CONSTRAINT DF_NotificationWake_Seq DEFAULT (0),
+    bumped_at       DATETIMEOFFSET   NOT NULL CONSTRAINT DF_NotificationWake_Bumped DEFAULT SYSDATETIMEOFFSET()
+);
+INSERT INTO dbo.NotificationWake (wake_id) VALUES (1);
+GO
 
-    INSERT INTO dbo.NotificationQueue (
-          user_id,
-          token_id,
-          purpose,
-          payload_json,
-          scheduled_at,
-          status
-    )
-    SELECT
-        s.user_id,
-        NULL,  
-        N'tip',
-        N'{
-            "title": "Mendly \u2022 A small positive moment",
-            "body":  "Take one small positive pause with Mendly today."
-          }',
-        @now,
-        N'pending'
-    FROM dbo.UserSettings s
-    WHERE s.positive_notif_enabled = 1
-      AND NOT EXISTS (
-            SELECT 1
-            FROM dbo.NotificationQueue q
-            WHERE q.user_id = s.user_id
-              AND q.purpose = N'tip'
-              AND CONVERT(date, q.scheduled_at) = @today
-      );
-END
+------------------------------------------------------------
+-- Daily check-in reminders are enqueued by server/checkin_scheduler.py
+-- (timezone-aware, deduped by UX_NotificationQueue_Fire).
+------------------------------------------------------------
+DROP PROCEDURE IF EXISTS dbo.EnqueueDailyCheckinReminders;
+GO
+
+------------------------------------------------------------
+-- Positive notifications (tips) are enqueued by server/tip_scheduler.py
+-- every positive_notif_interval_minutes (UserSettings.next_positive_at).
+------------------------------------------------------------
+DROP PROCEDURE IF EXISTS dbo.EnqueuePositiveNotifications;
 GO
 
 ------------------------------------------------------------
@@ -398,13 +542,20 @@ CREATE TABLE dbo.AIInteractions (
                       CONSTRAINT FK_AIInteractions_Users FOREIGN KEY REFERENCES dbo.Users(user_id),
     mood_id         UNIQUEIDENTIFIER NULL
                       CONSTRAINT FK_AIInteractions_MoodEntries FOREIGN KEY REFERENCES dbo.MoodEntries(mood_id) ON DELETE SET NULL,
-    purpose         NVARCHAR(40)     NOT NULL CHECK (purpose IN (N'recommendation',N'summary')),
+    purpose         NVARCHAR(40)     NOT NULL CHECK (purpose IN (N'recommendation',N'summary',N'chat')),
     prompt_hash     VARBINARY(32)    NULL,  -- بدلاً من تخزين نص الحسّاس
     input_refs_json NVARCHAR(MAX)    NULL,  -- IDs بدل نصوص
     output_text     NVARCHAR(MAX)    NOT NULL,
-    created_at      DATETIMEOFFSET   NOT NULL CONSTRAINT DF_AIInteractions_Created DEFAULT SYSDATETIMEOFFSET()
+    created_at      DATETIMEOFFSET   NOT NULL CONSTRAINT DF_AIInteractions_Created DEFAULT SYSDATETIMEOFFSET(),
+    -- purpose = 'chat': one row per conversation turn (server-held chat history)
+    conversation_id UNIQUEIDENTIFIER NULL,
+    turn_no         INT              NULL,
+    role            NVARCHAR(20)     NULL CHECK (role IS NULL OR role IN (N'user',N'assistant'))
 );
 CREATE INDEX IX_AIInteractions_User_Time ON dbo.AIInteractions(user_id, created_at DESC);
+CREATE UNIQUE INDEX UX_AIInteractions_Conversation_Turn
+    ON dbo.AIInteractions(conversation_id, turn_no)
+    WHERE conversation_id IS NOT NULL;
 GO
 
 ------------------------------------------------------------
@@ -0,0 +1,346 @@
+/* ===== Schema upgrade: Mendly Core ===== */
+-- Brings a database created by an older mendly_schema.sql up to date
+-- without dropping anything. Every statement is guarded (COL_LENGTH /
+-- OBJECT_ID / sys.indexes), so the script can run on every start:
+-- server/init_db.py applies it when the schema already exists
+-- (INIT_DB_MODE=missing). Keep it in step with mendly_schema.sql.
+
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+
+------------------------------------------------------------
+-- 2) UserSettings: timezone, tip schedule, quiet hours / daily cap
+------------------------------------------------------------
+IF COL_LENGTH('dbo.UserSettings','timezone') IS NULL
+    ALTER TABLE dbo.UserSettings ADD timezone NVARCHAR(64) NULL;
+IF COL_LENGTH('dbo.UserSettings','next_positive_at') IS NULL
+    ALTER TABLE dbo.UserSettings ADD next_positive_at DATETIMEOFFSET NULL;
+IF COL_LENGTH('dbo.UserSettings','quiet_start_hour') IS NULL
+    ALTER TABLE dbo.UserSettings ADD quiet_start_hour TINYINT NULL
+        CONSTRAINT CK_UserSettings_QuietStart CHECK (quiet_start_hour < 24);
+IF COL_LENGTH('dbo.UserSettings','quiet_end_hour') IS NULL
+    ALTER TABLE dbo.UserSettings ADD quiet_end_hour TINYINT NULL
+        CONSTRAINT CK_UserSettings_QuietEnd CHECK (quiet_end_hour < 24);
+IF COL_LENGTH('dbo.UserSettings','max_pushes_per_day') IS NULL
+    ALTER TABLE dbo.UserSettings ADD max_pushes_per_day TINYINT NULL;
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_UserSettings_NextPositive' AND object_id = OBJECT_ID('dbo.UserSettings'))
+    CREATE INDEX IX_UserSettings_NextPositive
+        ON dbo.UserSettings(next_positive_at)
+        INCLUDE (positive_notif_interval_minutes)
+        WHERE positive_notif_enabled = 1;
+GO
+
+------------------------------------------------------------
+-- 3) UserDeviceTokens: language, tip topic subscription and its backoff
+------------------------------------------------------------
+IF COL_LENGTH('dbo.UserDeviceTokens','language') IS NULL
+    ALTER TABLE dbo.UserDeviceTokens ADD language NVARCHAR(10) NULL;
+IF COL_LENGTH('dbo.UserDeviceTokens','tip_topic') IS NULL
+    ALTER TABLE dbo.UserDeviceTokens ADD tip_topic NVARCHAR(200) NULL;
+IF COL_LENGTH('dbo.UserDeviceTokens','tip_sync_failures') IS NULL
+    ALTER TABLE dbo.UserDeviceTokens ADD tip_sync_failures TINYINT NOT NULL
+        CONSTRAINT DF_UserDeviceTokens_TipSyncFailures DEFAULT (0);
+IF COL_LENGTH('dbo.UserDeviceTokens','tip_sync_retry_at') IS NULL
+    ALTER TABLE dbo.UserDeviceTokens ADD tip_sync_retry_at DATETIMEOFFSET NULL;
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_UserDeviceTokens_Active_LastSeen' AND object_id = OBJECT_ID('dbo.UserDeviceTokens'))
+    CREATE INDEX IX_UserDeviceTokens_Active_LastSeen ON dbo.UserDeviceTokens(last_seen) WHERE is_active = 1;
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_UserDeviceTokens_TipTopic' AND object_id = OBJECT_ID('dbo.UserDeviceTokens'))
+    CREATE INDEX IX_UserDeviceTokens_TipTopic ON dbo.UserDeviceTokens(tip_topic) WHERE is_active = 1 AND tip_topic IS NOT NULL;
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_UserDeviceTokens_TipSyncRetry' AND object_id = OBJECT_ID('dbo.UserDeviceTokens'))
+    CREATE INDEX IX_UserDeviceTokens_TipSyncRetry ON dbo.UserDeviceTokens(tip_sync_retry_at) WHERE is_active = 1 AND tip_sync_retry_at IS NOT NULL;
+GO
+
+------------------------------------------------------------
+-- 4) CheckinSchedule: next fire time (checkin_scheduler.py)
+------------------------------------------------------------
+IF COL_LENGTH('dbo.CheckinSchedule','next_fire_at') IS NULL
+    ALTER TABLE dbo.CheckinSchedule ADD next_fire_at DATETIMEOFFSET NULL;
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_CheckinSchedule_NextFire' AND object_id = OBJECT_ID('dbo.CheckinSchedule'))
+    CREATE INDEX IX_CheckinSchedule_NextFire ON dbo.CheckinSchedule(next_fire_at) WHERE enabled = 1;
+GO
+
+------------------------------------------------------------
+-- 9b) NotificationTemplates
+------------------------------------------------------------
+IF OBJECT_ID('dbo.NotificationTemplates','U') IS NULL
+    CREATE TABLE dbo.NotificationTemplates (
+        template_id     NVARCHAR(60)     NOT NULL CONSTRAINT PK_NotificationTemplates PRIMARY KEY,
+        title           NVARCHAR(200)    NOT NULL,
+        body            NVARCHAR(1000)   NOT NULL,   -- str.format placeholders, e.g. {slot}
+        updated_at      DATETIMEOFFSET   NOT NULL CONSTRAINT DF_NotificationTemplates_Updated DEFAULT SYSDATETIMEOFFSET()
+    );
+GO
+-- seed rows only where missing: edited templates are kept
+INSERT INTO dbo.NotificationTemplates (template_id, title, body)
+SELECT v.template_id, v.title, v.body
+FROM (VALUES
+    (N'checkin_reminder', N'Mendly check-in',                   N'Take 30 seconds to log your {slot} mood today.'),
+    (N'weekly_summary',   N'Your Mendly week',                  N'Your weekly mood summary is ready. Take a look at your journey.'),
+    (N'tip',              N'Mendly • A small positive moment',  N'Take one small positive pause with Mendly today.'),
+    (N'test_positive',    N'Mendly • Test positive message',    N'{body}')
+) v (template_id, title, body)
+WHERE NOT EXISTS (SELECT 1 FROM dbo.NotificationTemplates t WHERE t.template_id = v.template_id);
+GO
+
+------------------------------------------------------------
+-- 10) NotificationQueue: templates, leases, retries, reminder dedupe
+------------------------------------------------------------
+IF COL_LENGTH('dbo.NotificationQueue','template_id') IS NULL
+    ALTER TABLE dbo.NotificationQueue ADD template_id NVARCHAR(60) NULL;
+IF COL_LENGTH('dbo.NotificationQueue','params_json') IS NULL
+    ALTER TABLE dbo.NotificationQueue ADD params_json NVARCHAR(400) NULL;
+IF COL_LENGTH('dbo.NotificationQueue','attempts') IS NULL
+    ALTER TABLE dbo.NotificationQueue ADD attempts INT NOT NULL
+        CONSTRAINT DF_NotificationQueue_Attempts DEFAULT (0);
+IF COL_LENGTH('dbo.NotificationQueue','lease_until') IS NULL
+    ALTER TABLE dbo.NotificationQueue ADD lease_until DATETIMEOFFSET NULL;
+IF COL_LENGTH('dbo.NotificationQueue','claimed_by') IS NULL
+    ALTER TABLE dbo.NotificationQueue ADD claimed_by NVARCHAR(100) NULL;
+IF COL_LENGTH('dbo.NotificationQueue','slot') IS NULL
+    ALTER TABLE dbo.NotificationQueue ADD slot NVARCHAR(20) NULL;
+IF COL_LENGTH('dbo.NotificationQueue','fire_date') IS NULL
+    ALTER TABLE dbo.NotificationQueue ADD fire_date DATE NULL;
+-- templated rows carry no payload
+IF EXISTS (SELECT 1 FROM sys.columns
+           WHERE object_id = OBJECT_ID('dbo.NotificationQueue') AND name = 'payload_json' AND is_nullable = 0)
+    ALTER TABLE dbo.NotificationQueue ALTER COLUMN payload_json NVARCHAR(MAX) NULL;
+GO
+-- older status CHECKs (pending / sent / failed, then no 'capped') are swapped
+-- for the current list; the inline CHECK has a generated name, so look it up
+DECLARE @ck SYSNAME = (
+    SELECT TOP (1) cc.name
+    FROM sys.check_constraints cc
+    JOIN sys.columns c ON c.object_id = cc.parent_object_id AND c.column_id = cc.parent_column_id
+    WHERE cc.parent_object_id = OBJECT_ID('dbo.NotificationQueue')
+      AND c.name = 'status'
+      AND cc.definition NOT LIKE '%capped%'
+);
+IF @ck IS NOT NULL
+BEGIN
+    EXEC (N'ALTER TABLE dbo.NotificationQueue DROP CONSTRAINT ' + QUOTENAME(@ck));
+    ALTER TABLE dbo.NotificationQueue ADD CONSTRAINT CK_NotificationQueue_Status
+        CHECK (status IN (N'pending',N'sending',N'sent',N'coalesced',N'failed',N'dead',N'no_device',N'expired',N'capped'));
+END
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_NotificationQueue_Purpose_Status_Sched' AND object_id = OBJECT_ID('dbo.NotificationQueue'))
+    CREATE INDEX IX_NotificationQueue_Purpose_Status_Sched ON dbo.NotificationQueue(purpose, status, scheduled_at);
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_NotificationQueue_User_Sent' AND object_id = OBJECT_ID('dbo.NotificationQueue'))
+    CREATE INDEX IX_NotificationQueue_User_Sent
+        ON dbo.NotificationQueue(user_id, sent_at)
+        WHERE status = N'sent';
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_NotificationQueue_Fire' AND object_id = OBJECT_ID('dbo.NotificationQueue'))
+    CREATE UNIQUE INDEX UX_NotificationQueue_Fire
+        ON dbo.NotificationQueue(user_id, purpose, slot, fire_date)
+        WHERE fire_date IS NOT NULL;
+GO
+
+------------------------------------------------------------
+-- 10b) NotificationDeliveries
+------------------------------------------------------------
+IF OBJECT_ID('dbo.NotificationDeliveries','U') IS NULL
+    CREATE TABLE dbo.NotificationDeliveries (
+        job_id          UNIQUEIDENTIFIER NOT NULL
+                          CONSTRAINT FK_NotificationDeliveries_Job FOREIGN KEY REFERENCES dbo.NotificationQueue(job_id) ON DELETE CASCADE,
+        token_id        UNIQUEIDENTIFIER NOT NULL,
+        status          NVARCHAR(20)     NOT NULL CHECK (status IN (N'sent',N'failed',N'invalid')),
+        error_code      NVARCHAR(40)     NULL,
+        message_id      NVARCHAR(200)    NULL,
+        attempted_at    DATETIMEOFFSET   NOT NULL CONSTRAINT DF_NotificationDeliveries_Attempted DEFAULT SYSDATETIMEOFFSET(),
+        CONSTRAINT PK_NotificationDeliveries PRIMARY KEY (job_id, token_id)
+    );
+GO
+
+------------------------------------------------------------
+-- 10c) BroadcastQueue
+------------------------------------------------------------
+IF OBJECT_ID('dbo.BroadcastQueue','U') IS NULL
+BEGIN
+    CREATE TABLE dbo.BroadcastQueue (
+        broadcast_id    UNIQUEIDENTIFIER NOT NULL CONSTRAINT PK_BroadcastQueue PRIMARY KEY DEFAULT NEWSEQUENTIALID(),
+        topic           NVARCHAR(200)    NOT NULL,
+        purpose         NVARCHAR(40)     NOT NULL CHECK (purpose IN (N'tip')),
+        template_id     NVARCHAR(60)     NULL,
+        params_json     NVARCHAR(400)    NULL,
+        payload_json    NVARCHAR(MAX)    NULL,
+        scheduled_at    DATETIMEOFFSET   NOT NULL,
+        sent_at         DATETIMEOFFSET   NULL,
+        status          NVARCHAR(20)     NOT NULL CONSTRAINT DF_BroadcastQueue_Status DEFAULT (N'pending')
+                           CHECK (status IN (N'pending',N'sending',N'sent',N'dead',N'expired')),
+        error           NVARCHAR(500)    NULL,
+        message_id      NVARCHAR(200)    NULL,
+        attempts        INT              NOT NULL CONSTRAINT DF_BroadcastQueue_Attempts DEFAULT (0),
+        lease_until     DATETIMEOFFSET   NULL,
+        claimed_by      NVARCHAR(100)    NULL,
+        CONSTRAINT UQ_BroadcastQueue_Topic_Sched UNIQUE (topic, scheduled_at)
+    );
+    CREATE INDEX IX_BroadcastQueue_Status_Sched ON dbo.BroadcastQueue(status, scheduled_at);
+END
+GO
+
+------------------------------------------------------------
+-- 10d) Archive tables
+------------------------------------------------------------
+IF OBJECT_ID('dbo.NotificationQueueArchive','U') IS NULL
+BEGIN
+    CREATE TABLE dbo.NotificationQueueArchive (
+        job_id          UNIQUEIDENTIFIER NOT NULL CONSTRAINT PK_NotificationQueueArchive PRIMARY KEY NONCLUSTERED,
+        user_id         UNIQUEIDENTIFIER NOT NULL,
+        token_id        UNIQUEIDENTIFIER NULL,
+        purpose         NVARCHAR(40)     NOT NULL,
+        template_id     NVARCHAR(60)     NULL,
+        params_json     NVARCHAR(400)    NULL,
+        payload_json    NVARCHAR(MAX)    NULL,
+        scheduled_at    DATETIMEOFFSET   NOT NULL,
+        sent_at         DATETIMEOFFSET   NULL,
+        status          NVARCHAR(20)     NOT NULL,
+        error           NVARCHAR(500)    NULL,
+        attempts        INT              NOT NULL,
+        slot            NVARCHAR(20)     NULL,
+        fire_date       DATE             NULL,
+        archived_at     DATETIMEOFFSET   NOT NULL CONSTRAINT DF_NotificationQueueArchive_Archived DEFAULT SYSDATETIMEOFFSET()
+    );
+    CREATE CLUSTERED INDEX CX_NotificationQueueArchive_Sched ON dbo.NotificationQueueArchive(scheduled_at);
+    CREATE INDEX IX_NotificationQueueArchive_User ON dbo.NotificationQueueArchive(user_id, scheduled_at);
+END
+
+IF OBJECT_ID('dbo.NotificationDeliveriesArchive','U') IS NULL
+    CREATE TABLE dbo.NotificationDeliveriesArchive (
+        job_id          UNIQUEIDENTIFIER NOT NULL,
+        token_id        UNIQUEIDENTIFIER NOT NULL,
+        status          NVARCHAR(20)     NOT NULL,
+        error_code      NVARCHAR(40)     NULL,
+        message_id      NVARCHAR(200)    NULL,
+        attempted_at    DATETIMEOFFSET   NOT NULL,
+        CONSTRAINT PK_NotificationDeliveriesArchive PRIMARY KEY (job_id, token_id)
+    );
+
+IF OBJECT_ID('dbo.BroadcastQueueArchive','U') IS NULL
+    CREATE TABLE dbo.BroadcastQueueArchive (
+        broadcast_id    UNIQUEIDENTIFIER NOT NULL CONSTRAINT PK_BroadcastQueueArchive PRIMARY KEY,
+        topic           NVARCHAR(200)    NOT NULL,
+        purpose         NVARCHAR(40)     NOT NULL,
+        template_id     NVARCHAR(60)     NULL,
+        params_json     NVARCHAR(400)    NULL,
+        payload_json    NVARCHAR(MAX)    NULL,
+        scheduled_at    DATETIMEOFFSET   NOT NULL,
+        sent_at         DATETIMEOFFSET   NULL,
+        status          NVARCHAR(20)     NOT NULL,
+        error           NVARCHAR(500)    NULL,
+        message_id      NVARCHAR(200)    NULL,
+        attempts        INT              NOT NULL,
+        archived_at     DATETIMEOFFSET   NOT NULL CONSTRAINT DF_BroadcastQueueArchive_Archived DEFAULT SYSDATETIMEOFFSET()
+    );
+
+IF OBJECT_ID('dbo.AuditLogsArchive','U') IS NULL
+    CREATE TABLE dbo.AuditLogsArchive (
+        audit_id    BIGINT           NOT NULL CONSTRAINT PK_AuditLogsArchive PRIMARY KEY,
+        user_id     UNIQUEIDENTIFIER NULL,
+        actor       NVARCHAR(40)     NOT NULL,
+        action      NVARCHAR(80)     NOT NULL,
+        resource    NVARCHAR(120)    NULL,
+        ts          DATETIMEOFFSET   NOT NULL,
+        archived_at DATETIMEOFFSET   NOT NULL CONSTRAINT DF_AuditLogsArchive_Archived DEFAULT SYSDATETIMEOFFSET()
+    );
+GO
+
+------------------------------------------------------------
+-- 10e) EmailOutbox
+------------------------------------------------------------
+IF OBJECT_ID('dbo.EmailOutbox','U') IS NULL
+BEGIN
+    CREATE TABLE dbo.EmailOutbox (
+        email_id        UNIQUEIDENTIFIER NOT NULL CONSTRAINT PK_EmailOutbox PRIMARY KEY DEFAULT NEWSEQUENTIALID(),
+        to_email        NVARCHAR(255)    NOT NULL,
+        subject         NVARCHAR(300)    NOT NULL,
+        body            NVARCHAR(MAX)    NOT NULL,
+        status          NVARCHAR(20)     NOT NULL CONSTRAINT DF_EmailOutbox_Status DEFAULT (N'pending')
+                           CHECK (status IN (N'pending',N'sending',N'sent',N'dead',N'expired')),
+        attempts        INT              NOT NULL CONSTRAINT DF_EmailOutbox_Attempts DEFAULT (0),
+        scheduled_at    DATETIMEOFFSET   NOT NULL CONSTRAINT DF_EmailOutbox_Sched DEFAULT SYSDATETIMEOFFSET(),
+        expires_at      DATETIMEOFFSET   NULL,
+        created_at      DATETIMEOFFSET   NOT NULL CONSTRAINT DF_EmailOutbox_Created DEFAULT SYSDATETIMEOFFSET(),
+        sent_at         DATETIMEOFFSET   NULL,
+        error           NVARCHAR(500)    NULL,
+        lease_until     DATETIMEOFFSET   NULL,
+        claimed_by      NVARCHAR(100)    NULL
+    );
+    CREATE INDEX IX_EmailOutbox_Status_Sched ON dbo.EmailOutbox(status, scheduled_at);
+END
+GO
+-- outboxes created before reset emails could expire
+IF COL_LENGTH('dbo.EmailOutbox','expires_at') IS NULL
+    ALTER TABLE dbo.EmailOutbox ADD expires_at DATETIMEOFFSET NULL;
+GO
+DECLARE @ck SYSNAME = (
+    SELECT TOP (1) cc.name
+    FROM sys.check_constraints cc
+    JOIN sys.columns c ON c.object_id = cc.parent_object_id AND c.column_id = cc.parent_column_id
+    WHERE cc.parent_object_id = OBJECT_ID('dbo.EmailOutbox')
+      AND c.name = 'status'
+      AND cc.definition NOT LIKE '%expired%'
+);
+IF @ck IS NOT NULL
+BEGIN
+    EXEC (N'ALTER TABLE dbo.EmailOutbox DROP CONSTRAINT ' + QUOTENAME(@ck));
+    ALTER TABLE dbo.EmailOutbox ADD CONSTRAINT CK_EmailOutbox_Status
+        CHECK (status IN (N'pending',N'sending',N'sent',N'dead',N'expired'));
+END
+GO
+
+------------------------------------------------------------
+-- 10f) NotificationWake
+------------------------------------------------------------
+IF OBJECT_ID('dbo.NotificationWake','U') IS NULL
+    CREATE TABLE dbo.NotificationWake (
+        wake_id         TINYINT          NOT NULL CONSTRAINT PK_NotificationWake PRIMARY KEY
+                           CONSTRAINT CK_NotificationWake_Single CHECK (wake_id = 1),
+        seq             BIGINT           NOT NULL CONSTRAINT DF_NotificationWake_Seq DEFAULT (0),
+        bumped_at       DATETIMEOFFSET   NOT NULL CONSTRAINT DF_NotificationWake_Bumped DEFAULT SYSDATETIMEOFFSET()
+    );
+GO
+IF NOT EXISTS (SELECT 1 FROM dbo.NotificationWake WHERE wake_id = 1)
+    INSERT INTO dbo.NotificationWake (wake_id) VALUES (1);
+GO
+
+------------------------------------------------------------
+-- Replaced by checkin_scheduler.py / tip_scheduler.py
+------------------------------------------------------------
+DROP PROCEDURE IF EXISTS dbo.EnqueueDailyCheckinReminders;
+DROP PROCEDURE IF EXISTS dbo.EnqueuePositiveNotifications;
+GO
+
+------------------------------------------------------------
+-- 15) AIInteractions: server-held chat turns
+------------------------------------------------------------
+IF COL_LENGTH('dbo.AIInteractions','conversation_id') IS NULL
+    ALTER TABLE dbo.AIInteractions ADD conversation_id UNIQUEIDENTIFIER NULL;
+IF COL_LENGTH('dbo.AIInteractions','turn_no') IS NULL
+    ALTER TABLE dbo.AIInteractions ADD turn_no INT NULL;
+IF COL_LENGTH('dbo.AIInteractions','role') IS NULL
+    ALTER TABLE dbo.AIInteractions ADD role NVARCHAR(20) NULL
+        CONSTRAINT CK_AIInteractions_Role CHECK (role IS NULL OR role IN (N'user',N'assistant'));
+GO
+-- the original purpose CHECK had no 'chat'
+DECLARE @ck SYSNAME = (
+    SELECT TOP (1) cc.name
+    FROM sys.check_constraints cc
+    JOIN sys.columns c ON c.object_id = cc.parent_object_id AND c.column_id = cc.parent_column_id
+    WHERE cc.parent_object_id = OBJECT_ID('dbo.AIInteractions')
+      AND c.name = 'purpose'
+      AND cc.definition NOT LIKE '%chat%'
+);
+IF @ck IS NOT NULL
+BEGIN
+    EXEC (N'ALTER TABLE dbo.AIInteractions DROP CONSTRAINT ' + QUOTENAME(@ck));
+    ALTER TABLE dbo.AIInteractions ADD CONSTRAINT CK_AIInteractions_Purpose
+        CHECK (purpose IN (N'recommendation',N'summary',N'chat'));
+END
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_AIInteractions_Conversation_Turn' AND object_id = OBJECT_ID('dbo.AIInteractions'))
+    CREATE UNIQUE INDEX UX_AIInteractions_Conversation_Turn
+        ON dbo.AIInteractions(conversation_id, turn_no)
+        WHERE conversation_id IS NOT NULL;
+GO
@@ -4,9 +4,11 @@ from sqlalchemy import (
     Column,
     String,
     Integer,
+    BigInteger,
     SmallInteger,
     DateTime,
     Boolean,
+    Date,
     DateTime,
     DateTime,
     DateTime,
@@ -61,6 +63,10 @@ class UserDeviceToken(Base):
         server_default=func.sysdatetimeoffset(),
     )
     is_active = Column(Boolean, nullable=False, server_default=text("1"))
+    language = Column(String(10))
+    tip_topic = Column(String(200))  # FCM topic for broadcast tips
+    tip_sync_failures = Column(SmallInteger, nullable=False, server_default=text("0"))
+    tip_sync_retry_at = Column(DateTime(timezone=True))
 
 
 class NotificationQueue(Base):
@@ -74,8 +80,95 @@ class NotificationQueue(Base):
     user_id = Column(UNIQUEIDENTIFIER, nullable=False)
     token_id = Column(UNIQUEIDENTIFIER)  # optional, we may leave NULL
     purpose = Column(String(40), nullable=False)  # 'checkin_reminder', etc.
-    payload_json = Column(Text, nullable=False)
+    template_id = Column(String(60))  # dbo.NotificationTemplates
+    params_json = Column(String(400))
+    payload_json = Column(Text)  # legacy rows only
     scheduled_at = Column(DateTime(timezone=True), nullable=False)
     sent_at = Column(DateTime(timezone=True))
     status = Column(String(20), nullable=False, server_default=text("N'pending'"))
-    error = Column(String(500))
\ No newline at end of file
+    error = Column(String(500))
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+    lease_until = Column(DateTime(timezone=True))
+    claimed_by = Column(String(100))
+    slot = Column(String(20))  # scheduled reminders only
+    fire_date = Column(Date)
+
+
+class NotificationDelivery(Base):
+    __tablename__ = "NotificationDeliveries"
+
+    job_id = Column(UNIQUEIDENTIFIER, primary_key=True)
+    token_id = Column(UNIQUEIDENTIFIER, primary_key=True)
+    status = Column(String(20), nullable=False)  # 'sent' / 'failed' / 'invalid'
+    error_code = Column(String(40))
+    message_id = Column(String(200))
+    attempted_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.sysdatetimeoffset(),
+    )
+
+
+class BroadcastQueue(Base):
+    __tablename__ = "BroadcastQueue"
+
+    broadcast_id = Column(
+        UNIQUEIDENTIFIER,
+        primary_key=True,
+        server_default=text("NEWSEQUENTIALID()"),
+    )
+    topic = Column(String(200), nullable=False)
+    purpose = Column(String(40), nullable=False)  # 'tip'
+    template_id = Column(String(60))
+    params_json = Column(String(400))
+    payload_json = Column(Text)
+    scheduled_at = Column(DateTime(timezone=True), nullable=False)
+    sent_at = Column(DateTime(timezone=True))
+    status = Column(String(20), nullable=False, server_default=text("N'pending'"))
+    error = Column(String(500))
+    message_id = Column(String(200))
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+    lease_until = Column(DateTime(timezone=True))
+    claimed_by = Column(String(100))
+
+
+class EmailOutbox(Base):
+    __tablename__ = "EmailOutbox"
+
+    email_id = Column(
+        UNIQUEIDENTIFIER,
+        primary_key=True,
+        server_default=text("NEWSEQUENTIALID()"),
+    )
+    to_email = Column(String(255), nullable=False)
+    subject = Column(String(300), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, server_default=text("N'pending'"))
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+    scheduled_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.sysdatetimeoffset(),
+    )
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.sysdatetimeoffset(),
+    )
+    expires_at = Column(DateTime(timezone=True))
+    sent_at = Column(DateTime(timezone=True))
+    error = Column(String(500))
+    lease_until = Column(DateTime(timezone=True))
+    claimed_by = Column(String(100))
+
+
+class NotificationWake(Base):
+    __tablename__ = "NotificationWake"
+
+    wake_id = Column(SmallInteger, primary_key=True)  # always 1
+    seq = Column(BigInteger, nullable=False, server_default=text("0"))
+    bumped_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.sysdatetimeoffset(),
+    )
@@ -0,0 +1,173 @@
+# server/mood_snapshots.py
+import os
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from .db import SessionLocal
+
+log = logging.getLogger("mendly.mood_snapshots")
+
+# One snapshot per user per window: messages inside the window only
+# replace the pending snapshot (its note already holds the last ~10
+# user messages), they never add a new MoodEntries row.
+SNAPSHOT_WINDOW_SEC = int(os.getenv("AI_SNAPSHOT_WINDOW_SEC", "300"))
+SNAPSHOT_FLUSH_INTERVAL_SEC = float(os.getenv("AI_SNAPSHOT_FLUSH_INTERVAL_SEC", "5"))
+SNAPSHOT_BATCH_SIZE = int(os.getenv("AI_SNAPSHOT_BATCH_SIZE", "200"))
+
+
+@dataclass
+class PendingSnapshot:
+    user_id: str
+    score: int
+    label: str
+    note: str
+    captured_at: datetime
+    first_seen: datetime
+
+
+class MoodSnapshotBuffer:
+    """
+    In-memory, per-user coalescing buffer for AI chat mood snapshots.
+
+    The chat routes call submit() (a dict write under a lock), and a
+    background thread flushes snapshots whose window has elapsed with
+    one executemany INSERT per batch. Chat latency therefore never
+    depends on DB write latency.
+    """
+
+    def __init__(
+        self,
+        window_seconds: int = SNAPSHOT_WINDOW_SEC,
+        flush_interval: float = SNAPSHOT_FLUSH_INTERVAL_SEC,
+        batch_size: int = SNAPSHOT_BATCH_SIZE,
+    ) -> None:
+        self.window_seconds = window_seconds
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._pending: Dict[str, PendingSnapshot] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.submitted = 0
+        self.written = 0
+
+    # ---------- producer side ----------
+
+    def submit(self, user_id: str, score: int, label: str, note: str) -> None:
+        if not note:
+            return
+
+        now = datetime.now(timezone.utc)
+        key = str(user_id)
+        with self._lock:
+            prev = self._pending.get(key)
+            self._pending[key] = PendingSnapshot(
+                user_id=key,
+                score=score,
+                label=label,
+                note=note,
+                captured_at=now,
+                first_seen=prev.first_seen if prev else now,
+            )
+            self.submitted += 1
+
+        self._ensure_started()
+
+    # ---------- consumer side ----------
+
+    def _take_due(self, force: bool = False) -> List[PendingSnapshot]:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            due_keys = [
+                k
+                for k, snap in self._pending.items()
+                if force or (now - snap.first_seen).total_seconds() >= self.window_seconds
+            ]
+            return [self._pending.pop(k) for k in due_keys]
+
+    def _write(self, snaps: List[PendingSnapshot]) -> None:
+        for i in range(0, len(snaps), self.batch_size):
+            batch = snaps[i : i + self.batch_size]
+            try:
+                with SessionLocal() as db:
+                    db.execute(
+                        text(
+                            """
+                            INSERT INTO dbo.MoodEntries
+                                (user_id, checkin_slot, score, label,
+                                 text_note_encrypted, emojis_json,
+                                 captured_at, created_at)
+                            VALUES
+                                (:uid, NULL, :score, :label,
+                                 CONVERT(VARBINARY(MAX), :note), NULL,
+                                 :captured_at, SYSDATETIMEOFFSET())
+                            """
+                        ),
+                        [
+                            {
+                                "uid": s.user_id,
+                                "score": s.score,
+                                "label": s.label,
+                                "note": s.note,
+                                "captured_at": s.captured_at,
+                            }
+                            for s in batch
+                        ],
+                    )
+                    db.commit()
+                self.written += len(batch)
+            except Exception as e:
+                # Snapshots are best-effort; drop the batch rather than
+                # retrying forever against a broken DB.
+                log.warning("Failed to write %s mood snapshots: %r", len(batch), e)
+
+    def flush(self, force: bool = False) -> int:
+        snaps = self._take_due(force=force)
+        if snaps:
+            self._write(snaps)
+        return len(snaps)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception("Error in mood snapshot flusher: %r", e)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="mood-snapshot-flusher", daemon=True
+            )
+            self._thread.start()
+            log.info(
+                "[mood_snapshots] flusher started (window=%ss, interval=%ss)",
+                self.window_seconds,
+                self.flush_interval,
+            )
+
+    def stop(self) -> None:
+        """
+        Stop the flusher and write everything still pending.
+        Called from main.lifespan on shutdown.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        n = self.flush(force=True)
+        if n:
+            log.info("[mood_snapshots] flushed %s pending snapshots on shutdown", n)
+
+
+snapshot_buffer = MoodSnapshotBuffer()
@@ -0,0 +1,339 @@
+# server/notification_loadtest.py
+# End-to-end load test for the notification worker against the local FCM
+# stand-in (server/fake_fcm.py). Needs a scratch Mendly database:
+#
+#     python -m server.notification_loadtest --jobs 20000 --users 10000 \
+#         --latency-ms 40 --error-rate 0.01 --unregistered-rate 0.002
+#
+# --purpose takes a comma-separated list, assigned round-robin to the
+# jobs. Rate-limited purposes need their own run: a tip backlog larger
+# than NOTIF_TIP_RATE has to drain at the limiter's pace instead of
+# stalling until the next resync, e.g.
+#
+#     python -m server.notification_loadtest --jobs 5000 --purpose tip
+#     python -m server.notification_loadtest --jobs 5000 --purpose checkin_reminder,tip
+#
+# Seeds throwaway users (with quiet hours and the daily cap switched off),
+# their devices and N pending jobs spread over --spread-sec, runs the
+# worker loop in-process until every seeded job has left pending/sending,
+# then reports:
+#   - drain rate (jobs/sec from first due time to the last job settled)
+#   - scheduled_at -> sent_at lag percentiles (p50/p95/p99)
+#   - DB load: statements and time spent in the DB driver by the worker
+#   - job statuses and the stand-in's counters
+# Seeded rows are deleted afterwards unless --keep.
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event, text
+
+from .db import SessionLocal, engine
+from .fake_fcm import add_fake_args, fake_from_args, start_fake_fcm
+from .firebase_client import HttpTransport, set_transport
+from . import notification_worker as worker
+from .notification_purposes import get_purpose, purpose_names
+
+log = logging.getLogger("mendly.notification_loadtest")
+
+SEED_CHUNK_SIZE = 1000
+
+
+class DbLoad:
+    """
+    Statement count and driver time, from SQLAlchemy engine events.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.statements = 0
+        self.seconds = 0.0
+        self.enabled = False
+
+    def install(self) -> None:
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def ignore_thread(self, ignored: bool = True) -> None:
+        # the harness's own progress queries are not worker load
+        self._local.ignored = ignored
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self._local.t0 = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if not self.enabled or getattr(self._local, "ignored", False):
+            return
+        dt = time.perf_counter() - getattr(self._local, "t0", time.perf_counter())
+        with self._lock:
+            self.statements += 1
+            self.seconds += dt
+
+
+db_load = DbLoad()
+
+
+def _chunks(rows: List[Dict[str, Any]], n: int = SEED_CHUNK_SIZE):
+    for i in range(0, len(rows), n):
+        yield rows[i : i + n]
+
+
+def seed(run_id: str, jobs: int, users: int, devices_per_user: int, purposes: List[str], spread_sec: int) -> List[str]:
+    """
+    Insert users, settings, devices and pending jobs. Returns the user ids.
+    """
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    user_rows = [
+        {"user_id": uid, "name": f"loadtest-{run_id}-{i}", "email": f"loadtest-{run_id}-{i}@example.invalid"}
+        for i, uid in enumerate(user_ids)
+    ]
+    device_rows = [
+        {"user_id": uid, "token": f"lt-{run_id}-{i}-{d}", "platform": "android" if d % 2 == 0 else "ios"}
+        for i, uid in enumerate(user_ids)
+        for d in range(devices_per_user)
+    ]
+    start = datetime.now(timezone.utc)
+    job_rows = [
+        {
+            "user_id": user_ids[i % users],
+            "purpose": purposes[i % len(purposes)],
+            "scheduled_at": (start + timedelta(seconds=spread_sec * i / max(1, jobs))).isoformat(),
+        }
+        for i in range(jobs)
+    ]
+
+    with SessionLocal() as db:
+        for part in _chunks(user_rows):
+            db.execute(
+                text(
+                    """
+                    INSERT INTO dbo.Users (user_id, Username, Password, Email)
+                    SELECT u.user_id, u.name, N'!loadtest', u.email
+                    FROM OPENJSON(:rows) WITH (
+                            user_id UNIQUEIDENTIFIER '$.user_id',
+                            name    NVARCHAR(120)    '$.name',
+                            email   NVARCHAR(255)    '$.email'
+                         ) u;
+
+                    INSERT INTO dbo.UserSettings
+                        (user_id, positive_notif_enabled, quiet_start_hour, quiet_end_hour, max_pushes_per_day)
+                    SELECT u.user_id, 0, 0, 0, 0
+                    FROM OPENJSON(:rows) WITH (user_id UNIQUEIDENTIFIER '$.user_id') u;
+                    """
+                ),
+                {"rows": json.dumps(part)},
+            )
+        for part in _chunks(device_rows):
+            db.execute(
+                text(
+                    """
+                    INSERT INTO dbo.UserDeviceTokens (user_id, platform, fcm_token, is_active)
+                    SELECT d.user_id, d.platform, d.token, 1
+                    FROM OPENJSON(:rows) WITH (
+                            user_id  UNIQUEIDENTIFIER '$.user_id',
+                            platform NVARCHAR(20)     '$.platform',
+                            token    NVARCHAR(512)    '$.token'
+                         ) d
+                    """
+                ),
+                {"rows": json.dumps(part)},
+            )
+        for part in _chunks(job_rows):
+            db.execute(
+                text(
+                    """
+                    INSERT INTO dbo.NotificationQueue
+                        (user_id, token_id, purpose, template_id, params_json, scheduled_at, status)
+                    SELECT j.user_id, NULL, j.purpose, N'test_positive', N'{"body":"load test"}',
+                           j.scheduled_at, N'pending'
+                    FROM OPENJSON(:rows) WITH (
+                            user_id      UNIQUEIDENTIFIER '$.user_id',
+                            purpose      NVARCHAR(40)     '$.purpose',
+                            scheduled_at DATETIMEOFFSET   '$.scheduled_at'
+                         ) j
+                    """
+                ),
+                {"rows": json.dumps(part)},
+            )
+        db.commit()
+    return user_ids
+
+
+def _open_jobs(user_ids: List[str]) -> int:
+    # runs on the shared to_thread pool: only ignore this call's statements
+    db_load.ignore_thread()
+    try:
+        with SessionLocal() as db:
+            return int(
+                db.execute(
+                    text(
+                        """
+                        SELECT COUNT(*)
+                        FROM dbo.NotificationQueue q
+                        JOIN OPENJSON(:users) WITH (user_id UNIQUEIDENTIFIER '$') u
+                          ON u.user_id = q.user_id
+                        WHERE q.status IN (N'pending', N'sending')
+                        """
+                    ),
+                    {"users": json.dumps(user_ids)},
+                ).scalar()
+                or 0
+            )
+    finally:
+        db_load.ignore_thread(False)
+
+
+def collect(user_ids: List[str]) -> Dict[str, Any]:
+    """
+    Status counts and scheduled_at -> sent_at lag percentiles (ms).
+    """
+    with SessionLocal() as db:
+        rows = db.execute(
+            text(
+                """
+                SELECT q.status,
+                       DATEDIFF_BIG(MILLISECOND, q.scheduled_at, q.sent_at) AS lag_ms
+                FROM dbo.NotificationQueue q
+                JOIN OPENJSON(:users) WITH (user_id UNIQUEIDENTIFIER '$') u
+                  ON u.user_id = q.user_id
+                """
+            ),
+            {"users": json.dumps(user_ids)},
+        ).fetchall()
+    statuses = Counter(r.status for r in rows)
+    lags = sorted(int(r.lag_ms) for r in rows if r.status in ("sent", "coalesced") and r.lag_ms is not None)
+
+    def pct(p: float) -> Optional[int]:
+        if not lags:
+            return None
+        return lags[min(len(lags) - 1, int(round(p / 100.0 * (len(lags) - 1))))]
+
+    return {
+        "statuses": dict(statuses),
+        "lag_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99), "max": lags[-1] if lags else None},
+    }
+
+
+def cleanup(user_ids: List[str]) -> None:
+    with SessionLocal() as db:
+        for part in _chunks([{"user_id": u} for u in user_ids]):
+            # deliveries cascade from the queue; devices and settings from Users
+            db.execute(
+                text(
+                    """
+                    DELETE q FROM dbo.NotificationQueue q
+                    JOIN OPENJSON(:rows) WITH (user_id UNIQUEIDENTIFIER '$.user_id') u
+                      ON u.user_id = q.user_id;
+
+                    DELETE us FROM dbo.Users us
+                    JOIN OPENJSON(:rows) WITH (user_id UNIQUEIDENTIFIER '$.user_id') u
+                      ON u.user_id = us.user_id;
+                    """
+                ),
+                {"rows": json.dumps(part)},
+            )
+        db.commit()
+
+
+async def _drain(user_ids: List[str], timeout: float, poll: float, resync: int) -> float:
+    """
+    Run the worker until no seeded job is open. Returns the seconds it took.
+    """
+    task = asyncio.create_task(worker.notification_loop(resync))
+    t0 = time.perf_counter()
+    try:
+        while time.perf_counter() - t0 < timeout:
+            await asyncio.sleep(poll)
+            if await asyncio.to_thread(_open_jobs, user_ids) == 0:
+                break
+        else:
+            log.warning("Timed out after %ss with jobs still open", timeout)
+        return time.perf_counter() - t0
+    finally:
+        worker.stop_worker()
+        await task
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Notification worker load test")
+    parser.add_argument("--jobs", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=None, help="default: one user per job")
+    parser.add_argument("--devices-per-user", type=int, default=1)
+    parser.add_argument(
+        "--purpose",
+        default="checkin_reminder",
+        help=f"comma-separated, round-robin over the jobs; one of {', '.join(purpose_names())}",
+    )
+    parser.add_argument("--spread-sec", type=int, default=0, help="scheduled_at spread over now..now+N")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--poll", type=float, default=0.5, help="progress check interval")
+    parser.add_argument("--resync", type=int, default=worker.POLL_INTERVAL_SECONDS)
+    parser.add_argument("--fake-port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded rows")
+    add_fake_args(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    users = max(1, args.users or args.jobs)
+    run_id = uuid.uuid4().hex[:8]
+    purposes = [p.strip() for p in args.purpose.split(",") if p.strip()]
+    unknown = [p for p in purposes if get_purpose(p) is None]
+    if not purposes or unknown:
+        parser.error(f"unknown --purpose {', '.join(unknown) or args.purpose!r}")
+
+    fake = fake_from_args(args)
+    server = start_fake_fcm(fake, args.fake_port)
+    set_transport(HttpTransport(f"http://127.0.0.1:{server.server_address[1]}"))
+
+    load = db_load
+    load.install()
+
+    t_seed = time.perf_counter()
+    user_ids = seed(run_id, args.jobs, users, max(1, args.devices_per_user), purposes, args.spread_sec)
+    seed_sec = time.perf_counter() - t_seed
+
+    try:
+        fake.reset()
+        load.enabled = True
+        elapsed = asyncio.run(_drain(user_ids, args.timeout, args.poll, args.resync))
+        load.enabled = False
+
+        report = collect(user_ids)
+        # jobs only become due over the spread, so it is not drain time
+        drain_sec = max(elapsed - args.spread_sec, 1e-9)
+        report.update(
+            {
+                "run_id": run_id,
+                "jobs": args.jobs,
+                "users": users,
+                "purposes": {p: {"rate_per_sec": get_purpose(p).rate_per_sec} for p in purposes},
+                "seed_sec": round(seed_sec, 2),
+                "elapsed_sec": round(elapsed, 2),
+                "drain_jobs_per_sec": round(args.jobs / drain_sec, 1),
+                "db": {
+                    "statements": load.statements,
+                    "driver_sec": round(load.seconds, 2),
+                    "statements_per_job": round(load.statements / max(1, args.jobs), 3),
+                },
+                "fcm": fake.stats(),
+                "worker_last_batch": dict(worker.last_batch_stats),
+            }
+        )
+        print(json.dumps(report, indent=2, default=str))
+    finally:
+        set_transport(None)
+        server.shutdown()
+        if not args.keep:
+            cleanup(user_ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# server/notification_metrics.py
+# In-process metrics for the notification worker plus a tiny JSON
+# endpoint (stdlib http.server, so the worker process needs no ASGI app).
+#
+#     GET /metrics  -> queue depth, due-but-unsent lag, sends/sec and
+#                      error rate by purpose
+#     GET /healthz  -> {"ok": true, "draining": ...}
+#
+# No authentication: it binds to NOTIF_METRICS_HOST (default 127.0.0.1).
+# Only expose it beyond localhost (0.0.0.0) inside a private network.
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from .db import SessionLocal
+
+log = logging.getLogger("mendly.notifications.metrics")
+
+# sends/sec is averaged over this window
+RATE_WINDOW_SECONDS = 60
+METRICS_HOST = os.getenv("NOTIF_METRICS_HOST", "127.0.0.1")
+
+
+class WorkerMetrics:
+    """
+    Thread-safe counters fed by the worker after every batch.
+    """
+
+    def __init__(self, window: int = RATE_WINDOW_SECONDS) -> None:
+        self.window = window
+        self.started_at = time.time()
+        self.draining = False
+        self._lock = threading.Lock()
+        # purpose -> status -> count (since start)
+        self._by_purpose: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        # (timestamp, device messages sent ok)
+        self._sends: Deque[Tuple[float, int]] = deque()
+        self.batches = 0
+        self.last_batch: Dict[str, float] = {}
+
+    def record_batch(self, outcomes: Dict[Tuple[str, str], int], sent_ok: int, stats: Dict[str, float]) -> None:
+        """
+        outcomes: {(purpose, job_status): count}; sent_ok: device messages
+        FCM accepted in this batch.
+        """
+        now = time.time()
+        with self._lock:
+            for (purpose, status), n in outcomes.items():
+                self._by_purpose[purpose][status] += n
+            if sent_ok:
+                self._sends.append((now, sent_ok))
+            self._trim(now)
+            self.batches += 1
+            self.last_batch = dict(stats)
+
+    def record(self, outcomes: Dict[Tuple[str, str], int]) -> None:
+        """
+        Outcomes that happen outside a send batch (e.g. TTL expiry).
+        """
+        with self._lock:
+            for (purpose, status), n in outcomes.items():
+                self._by_purpose[purpose][status] += n
+
+    def _trim(self, now: float) -> None:
+        while self._sends and self._sends[0][0] < now - self.window:
+            self._sends.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            self._trim(now)
+            by_purpose = {}
+            for purpose, counts in self._by_purpose.items():
+                total = sum(counts.values())
+                # retries and dead letters are errors; no_device is not
+                errors = counts.get("pending", 0) + counts.get("dead", 0)
+                by_purpose[purpose] = {
+                    **counts,
+                    "error_rate": round(errors / total, 4) if total else 0.0,
+                }
+            return {
+                "uptime_sec": round(now - self.started_at, 1),
+                "draining": self.draining,
+                "batches": self.batches,
+                "sends_per_sec": round(sum(n for _, n in self._sends) / self.window, 2),
+                "by_purpose": by_purpose,
+                "last_batch": self.last_batch,
+            }
+
+
+metrics = WorkerMetrics()
+
+
+def queue_snapshot() -> Dict[str, Any]:
+    """
+    Queue depth per purpose and the lag of the oldest due, unsent job.
+    """
+    with SessionLocal() as db:
+        rows = db.execute(
+            text(
+                """
+                SELECT purpose,
+                       COUNT(*) AS depth,
+                       SUM(CASE WHEN scheduled_at <= SYSDATETIMEOFFSET() THEN 1 ELSE 0 END) AS due,
+                       DATEDIFF(SECOND,
+                                MIN(CASE WHEN scheduled_at <= SYSDATETIMEOFFSET() THEN scheduled_at END),
+                                SYSDATETIMEOFFSET()) AS due_lag_sec
+                FROM dbo.NotificationQueue WITH (READPAST)
+                WHERE status IN (N'pending', N'sending')
+                GROUP BY purpose
+                """
+            )
+        ).fetchall()
+    return {
+        r.purpose: {
+            "depth": int(r.depth),
+            "due": int(r.due or 0),
+            "due_lag_sec": int(r.due_lag_sec) if r.due_lag_sec is not None else 0,
+        }
+        for r in rows
+    }
+
+
+def _handler(collect: Callable[[], Dict[str, Any]]):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802
+            if self.path.startswith("/healthz"):
+                body = {"ok": True, "draining": metrics.draining}
+            elif self.path.startswith("/metrics"):
+                try:
+                    body = collect()
+                except Exception:
+                    # details go to the log, not to whoever can reach the port
+                    log.exception("Failed to collect notification metrics")
+                    self._send(500, {"ok": False, "error": "metrics unavailable"})
+                    return
+            else:
+                self._send(404, {"ok": False})
+                return
+            self._send(200, body)
+
+        def _send(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return MetricsHandler
+
+
+def collect_metrics() -> Dict[str, Any]:
+    snap = metrics.snapshot()
+    snap["queue"] = queue_snapshot()
+    return snap
+
+
+def start_metrics_server(port: int, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve /metrics and /healthz from a daemon thread. port <= 0 disables it.
+    """
+    if port <= 0:
+        return None
+    server = ThreadingHTTPServer((host, port), _handler(collect_metrics))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="notif-metrics", daemon=True).start()
+    log.info("[notifications] metrics on http://%s:%s/metrics", host, port)
+    return server
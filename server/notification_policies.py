@@ -0,0 +1,124 @@
+# server/notification_policies.py
+# Per-user delivery policy for the notification worker.
+#
+#   - quiet hours (opt-in): no pushes between quiet_start_hour and
+#     quiet_end_hour in the user's local time (UserSettings.timezone); jobs
+#     claimed inside the window are pushed back to its end, or expire when
+#     that is past their purpose's TTL
+#   - daily cap: at most max_pushes_per_day pushes per rolling 24 hours;
+#     a coalesced push counts once
+#
+# Both are loaded for a whole batch of users with one query. NULL settings
+# fall back to NOTIF_QUIET_START_HOUR / NOTIF_QUIET_END_HOUR (unset: no
+# quiet hours) and NOTIF_MAX_PUSHES_PER_DAY; equal start and end hours
+# disable quiet hours and a cap <= 0 disables the cap.
+#
+# Test pushes the user asked for (POLICY_EXEMPT_TEMPLATES) bypass both and
+# are never merged. Topic broadcasts (TIP_DELIVERY=topic) reach a whole
+# segment with one message and cannot honour per-user settings, so users
+# with their own quiet hours or cap get their tips as direct pushes
+# instead (tip_topics.own_policy_sql).
+import os
+import json
+from datetime import datetime, timedelta, tzinfo
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+
+from .utils.timezones import user_zone
+
+
+def _env_hour(name: str) -> Optional[int]:
+    value = (os.getenv(name) or "").strip()
+    return int(value) % 24 if value else None
+
+
+QUIET_START_HOUR = _env_hour("NOTIF_QUIET_START_HOUR")
+QUIET_END_HOUR = _env_hour("NOTIF_QUIET_END_HOUR")
+MAX_PUSHES_PER_DAY = int(os.getenv("NOTIF_MAX_PUSHES_PER_DAY", "8"))
+# user-triggered pushes: sent right away, not counted against the cap
+POLICY_EXEMPT_TEMPLATES = ("test_positive",)
+
+
+class UserPolicy(NamedTuple):
+    tz: tzinfo
+    quiet_start: Optional[int]  # None: no quiet hours
+    quiet_end: Optional[int]
+    daily_cap: int
+    sent_recent: int  # pushes sent in the last 24 hours
+
+
+DEFAULT_POLICY = UserPolicy(user_zone(None), QUIET_START_HOUR, QUIET_END_HOUR, MAX_PUSHES_PER_DAY, 0)
+
+
+def load_policies(db, user_ids: Iterable[str]) -> Dict[str, UserPolicy]:
+    """
+    Policy for every user of a batch, keyed by lower-case user_id.
+    Users without a UserSettings row get the defaults.
+    """
+    ids = sorted({str(u).lower() for u in user_ids})
+    if not ids:
+        return {}
+    rows = db.execute(
+        text(
+            """
+            SELECT u.user_id, s.timezone, s.quiet_start_hour, s.quiet_end_hour,
+                   s.max_pushes_per_day,
+                   (SELECT COUNT(*)
+                    FROM dbo.NotificationQueue q
+                    WHERE q.user_id = u.user_id
+                      AND q.status = N'sent'
+                      AND ISNULL(q.template_id, N'') NOT IN :exempt
+                      AND q.sent_at >= DATEADD(HOUR, -24, SYSDATETIMEOFFSET())) AS sent_recent
+            FROM OPENJSON(:users) WITH (user_id UNIQUEIDENTIFIER '$') u
+            LEFT JOIN dbo.UserSettings s ON s.user_id = u.user_id
+            """
+        ).bindparams(bindparam("exempt", expanding=True)),
+        {"users": json.dumps(ids), "exempt": list(POLICY_EXEMPT_TEMPLATES)},
+    ).fetchall()
+    return {
+        str(r.user_id).lower(): UserPolicy(
+            user_zone(r.timezone),
+            *_quiet_hours(r.quiet_start_hour, r.quiet_end_hour),
+            MAX_PUSHES_PER_DAY if r.max_pushes_per_day is None else int(r.max_pushes_per_day),
+            int(r.sent_recent or 0),
+        )
+        for r in rows
+    }
+
+
+def _quiet_hours(start, end) -> Tuple[Optional[int], Optional[int]]:
+    # the user's own window only counts when both ends are set
+    if start is None or end is None:
+        return QUIET_START_HOUR, QUIET_END_HOUR
+    return int(start), int(end)
+
+
+def exempt_from_policy(job) -> bool:
+    return job.template_id in POLICY_EXEMPT_TEMPLATES
+
+
+def quiet_until(policy: UserPolicy, now: datetime) -> Optional[datetime]:
+    """
+    End of the quiet window `now` falls into, None outside quiet hours.
+    The window may wrap midnight (22 -> 8).
+    """
+    if policy.quiet_start is None or policy.quiet_end is None:
+        return None
+    start, end = policy.quiet_start % 24, policy.quiet_end % 24
+    if start == end:
+        return None
+    local = now.astimezone(policy.tz)
+    hour = local.hour
+    inside = start <= hour < end if start < end else (hour >= start or hour < end)
+    if not inside:
+        return None
+    end_at = local.replace(hour=end, minute=0, second=0, microsecond=0)
+    if end_at <= local:
+        # wall-clock arithmetic: still the end hour across a DST change
+        end_at += timedelta(days=1)
+    return end_at
+
+
+def over_cap(policy: UserPolicy) -> bool:
+    return policy.daily_cap > 0 and policy.sent_recent >= policy.daily_cap
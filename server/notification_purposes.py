@@ -0,0 +1,146 @@
+# server/notification_purposes.py
+# Purpose registry for the notification worker.
+#
+# Every dbo.NotificationQueue.purpose the worker sends is registered here
+# with how to build its push and how to schedule it:
+#   - priority:   lower claims first (check-in reminders before tips)
+#   - batch_size: max jobs of this purpose per worker cycle
+#   - rate_per_sec: jobs/sec claimed per worker process (0 = unlimited)
+#   - ttl_seconds: jobs pending longer than this past scheduled_at are
+#                  expired instead of sent late
+#
+# Limits can be tuned per purpose from the environment, e.g.
+#     NOTIF_TIP_RATE=50  NOTIF_TIP_TTL_SEC=1800  NOTIF_TIP_BATCH=200
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .notification_templates import catalog, template_params
+
+# job -> (title, body, data)
+RenderFn = Callable[[Any], Tuple[str, str, Dict[str, str]]]
+
+
+def render_payload(job: Any) -> Tuple[str, str, Dict[str, str]]:
+    """
+    Default handler: render template_id + params_json from the catalog;
+    rows written before templates fall back to their payload_json text.
+    """
+    data = {"purpose": job.purpose}
+    template_id = getattr(job, "template_id", None)
+    if template_id:
+        rendered = catalog.render(template_id, template_params(job.params_json))
+        if rendered is not None:
+            return rendered[0], rendered[1], data
+
+    try:
+        payload = json.loads(job.payload_json or "{}")
+    except Exception:
+        payload = {}
+    return (
+        payload.get("title", "Mendly"),
+        payload.get("body", "You have a new notification"),
+        data,
+    )
+
+
+class RateLimiter:
+    """
+    Token bucket (thread-safe). capacity = one second of budget.
+    """
+
+    def __init__(self, rate_per_sec: float) -> None:
+        self.rate = float(rate_per_sec)
+        self.capacity = max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def take(self, want: int) -> int:
+        """
+        Take up to `want` tokens; returns how many were granted.
+        """
+        if self.rate <= 0:
+            return want
+        with self._lock:
+            self._refill()
+            granted = min(want, int(self._tokens))
+            self._tokens -= granted
+            return granted
+
+    def give_back(self, n: int) -> None:
+        if self.rate <= 0 or n <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + n)
+
+    def seconds_until_available(self, n: int = 1) -> float:
+        """
+        Seconds until `n` tokens (at most the bucket's capacity) can be taken.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            need = min(float(max(1, n)), self.capacity)
+            return 0.0 if self._tokens >= need else (need - self._tokens) / self.rate
+
+
+def _env_num(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    return float(raw) if raw not in (None, "") else default
+
+
+@dataclass
+class PurposeConfig:
+    name: str
+    priority: int = 100
+    batch_size: int = 500
+    rate_per_sec: float = 0.0
+    ttl_seconds: Optional[int] = None
+    render: RenderFn = render_payload
+
+    def __post_init__(self) -> None:
+        key = f"NOTIF_{self.name.upper()}"
+        self.batch_size = max(1, int(_env_num(f"{key}_BATCH", self.batch_size)))
+        self.rate_per_sec = _env_num(f"{key}_RATE", self.rate_per_sec)
+        ttl = _env_num(f"{key}_TTL_SEC", self.ttl_seconds or 0)
+        self.ttl_seconds = int(ttl) if ttl > 0 else None
+        self.limiter = RateLimiter(self.rate_per_sec)
+
+
+_registry: Dict[str, PurposeConfig] = {}
+
+
+def register_purpose(config: PurposeConfig) -> PurposeConfig:
+    _registry[config.name] = config
+    return config
+
+
+def get_purpose(name: str) -> Optional[PurposeConfig]:
+    return _registry.get(name)
+
+
+def purposes_by_priority() -> List[PurposeConfig]:
+    return sorted(_registry.values(), key=lambda c: (c.priority, c.name))
+
+
+def purpose_names() -> List[str]:
+    return [c.name for c in purposes_by_priority()]
+
+
+# ---------- built-in purposes ----------
+
+# a reminder for "this morning" is useless by the afternoon
+register_purpose(PurposeConfig("checkin_reminder", priority=0, ttl_seconds=2 * 3600))
+register_purpose(PurposeConfig("weekly_summary", priority=1, ttl_seconds=2 * 86400))
+# nice-to-have: lowest lane, throttled, short TTL
+register_purpose(PurposeConfig("tip", priority=2, batch_size=200, rate_per_sec=100, ttl_seconds=1800))
@@ -0,0 +1,138 @@
+# server/notification_templates.py
+# Notification template catalog.
+#
+# Queue rows (NotificationQueue / BroadcastQueue) carry only template_id and
+# a small params_json map instead of the full title/body text; the worker
+# renders the text at send time. Templates live in dbo.NotificationTemplates
+# (editable without a deploy), are precompiled once and cached in memory for
+# NOTIF_TEMPLATE_CACHE_SEC. BUILTIN_TEMPLATES cover a missing/empty table.
+#
+# Placeholders use str.format syntax: "Log your {slot} mood".
+import os
+import json
+import time
+import string
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import text
+
+from .db import SessionLocal
+
+log = logging.getLogger("mendly.notification_templates")
+
+TEMPLATE_CACHE_SECONDS = int(os.getenv("NOTIF_TEMPLATE_CACHE_SEC", "300"))
+# NotificationQueue / BroadcastQueue params_json is NVARCHAR(400)
+PARAMS_JSON_MAX_LENGTH = 400
+
+# template_id -> (title, body); mirrors the seed rows in mendly_schema.sql
+BUILTIN_TEMPLATES: Dict[str, Tuple[str, str]] = {
+    "checkin_reminder": ("Mendly check-in", "Take 30 seconds to log your {slot} mood today."),
+    "weekly_summary": ("Your Mendly week", "Your weekly mood summary is ready. Take a look at your journey."),
+    "tip": ("Mendly • A small positive moment", "Take one small positive pause with Mendly today."),
+    "test_positive": ("Mendly • Test positive message", "{body}"),
+}
+
+_formatter = string.Formatter()
+
+
+class CompiledTemplate:
+    """
+    A template split once into literal text and field names, so rendering
+    is a join over a short list (no parsing per message). Missing params
+    render as empty text; param values are never parsed as templates.
+    """
+
+    __slots__ = ("parts",)
+
+    def __init__(self, source: str) -> None:
+        parts: List[Union[str, Tuple[str]]] = []
+        for literal, field, _spec, _conv in _formatter.parse(source or ""):
+            if literal:
+                parts.append(literal)
+            if field is not None:
+                parts.append((field,))
+        self.parts = parts
+
+    def render(self, params: Dict[str, Any]) -> str:
+        return "".join(
+            p if isinstance(p, str) else str(params.get(p[0], "")) for p in self.parts
+        )
+
+
+class TemplateCatalog:
+    def __init__(self, ttl_seconds: int = TEMPLATE_CACHE_SECONDS) -> None:
+        self.ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = 0.0
+        self._templates: Dict[str, Tuple[CompiledTemplate, CompiledTemplate]] = self._compile(
+            BUILTIN_TEMPLATES
+        )
+
+    @staticmethod
+    def _compile(raw: Dict[str, Tuple[str, str]]) -> Dict[str, Tuple[CompiledTemplate, CompiledTemplate]]:
+        return {tid: (CompiledTemplate(t), CompiledTemplate(b)) for tid, (t, b) in raw.items()}
+
+    def refresh(self) -> None:
+        rows = []
+        try:
+            with SessionLocal() as db:
+                rows = db.execute(
+                    text("SELECT template_id, title, body FROM dbo.NotificationTemplates")
+                ).fetchall()
+        except Exception as e:
+            log.warning("Failed to load notification templates, keeping cached ones: %r", e)
+        raw = dict(BUILTIN_TEMPLATES)
+        raw.update({r.template_id: (r.title, r.body) for r in rows})
+        compiled = self._compile(raw)
+        with self._lock:
+            self._templates = compiled
+            self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self) -> None:
+        """
+        Reload from the DB when the cache is older than the TTL. Blocking:
+        call it from a worker thread, never from the event loop.
+        """
+        if time.monotonic() - self._loaded_at >= self.ttl:
+            self.refresh()
+
+    def render(self, template_id: str, params: Optional[Dict[str, Any]] = None) -> Optional[Tuple[str, str]]:
+        """
+        (title, body), or None for an unknown template_id.
+        """
+        with self._lock:
+            tpl = self._templates.get(template_id)
+        if tpl is None:
+            return None
+        params = params or {}
+        return tpl[0].render(params), tpl[1].render(params)
+
+
+catalog = TemplateCatalog()
+
+
+def template_params(params_json: Optional[str]) -> Dict[str, Any]:
+    if not params_json:
+        return {}
+    try:
+        params = json.loads(params_json)
+    except Exception:
+        return {}
+    return params if isinstance(params, dict) else {}
+
+
+def dump_params(params: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Compact params_json for a queue row (None when there is nothing to store).
+    """
+    return json.dumps(params, separators=(",", ":"), ensure_ascii=False) if params else None
+
+
+def params_fit(params_json: Optional[str]) -> bool:
+    """
+    Whether params_json fits the column. NVARCHAR counts UTF-16 code
+    units, so an emoji takes two.
+    """
+    return params_json is None or len(params_json.encode("utf-16-le")) // 2 <= PARAMS_JSON_MAX_LENGTH
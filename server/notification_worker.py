@@ -1,154 +1,1155 @@
 # server/notification_worker.py
+import argparse
 import asyncio
+import heapq
 import json
 import logging
-from datetime import datetime, timezone
+import os
+import random
+import signal
+import socket
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from .db import SessionLocal
-from .firebase_client import send_push_to_token
+from .device_tokens import deactivate_tokens, release_tip_topics, sweep_stale_tokens
+from .firebase_client import PushMessage, SendResult, send_push_batch, send_push_topic
+from .notification_metrics import METRICS_HOST, metrics, start_metrics_server
+from .notification_policies import (
+    DEFAULT_POLICY,
+    UserPolicy,
+    exempt_from_policy,
+    load_policies,
+    over_cap,
+    quiet_until,
+)
+from .notification_purposes import PurposeConfig, get_purpose, purpose_names, purposes_by_priority
+from .notification_templates import catalog as templates
 
 log = logging.getLogger("mendly.notifications")
 
-POLL_INTERVAL_SECONDS = 15  # how often to check DB
-
-
-async def _send_one_job(db, job_row) -> None:
-  job_id = job_row.job_id
-  user_id = job_row.user_id
-  purpose = job_row.purpose
-  payload_json = job_row.payload_json
-
-  # find an active device token for this user
-  token_row = db.execute(
-      text(
-          """
-          SELECT TOP 1 fcm_token
-          FROM dbo.UserDeviceTokens
-          WHERE user_id = :uid AND is_active = 1
-          ORDER BY last_seen DESC
-          """
-      ),
-      {"uid": user_id},
-  ).fetchone()
-
-  if not token_row:
-      return
-
-  fcm_token = token_row.fcm_token
-
-  # parse payload
-  try:
-      payload = json.loads(payload_json)
-  except Exception:
-      payload = {}
-
-  title = payload.get("title", "Mendly")
-  body = payload.get("body", "You have a new notification")
-
-  # ---- SEND VIA FCM ----
-  # normalize any return shape from send_push_to_token into (ok, err)
-  try:
-      send_result = send_push_to_token(
-          token=fcm_token,
-          title=title,
-          body=body,
-          data={"purpose": purpose},
-      )
-      ok: bool
-      err: str | None
-
-      if isinstance(send_result, tuple):
-          if len(send_result) == 2:
-              ok, err = send_result
-          else:
-              # e.g. (ok, err, message_id) -> take first two
-              ok = bool(send_result[0])
-              err = send_result[1] if len(send_result) > 1 else None
-      else:
-          # e.g. just a message_id string or True/False
-          ok = bool(send_result)
-          err = None
-  except Exception as e:
-      ok = False
-      err = str(e)
-      log.warning("FCM send raised exception for job %s: %r", job_id, e)
-
-  # ---- UPDATE DB STATUS ----
-  if ok:
-      db.execute(
-          text(
-              """
-              UPDATE dbo.NotificationQueue
-              SET status = N'sent',
-                  sent_at = SYSDATETIMEOFFSET()
-              WHERE job_id = :jid
-              """
-          ),
-          {"jid": job_id},
-      )
-      log.info(
-          "Sent notification job %s (purpose=%s) to user %s",
-          job_id,
-          purpose,
-          user_id,
-      )
-  else:
-      db.execute(
-          text(
-              """
-              UPDATE dbo.NotificationQueue
-              SET status = N'failed',
-                  error = :err,
-                  sent_at = SYSDATETIMEOFFSET()
-              WHERE job_id = :jid
-              """
-          ),
-          {"jid": job_id, "err": err or "unknown error"},
-      )
-      log.warning("Failed to send notification job %s: %s", job_id, err)
+# Upper bound on how long the worker sleeps without looking at the DB.
+# Jobs enqueued in this process wake the worker immediately (notify_enqueued);
+# other processes bump dbo.NotificationWake (signal_enqueued), which the
+# worker checks every WAKE_POLL_SECONDS. The resync catches the rest
+# (SQL jobs, scheduled_at values that were not in the prefetch).
+POLL_INTERVAL_SECONDS = 15
+# one primary-key read per interval; 0 turns the wake row off
+WAKE_POLL_SECONDS = float(os.getenv("NOTIF_WAKE_POLL_SEC", "1"))
 
+# due jobs per cycle; sent with one FCM send_each call per 500
+BATCH_SIZE = int(os.getenv("NOTIF_WORKER_BATCH_SIZE", "500"))
+# FCM calls run in a thread pool: SEND_CHUNK_SIZE messages per send_each
+# call, at most SEND_CONCURRENCY calls in flight
+SEND_CHUNK_SIZE = max(1, min(500, int(os.getenv("NOTIF_SEND_CHUNK_SIZE", "100"))))
+SEND_CONCURRENCY = max(1, int(os.getenv("NOTIF_SEND_CONCURRENCY", "8")))
+# claimed jobs stay 'sending' until this lease expires; after that any
+# worker may reclaim them (crashed / killed sender)
+LEASE_SECONDS = int(os.getenv("NOTIF_LEASE_SECONDS", "120"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"[:100]
+# failed sends are retried with exponential backoff (through scheduled_at)
+# and end up 'dead' after MAX_ATTEMPTS claims
+MAX_ATTEMPTS = int(os.getenv("NOTIF_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = int(os.getenv("NOTIF_RETRY_BASE_SEC", "30"))
+RETRY_MAX_SECONDS = int(os.getenv("NOTIF_RETRY_MAX_SEC", "3600"))
+# fan-out bound: devices per user a single job is sent to
+MAX_DEVICES_PER_USER = int(os.getenv("NOTIF_MAX_DEVICES_PER_USER", "10"))
+# how often stale device tokens (last_seen too old) are deactivated
+TOKEN_SWEEP_INTERVAL_SECONDS = int(os.getenv("NOTIF_TOKEN_SWEEP_INTERVAL_SEC", "3600"))
+# how many upcoming scheduled_at values we keep in memory
+PREFETCH_SIZE = int(os.getenv("NOTIF_WORKER_PREFETCH", "500"))
+# jobs of a user that fall due within this many seconds of one of their
+# claimed jobs are claimed with it and merged into the same push
+COALESCE_WINDOW_SECONDS = int(os.getenv("NOTIF_COALESCE_WINDOW_SEC", "300"))
+# a merged push body is cut to this many characters
+COALESCE_MAX_BODY = int(os.getenv("NOTIF_COALESCE_MAX_BODY", "240"))
+# standalone worker: /metrics + /healthz port (0 disables)
+METRICS_PORT = int(os.getenv("NOTIF_METRICS_PORT", "9108"))
 
-async def notification_loop(poll_interval: int = POLL_INTERVAL_SECONDS) -> None:
-  while True:
-      try:
-          with SessionLocal() as db:
-              jobs = db.execute(
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+class DueTimeWaker:
+    """
+    Min-heap of upcoming scheduled_at times plus a wake-up signal.
+
+    The worker sleeps exactly until the earliest time in the heap;
+    notify_enqueued() (any thread) pushes a new time and wakes it early.
+    """
+
+    def __init__(self) -> None:
+        self._heap: List[datetime] = []
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def unbind(self) -> None:
+        with self._lock:
+            self._loop, self._event = None, None
+            self._heap = []
+
+    def bound(self) -> bool:
+        loop = self._loop
+        return loop is not None and not loop.is_closed()
+
+    def replace(self, times: List[datetime]) -> None:
+        with self._lock:
+            self._heap = [_as_utc(t) for t in times]
+            heapq.heapify(self._heap)
+
+    def push(self, when: datetime) -> None:
+        with self._lock:
+            heapq.heappush(self._heap, _as_utc(when))
+
+    def next_due(self) -> Optional[datetime]:
+        with self._lock:
+            return self._heap[0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> None:
+        with self._lock:
+            while self._heap and self._heap[0] <= now:
+                heapq.heappop(self._heap)
+
+    def wake(self) -> None:
+        loop, event = self._loop, self._event
+        if loop is None or event is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, timeout: float) -> None:
+        assert self._event is not None
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=max(0.0, timeout))
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+
+waker = DueTimeWaker()
+
+
+def notify_enqueued(scheduled_at: Optional[datetime] = None) -> None:
+    """
+    Call after committing a dbo.NotificationQueue insert in this process,
+    so the worker sends it without waiting for the next resync.
+    A no-op in processes without a running worker loop (nobody would
+    ever pop the time; a standalone worker finds the job on its resync).
+    """
+    if not waker.bound():
+        return
+    waker.push(scheduled_at or _utcnow())
+    waker.wake()
+
+
+def signal_enqueued(db) -> None:
+    """
+    Bump the wake row in the caller's transaction (call it before the
+    commit of the insert), so worker processes pick up a job that is due
+    now within WAKE_POLL_SECONDS instead of at their next resync.
+    """
+    db.execute(
+        text(
+            """
+            UPDATE dbo.NotificationWake
+            SET seq = seq + 1, bumped_at = SYSDATETIMEOFFSET()
+            WHERE wake_id = 1
+            """
+        )
+    )
+
+
+def _read_wake_seq() -> Optional[int]:
+    with SessionLocal() as db:
+        return db.execute(text("SELECT seq FROM dbo.NotificationWake WHERE wake_id = 1")).scalar()
+
+
+def _load_upcoming(db) -> List[datetime]:
+    # pending jobs, plus leases that will expire (their jobs get reclaimed)
+    rows = db.execute(
+        text(
+            """
+            SELECT TOP (:n) due_at
+            FROM (
+                SELECT scheduled_at AS due_at
+                FROM dbo.NotificationQueue
+                WHERE status = N'pending'
+                  AND purpose IN :purposes
+                UNION ALL
+                SELECT lease_until
+                FROM dbo.NotificationQueue
+                WHERE status = N'sending'
+                UNION ALL
+                SELECT CASE WHEN status = N'pending' THEN scheduled_at ELSE lease_until END
+                FROM dbo.BroadcastQueue
+                WHERE status IN (N'pending', N'sending')
+            ) x
+            ORDER BY due_at
+            """
+        ).bindparams(bindparam("purposes", expanding=True)),
+        {"n": PREFETCH_SIZE, "purposes": purpose_names()},
+    ).fetchall()
+    return [r.due_at for r in rows if r.due_at is not None]
+
+
+def _load_upcoming_now() -> List[datetime]:
+    with SessionLocal() as db:
+        return _load_upcoming(db)
+
+
+def _expire_stale(db, chunk: int = 1000) -> int:
+    """
+    Mark pending jobs past their purpose's TTL as 'expired' (small
+    batches, so the sweep never holds long locks).
+    """
+    total = 0
+    for cfg in purposes_by_priority():
+        if not cfg.ttl_seconds:
+            continue
+        while True:
+            res = db.execute(
                 text(
                     """
-                    SELECT TOP 50 job_id, user_id, purpose, payload_json
-                    FROM dbo.NotificationQueue
-                    WHERE status = N'pending'
-                    AND scheduled_at <= SYSDATETIMEOFFSET()
-                    AND purpose IN (N'checkin_reminder', N'weekly_summary')  -- ignore 'tip'
-                    ORDER BY scheduled_at
+                    UPDATE TOP (:n) dbo.NotificationQueue
+                    SET status = N'expired',
+                        error = N'ttl exceeded'
+                    WHERE purpose = :purpose
+                      AND status = N'pending'
+                      AND scheduled_at < DATEADD(SECOND, -:ttl, SYSDATETIMEOFFSET())
+                    """
+                ),
+                {"n": chunk, "purpose": cfg.name, "ttl": cfg.ttl_seconds},
+            )
+            db.commit()
+            changed = res.rowcount or 0
+            total += changed
+            if changed:
+                metrics.record({(cfg.name, "expired"): changed})
+            if changed < chunk:
+                break
+    if total:
+        log.info("Expired %s notification jobs past their TTL", total)
+    return total
+
+
+def _expire_stale_now() -> int:
+    with SessionLocal() as db:
+        return _expire_stale(db)
+
+
+class Device(NamedTuple):
+    token_id: str
+    fcm_token: str
+
+
+def _find_devices(db, jobs) -> Tuple[Dict[str, List[Device]], set]:
+    """
+    Active devices for every job of the batch, in one query.
+
+    A job with token_id set targets only that device, otherwise all of
+    the user's active devices (newest first, at most MAX_DEVICES_PER_USER).
+    Devices that already got this job on an earlier attempt are skipped,
+    and each fcm_token is used once per job.
+
+    Also returns the ids of jobs (among retries) that were already
+    delivered to at least one device.
+    """
+    if not jobs:
+        return {}, set()
+    batch = json.dumps(
+        [
+            {
+                "job_id": str(j.job_id),
+                "user_id": str(j.user_id),
+                "token_id": str(j.token_id) if j.token_id else None,
+            }
+            for j in jobs
+        ]
+    )
+    rows = db.execute(
+        text(
+            """
+            SELECT j.job_id, t.token_id, t.fcm_token
+            FROM OPENJSON(:jobs) WITH (
+                    job_id   UNIQUEIDENTIFIER '$.job_id',
+                    user_id  UNIQUEIDENTIFIER '$.user_id',
+                    token_id UNIQUEIDENTIFIER '$.token_id'
+                 ) j
+            JOIN dbo.UserDeviceTokens t
+              ON t.user_id = j.user_id
+             AND t.is_active = 1
+             AND (j.token_id IS NULL OR t.token_id = j.token_id)
+            WHERE NOT EXISTS (
+                    SELECT 1 FROM dbo.NotificationDeliveries d
+                    WHERE d.job_id = j.job_id
+                      AND d.token_id = t.token_id
+                      AND d.status = N'sent'
+            )
+            ORDER BY j.job_id, t.last_seen DESC
+            """
+        ),
+        {"jobs": batch},
+    ).fetchall()
+
+    devices: Dict[str, List[Device]] = {}
+    seen: Dict[str, set] = {}
+    for r in rows:
+        jid = str(r.job_id).lower()
+        tokens = seen.setdefault(jid, set())
+        lst = devices.setdefault(jid, [])
+        if r.fcm_token in tokens or len(lst) >= MAX_DEVICES_PER_USER:
+            continue
+        tokens.add(r.fcm_token)
+        lst.append(Device(str(r.token_id), r.fcm_token))
+
+    delivered: set = set()
+    retried = [str(j.job_id) for j in jobs if int(j.attempts) > 1]
+    if retried:
+        delivered = {
+            str(r.job_id).lower()
+            for r in db.execute(
+                text(
+                    """
+                    SELECT DISTINCT d.job_id
+                    FROM dbo.NotificationDeliveries d
+                    JOIN OPENJSON(:ids) WITH (job_id UNIQUEIDENTIFIER '$') x
+                      ON x.job_id = d.job_id
+                    WHERE d.status = N'sent'
                     """
+                ),
+                {"ids": json.dumps(retried)},
+            ).fetchall()
+        }
+    return devices, delivered
+
+
+def _record_deliveries(db, deliveries: List[Tuple[str, str, SendResult]]) -> None:
+    """
+    Upsert one dbo.NotificationDeliveries row per (job, device) attempt.
+    """
+    if not deliveries:
+        return
+    db.execute(
+        text(
+            """
+            MERGE dbo.NotificationDeliveries AS d
+            USING (
+                SELECT * FROM OPENJSON(:rows) WITH (
+                    job_id     UNIQUEIDENTIFIER '$.job_id',
+                    token_id   UNIQUEIDENTIFIER '$.token_id',
+                    status     NVARCHAR(20)     '$.status',
+                    error_code NVARCHAR(40)     '$.error_code',
+                    message_id NVARCHAR(200)    '$.message_id'
+                )
+            ) AS s
+            ON d.job_id = s.job_id AND d.token_id = s.token_id
+            WHEN MATCHED THEN UPDATE SET
+                status = s.status,
+                error_code = s.error_code,
+                message_id = s.message_id,
+                attempted_at = SYSDATETIMEOFFSET()
+            WHEN NOT MATCHED THEN
+                INSERT (job_id, token_id, status, error_code, message_id)
+                VALUES (s.job_id, s.token_id, s.status, s.error_code, s.message_id);
+            """
+        ),
+        {
+            "rows": json.dumps(
+                [
+                    {
+                        "job_id": str(job_id),
+                        "token_id": token_id,
+                        "status": "sent" if res.ok else ("invalid" if res.token_invalid else "failed"),
+                        "error_code": (res.error_code or "")[:40] or None,
+                        "message_id": (res.message_id or "")[:200] or None,
+                    }
+                    for job_id, token_id, res in deliveries
+                ]
+            ),
+        },
+    )
+
+
+class JobUpdate(NamedTuple):
+    job_id: str
+    status: str  # sent / coalesced / pending (retry) / dead / no_device / capped
+    error: Optional[str] = None
+    retry_in: Optional[int] = None  # seconds; only with status='pending'
+    deferred: bool = False  # held back by policy: the claim is not an attempt
+
+
+def _retry_delay(attempts: int) -> int:
+    """
+    Exponential backoff (base * 2^(attempts-1)), capped, with +-20% jitter
+    so a failed wave does not retry in lockstep.
+    """
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return max(1, int(delay * random.uniform(0.8, 1.2)))
+
+
+def _failure_update(row_id, attempts: int, err: Optional[str], retry_now: bool = False) -> JobUpdate:
+    """
+    Retry or dead-letter a failed job / broadcast (row_id is its job_id
+    or broadcast_id, attempts its claim count).
+    """
+    err = err or "unknown error"
+    if int(attempts) >= MAX_ATTEMPTS:
+        return JobUpdate(row_id, "dead", err)
+    # retry_now: the token was pruned, the next claim picks another device
+    delay = 0 if retry_now else _retry_delay(int(attempts))
+    return JobUpdate(row_id, "pending", err, delay)
+
+
+def _apply_statuses(db, updates: List[JobUpdate]) -> None:
+    """
+    Write the whole batch's outcomes with one UPDATE, joining the queue
+    to the batch passed as a single JSON parameter. Only rows still
+    leased by this worker are touched. Retries go back to 'pending'
+    with scheduled_at pushed out by retry_in seconds; deferred jobs also
+    get their attempt back.
+    """
+    if not updates:
+        return
+    db.execute(
+        text(
+            """
+            UPDATE q
+            SET status = u.status,
+                error = u.error,
+                scheduled_at = CASE
+                    WHEN u.retry_in IS NOT NULL
+                        THEN DATEADD(SECOND, u.retry_in, SYSDATETIMEOFFSET())
+                    ELSE q.scheduled_at END,
+                attempts = q.attempts - CASE WHEN u.deferred = 1 THEN 1 ELSE 0 END,
+                sent_at = CASE
+                    WHEN u.status IN (N'sent', N'coalesced', N'dead') THEN SYSDATETIMEOFFSET()
+                    ELSE q.sent_at END,
+                lease_until = NULL,
+                claimed_by = NULL
+            FROM dbo.NotificationQueue q
+            JOIN OPENJSON(:updates) WITH (
+                    job_id   UNIQUEIDENTIFIER '$.job_id',
+                    status   NVARCHAR(20)     '$.status',
+                    error    NVARCHAR(500)    '$.error',
+                    retry_in INT              '$.retry_in',
+                    deferred BIT              '$.deferred'
+                 ) u
+              ON u.job_id = q.job_id
+            WHERE q.status = N'sending'
+              AND q.claimed_by = :worker
+            """
+        ),
+        {
+            "worker": WORKER_ID,
+            "updates": json.dumps(
+                [
+                    {
+                        "job_id": str(u.job_id),
+                        "status": u.status,
+                        "error": (u.error[:500] if u.error else None),
+                        "retry_in": u.retry_in,
+                        "deferred": u.deferred,
+                    }
+                    for u in updates
+                ]
+            ),
+        },
+    )
+
+
+def _claim_due(db) -> Tuple[List, float, bool]:
+    """
+    Atomically claim up to BATCH_SIZE due jobs for this worker, walking
+    the purpose registry in priority order. Each purpose gets at most its
+    batch_size and what its rate limiter grants; jobs past the purpose's
+    TTL are left for _expire_stale.
+
+    READPAST skips rows other workers have locked, UPDLOCK keeps two
+    workers from claiming the same row, and the lease lets another
+    worker reclaim jobs whose owner died mid-send.
+
+    Returns (jobs, seconds until a throttled purpose has budget again,
+    whether a purpose filled its whole share so more may be due now).
+    A purpose that the limiter cut short counts as throttled, not as
+    "more due": looping on a trickle of tokens would claim one job per
+    round trip.
+    """
+    jobs: List = []
+    throttled_for = 0.0
+    more_due = False
+
+    def throttle(cfg: PurposeConfig, want: int) -> None:
+        # wait for a useful refill, not for the first single token
+        nonlocal throttled_for
+        wait = cfg.limiter.seconds_until_available(want)
+        throttled_for = wait if not throttled_for else min(throttled_for, wait)
+
+    for cfg in purposes_by_priority():
+        remaining = BATCH_SIZE - len(jobs)
+        if remaining <= 0:
+            more_due = True
+            break
+        want = min(cfg.batch_size, remaining)
+        granted = cfg.limiter.take(want)
+        if granted <= 0:
+            throttle(cfg, want)
+            continue
+
+        rows = db.execute(
+            text(
+                """
+                WITH due AS (
+                    SELECT TOP (:n) *
+                    FROM dbo.NotificationQueue WITH (ROWLOCK, READPAST, UPDLOCK)
+                    WHERE purpose = :purpose
+                      AND (
+                            (status = N'pending'
+                             AND scheduled_at <= SYSDATETIMEOFFSET()
+                             AND (:ttl IS NULL OR scheduled_at >= DATEADD(SECOND, -:ttl, SYSDATETIMEOFFSET())))
+                         OR (status = N'sending' AND lease_until < SYSDATETIMEOFFSET())
+                      )
+                    ORDER BY scheduled_at
+                )
+                UPDATE due
+                SET status = N'sending',
+                    attempts = attempts + 1,
+                    lease_until = DATEADD(SECOND, :lease, SYSDATETIMEOFFSET()),
+                    claimed_by = :worker
+                OUTPUT inserted.job_id, inserted.user_id, inserted.token_id, inserted.purpose,
+                       inserted.template_id, inserted.params_json, inserted.payload_json,
+                       inserted.scheduled_at, inserted.attempts
+                """
+            ),
+            {
+                "n": granted,
+                "purpose": cfg.name,
+                "ttl": cfg.ttl_seconds,
+                "lease": LEASE_SECONDS,
+                "worker": WORKER_ID,
+            },
+        ).fetchall()
+        cfg.limiter.give_back(granted - len(rows))
+        jobs.extend(rows)
+        if len(rows) < granted:
+            continue
+        if granted < want:
+            throttle(cfg, want)
+        else:
+            more_due = True
+    db.commit()
+    return jobs, throttled_for, more_due
+
+
+def _claim_coalescable(db, jobs) -> List:
+    """
+    Claim the pending jobs of the batch's users that fall due within
+    COALESCE_WINDOW_SECONDS, so they go out merged into this batch's push
+    instead of as a separate one a few minutes later. They add no pushes,
+    so they bypass the purpose rate limiters.
+    """
+    if not jobs or COALESCE_WINDOW_SECONDS <= 0:
+        return []
+    rows = db.execute(
+        text(
+            """
+            WITH soon AS (
+                SELECT q.*
+                FROM dbo.NotificationQueue q WITH (ROWLOCK, READPAST, UPDLOCK)
+                JOIN OPENJSON(:users) WITH (user_id UNIQUEIDENTIFIER '$') u
+                  ON u.user_id = q.user_id
+                WHERE q.status = N'pending'
+                  AND q.purpose IN :purposes
+                  AND q.scheduled_at > SYSDATETIMEOFFSET()
+                  AND q.scheduled_at <= DATEADD(SECOND, :window, SYSDATETIMEOFFSET())
+            )
+            UPDATE soon
+            SET status = N'sending',
+                attempts = attempts + 1,
+                lease_until = DATEADD(SECOND, :lease, SYSDATETIMEOFFSET()),
+                claimed_by = :worker
+            OUTPUT inserted.job_id, inserted.user_id, inserted.token_id, inserted.purpose,
+                   inserted.template_id, inserted.params_json, inserted.payload_json,
+                   inserted.scheduled_at, inserted.attempts
+            """
+        ).bindparams(bindparam("purposes", expanding=True)),
+        {
+            "users": json.dumps(sorted({str(j.user_id).lower() for j in jobs})),
+            "purposes": purpose_names(),
+            "window": COALESCE_WINDOW_SECONDS,
+            "lease": LEASE_SECONDS,
+            "worker": WORKER_ID,
+        },
+    ).fetchall()
+    db.commit()
+    return rows
+
+
+def _load_batch() -> Tuple[List, Dict[str, List[Device]], set, Dict[str, UserPolicy], float, bool]:
+    templates.ensure_fresh()
+    with SessionLocal() as db:
+        jobs, throttled_for, more_due = _claim_due(db)
+        jobs.extend(_claim_coalescable(db, jobs))
+        devices, delivered = _find_devices(db, jobs)
+        policies = load_policies(db, (j.user_id for j in jobs))
+        return jobs, devices, delivered, policies, throttled_for, more_due
+
+
+def _store_statuses(
+    updates: List[JobUpdate],
+    deliveries: List[Tuple[str, str, SendResult]],
+    invalid_tokens: List[str],
+) -> None:
+    with SessionLocal() as db:
+        _record_deliveries(db, deliveries)
+        _apply_statuses(db, updates)
+        pruned = deactivate_tokens(db, invalid_tokens)
+        db.commit()
+    if pruned:
+        release_tip_topics(pruned)
+        log.info("Deactivated %s device tokens rejected by FCM", len(pruned))
+
+
+def _sweep_tokens() -> None:
+    with SessionLocal() as db:
+        sweep_stale_tokens(db)
+
+
+_send_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_send_executor() -> ThreadPoolExecutor:
+    global _send_executor
+    if _send_executor is None:
+        _send_executor = ThreadPoolExecutor(
+            max_workers=SEND_CONCURRENCY, thread_name_prefix="fcm-send"
+        )
+    return _send_executor
+
+
+async def _send_concurrently(messages: List[PushMessage]) -> List[SendResult]:
+    """
+    Split messages into SEND_CHUNK_SIZE chunks and run the blocking
+    send_push_batch calls in a thread pool, at most SEND_CONCURRENCY
+    at a time. Results keep the input order.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_send_executor()
+    sem = asyncio.Semaphore(SEND_CONCURRENCY)
+
+    async def _send_chunk(chunk: List[PushMessage]) -> List[SendResult]:
+        async with sem:
+            try:
+                return await loop.run_in_executor(executor, send_push_batch, chunk)
+            except Exception as e:
+                log.warning("FCM chunk of %s failed: %r", len(chunk), e)
+                return [SendResult(ok=False, error=str(e)) for _ in chunk]
+
+    chunks = [messages[i : i + SEND_CHUNK_SIZE] for i in range(0, len(messages), SEND_CHUNK_SIZE)]
+    results: List[SendResult] = []
+    for part in await asyncio.gather(*(_send_chunk(c) for c in chunks)):
+        results.extend(part)
+    return results
+
+
+# timings of the most recent non-empty batch (for logs / metrics)
+last_batch_stats: Dict[str, float] = {}
+
+
+def _plan_pushes(
+    jobs: List, policies: Dict[str, UserPolicy], now: datetime
+) -> Tuple[List[List], List[JobUpdate]]:
+    """
+    Coalesce the batch into at most one push per user and apply each
+    user's quiet hours and daily cap.
+
+    Returns (groups, held): every group is one user's jobs, highest
+    priority first, to be sent as a single push; held are the updates for
+    jobs that are not sent now (deferred to the end of quiet hours,
+    'expired' when that is past the purpose TTL, or dropped as 'capped').
+    Policy-exempt jobs (test pushes) go out alone and unconditionally.
+    """
+    groups: List[List] = []
+    by_user: Dict[str, List] = {}
+    for job in jobs:
+        if exempt_from_policy(job):
+            groups.append([job])
+        else:
+            by_user.setdefault(str(job.user_id).lower(), []).append(job)
+
+    held: List[JobUpdate] = []
+    for uid, user_jobs in by_user.items():
+        policy = policies.get(uid, DEFAULT_POLICY)
+        until = quiet_until(policy, now)
+        if until is not None:
+            delay = max(1, int((until - now).total_seconds()))
+            held.extend(_quiet_hours_update(j, until, delay) for j in user_jobs)
+        elif over_cap(policy):
+            held.extend(JobUpdate(j.job_id, "capped", "daily push cap reached") for j in user_jobs)
+        else:
+            groups.append(sorted(user_jobs, key=lambda j: get_purpose(j.purpose).priority))
+    return groups, held
+
+
+def _quiet_hours_update(job, until: datetime, delay: int) -> JobUpdate:
+    # a reminder held past its TTL would arrive when it no longer applies
+    ttl = get_purpose(job.purpose).ttl_seconds
+    if ttl is not None and until > _as_utc(job.scheduled_at) + timedelta(seconds=ttl):
+        return JobUpdate(job.job_id, "expired", "ttl exceeded during quiet hours")
+    return JobUpdate(job.job_id, "pending", "quiet hours", delay, True)
+
+
+def _render_group(group: List) -> Tuple[str, str, Dict[str, str]]:
+    """
+    The lead job's title; the bodies of all jobs joined into one.
+    """
+    title, body, data = get_purpose(group[0].purpose).render(group[0])
+    if len(group) == 1:
+        return title, body, data
+    bodies = [body]
+    for job in group[1:]:
+        extra = get_purpose(job.purpose).render(job)[1]
+        if extra and extra not in bodies:
+            bodies.append(extra)
+    body = " ".join(bodies)
+    if len(body) > COALESCE_MAX_BODY:
+        body = body[: COALESCE_MAX_BODY - 1].rstrip() + "\u2026"
+    data = dict(data)
+    data["coalesced"] = str(len(group))
+    data["purposes"] = ",".join(dict.fromkeys(j.purpose for j in group))
+    return title, body, data
+
+
+def _group_devices(group: List, devices: Dict[str, List[Device]]) -> List[Device]:
+    # union over the group's jobs, each fcm_token once
+    seen = set()
+    out: List[Device] = []
+    for job in group:
+        for dev in devices.get(str(job.job_id).lower(), ()):
+            if dev.fcm_token not in seen:
+                seen.add(dev.fcm_token)
+                out.append(dev)
+    return out[:MAX_DEVICES_PER_USER]
+
+
+def _group_updates(group: List, lead: JobUpdate) -> List[JobUpdate]:
+    # before any send (no device): the merged jobs share the lead job's fate;
+    # sent ones are 'coalesced'
+    rest = [
+        JobUpdate(j.job_id, "coalesced") if lead.status == "sent"
+        else lead._replace(job_id=j.job_id)
+        for j in group[1:]
+    ]
+    return [lead] + rest
+
+
+def _send_outcome(job, failures: List[SendResult], transient: List[SendResult], reached: bool, merged: bool) -> JobUpdate:
+    """
+    One job's status after its group's push. Decided on the job's own
+    attempts: a job merged into the group can be on another attempt than
+    the lead, so it may go dead while the lead retries or the other way round.
+    """
+    if transient and int(job.attempts) < MAX_ATTEMPTS:
+        # retry later; devices that already got it are skipped then
+        return _failure_update(job.job_id, job.attempts, transient[0].error)
+    if reached:
+        if merged:
+            return JobUpdate(job.job_id, "coalesced")
+        return JobUpdate(job.job_id, "sent", failures[0].error if failures else None)
+    return _failure_update(job.job_id, job.attempts, failures[0].error, retry_now=not transient)
+
+
+async def _process_due_batch() -> Tuple[int, bool]:
+    """
+    Send one batch of due jobs and map the per-message results back to
+    job statuses. DB work runs in a worker thread and FCM calls run
+    concurrently, so the event loop never blocks.
+
+    Jobs are coalesced per user (one push per user and batch) after
+    quiet hours and the daily cap have been applied.
+    Returns (how many jobs changed status, whether more jobs are due
+    right away).
+    """
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    jobs, devices, delivered, policies, throttled_for, more_due = await asyncio.to_thread(_load_batch)
+    t_load = loop.time()
+    if throttled_for:
+        # a rate-limited purpose still has due jobs: come back when it has budget
+        waker.push(_utcnow() + timedelta(seconds=throttled_for))
+
+    groups, updates = _plan_pushes(jobs, policies, _utcnow())
+
+    # one message per (group, device); targets[i] belongs to messages[i]
+    targets: List[Tuple[int, Device]] = []
+    messages: List[PushMessage] = []
+    for gi, group in enumerate(groups):
+        group_devices = _group_devices(group, devices)
+        if not group_devices:
+            # nothing (left) to send to: done if an earlier attempt reached
+            # a device, otherwise park it instead of refetching it forever
+            reached = any(str(j.job_id).lower() in delivered for j in group)
+            updates.extend(_group_updates(group, JobUpdate(group[0].job_id, "sent" if reached else "no_device")))
+            continue
+        title, body, data = _render_group(group)
+        for dev in group_devices:
+            targets.append((gi, dev))
+            messages.append(PushMessage(token=dev.fcm_token, title=title, body=body, data=data))
+
+    results = await _send_concurrently(messages) if messages else []
+    t_send = loop.time()
+
+    # fold per-device results back into one outcome per group
+    per_group: Dict[int, List[SendResult]] = {}
+    deliveries: List[Tuple[str, str, SendResult]] = []
+    invalid_tokens: List[str] = []
+    for (gi, dev), res in zip(targets, results):
+        per_group.setdefault(gi, []).append(res)
+        # recorded for every merged job, so a retry skips this device for all of them
+        deliveries.extend((str(j.job_id), dev.token_id, res) for j in groups[gi])
+        if res.token_invalid:
+            invalid_tokens.append(dev.fcm_token)
+
+    for gi, group_results in per_group.items():
+        group = groups[gi]
+        job = group[0]
+        failures = [r for r in group_results if not r.ok]
+        transient = [r for r in failures if not r.token_invalid]
+        reached = len(failures) < len(group_results) or any(
+            str(j.job_id).lower() in delivered for j in group
+        )
+
+        group_updates = [
+            _send_outcome(j, failures, transient, reached, merged=i > 0) for i, j in enumerate(group)
+        ]
+        upd = group_updates[0]
+        updates.extend(group_updates)
+
+        if failures:
+            log.warning(
+                "Notification job %s (+%s merged): %s/%s devices failed (attempt %s -> %s): %s",
+                job.job_id,
+                len(group) - 1,
+                len(failures),
+                len(group_results),
+                job.attempts,
+                upd.status,
+                failures[0].error,
+            )
+
+    await asyncio.to_thread(_store_statuses, updates, deliveries, invalid_tokens)
+    t_end = loop.time()
+
+    purpose_of = {str(j.job_id).lower(): j.purpose for j in jobs}
+    outcomes = Counter(
+        (purpose_of[str(u.job_id).lower()], "deferred" if u.deferred else u.status) for u in updates
+    )
+
+    # wake up for the earliest retry without waiting for a resync
+    retries = [u.retry_in for u in updates if u.retry_in is not None]
+    if retries:
+        waker.push(_utcnow() + timedelta(seconds=min(retries)))
+
+    if not per_group:
+        metrics.record_batch(outcomes, 0, {})
+        return len(updates), more_due
+
+    ok = sum(1 for r in results if r.ok)
+    last_batch_stats.clear()
+    last_batch_stats.update(
+        {
+            "jobs": sum(len(groups[gi]) for gi in per_group),
+            "pushes": len(per_group),
+            "devices": len(results),
+            "ok": ok,
+            "failed": len(results) - ok,
+            "held": sum(1 for u in updates if u.deferred or u.status == "capped"),
+            "tokens_pruned": len(invalid_tokens),
+            "load_ms": round((t_load - t0) * 1000, 1),
+            "send_ms": round((t_send - t_load) * 1000, 1),
+            "update_ms": round((t_end - t_send) * 1000, 1),
+            "sends_per_sec": round(len(results) / (t_send - t_load), 1) if t_send > t_load else 0.0,
+        }
+    )
+    metrics.record_batch(outcomes, ok, last_batch_stats)
+    log.info("Sent notification batch: %s", last_batch_stats)
+    return len(updates), more_due
+
+
+# ---------- topic broadcasts (dbo.BroadcastQueue) ----------
+
+BROADCAST_BATCH_SIZE = int(os.getenv("NOTIF_BROADCAST_BATCH_SIZE", "50"))
+
+
+def _claim_broadcasts() -> List:
+    """
+    Same lease protocol as _claim_due, for segment broadcasts.
+    """
+    templates.ensure_fresh()
+    with SessionLocal() as db:
+        rows = db.execute(
+            text(
+                """
+                WITH due AS (
+                    SELECT TOP (:n) *
+                    FROM dbo.BroadcastQueue WITH (ROWLOCK, READPAST, UPDLOCK)
+                    WHERE (status = N'pending' AND scheduled_at <= SYSDATETIMEOFFSET())
+                       OR (status = N'sending' AND lease_until < SYSDATETIMEOFFSET())
+                    ORDER BY scheduled_at
                 )
-                ).fetchall()
+                UPDATE due
+                SET status = N'sending',
+                    attempts = attempts + 1,
+                    lease_until = DATEADD(SECOND, :lease, SYSDATETIMEOFFSET()),
+                    claimed_by = :worker
+                OUTPUT inserted.broadcast_id, inserted.topic, inserted.purpose,
+                       inserted.template_id, inserted.params_json, inserted.payload_json,
+                       inserted.scheduled_at, inserted.attempts
+                """
+            ),
+            {"n": BROADCAST_BATCH_SIZE, "lease": LEASE_SECONDS, "worker": WORKER_ID},
+        ).fetchall()
+        db.commit()
+        return rows
+
+
+def _store_broadcasts(updates: List[Tuple[str, JobUpdate, Optional[str]]]) -> None:
+    with SessionLocal() as db:
+        db.execute(
+            text(
+                """
+                UPDATE dbo.BroadcastQueue
+                SET status = :status,
+                    error = :error,
+                    message_id = :message_id,
+                    scheduled_at = CASE WHEN :retry_in IS NOT NULL
+                        THEN DATEADD(SECOND, :retry_in, SYSDATETIMEOFFSET())
+                        ELSE scheduled_at END,
+                    sent_at = CASE WHEN :status IN (N'sent', N'dead', N'expired')
+                        THEN SYSDATETIMEOFFSET() ELSE sent_at END,
+                    lease_until = NULL,
+                    claimed_by = NULL
+                WHERE broadcast_id = :bid
+                  AND status = N'sending'
+                  AND claimed_by = :worker
+                """
+            ),
+            [
+                {
+                    "bid": bid,
+                    "status": u.status,
+                    "error": (u.error[:500] if u.error else None),
+                    "message_id": message_id,
+                    "retry_in": u.retry_in,
+                    "worker": WORKER_ID,
+                }
+                for bid, u, message_id in updates
+            ],
+        )
+        db.commit()
+
 
-              if not jobs:
-                  # nothing to do
-                  await asyncio.sleep(poll_interval)
-                  continue
+async def _process_due_broadcasts() -> int:
+    """
+    Send due segment broadcasts: one FCM topic message each, however many
+    devices are subscribed. Returns how many were handled.
 
-              for job in jobs:
-                  await _send_one_job(db, job)
+    Per-user quiet hours and caps cannot apply to a topic message; users
+    who set either are kept off the tip topics and get direct pushes.
+    """
+    rows = await asyncio.to_thread(_claim_broadcasts)
+    if not rows:
+        return 0
 
-              db.commit()
-      except Exception as e:
-          log.exception("Error in notification_loop: %r", e)
+    loop = asyncio.get_running_loop()
+    executor = _get_send_executor()
+    now = _utcnow()
 
-      await asyncio.sleep(poll_interval)
+    sendable = []
+    outcomes: List[Tuple[object, JobUpdate, Optional[str]]] = []
+    for b in rows:
+        cfg = get_purpose(b.purpose)
+        if cfg is None or (
+            cfg.ttl_seconds and (now - _as_utc(b.scheduled_at)).total_seconds() > cfg.ttl_seconds
+        ):
+            outcomes.append((b, JobUpdate(b.broadcast_id, "expired", "ttl exceeded"), None))
+            continue
+        sendable.append((b, cfg.render(b)))
+
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(executor, send_push_topic, b.topic, title, body, data)
+            for b, (title, body, data) in sendable
+        )
+    )
+    for (b, _), res in zip(sendable, results):
+        if res.ok:
+            upd = JobUpdate(b.broadcast_id, "sent")
+        else:
+            upd = _failure_update(b.broadcast_id, b.attempts, res.error)
+        outcomes.append((b, upd, res.message_id))
+        if not res.ok:
+            log.warning("Broadcast %s to %s failed (-> %s): %s", b.broadcast_id, b.topic, upd.status, res.error)
+
+    await asyncio.to_thread(_store_broadcasts, [(b.broadcast_id, u, mid) for b, u, mid in outcomes])
+
+    retries = [u.retry_in for _, u, _ in outcomes if u.retry_in is not None]
+    if retries:
+        waker.push(_utcnow() + timedelta(seconds=min(retries)))
+    metrics.record(Counter((b.purpose, u.status) for b, u, _ in outcomes))
+    return len(rows)
+
+
+_stop: Optional[asyncio.Event] = None
+_stop_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def stop_worker() -> None:
+    """
+    Ask the worker to stop after the batch in flight (any thread).
+    Claimed jobs that never get sent are picked up again once their
+    lease expires, so a hard kill loses nothing either.
+    """
+    metrics.draining = True
+    loop, event = _stop_loop, _stop
+    if loop is None or event is None or loop.is_closed():
+        return
+    loop.call_soon_threadsafe(event.set)
+    waker.wake()
+
+
+async def notification_loop(poll_interval: int = POLL_INTERVAL_SECONDS) -> None:
+    global _stop, _stop_loop, _send_executor
+    loop = asyncio.get_running_loop()
+    waker.bind(loop)
+    _stop, _stop_loop = asyncio.Event(), loop
+    next_resync = 0.0
+    next_sweep = 0.0
+    next_wake_check = 0.0 if WAKE_POLL_SECONDS > 0 else float("inf")
+    wake_seq: Optional[int] = None
+
+    while not _stop.is_set():
+        try:
+            if loop.time() >= next_sweep:
+                next_sweep = loop.time() + TOKEN_SWEEP_INTERVAL_SECONDS
+                await asyncio.to_thread(_sweep_tokens)
+
+            if loop.time() >= next_wake_check:
+                next_wake_check = loop.time() + WAKE_POLL_SECONDS
+                try:
+                    seq = await asyncio.to_thread(_read_wake_seq)
+                except Exception as e:
+                    log.warning("[notifications] wake row unavailable, resync only: %r", e)
+                    next_wake_check = float("inf")
+                else:
+                    if wake_seq is not None and seq != wake_seq:
+                        # another process enqueued a job: reload the due times now
+                        waker.replace(await asyncio.to_thread(_load_upcoming_now))
+                    wake_seq = seq
+
+            if loop.time() >= next_resync:
+                await asyncio.to_thread(_expire_stale_now)
+                waker.replace(await asyncio.to_thread(_load_upcoming_now))
+                next_resync = loop.time() + poll_interval
+
+            now = _utcnow()
+            next_due = waker.next_due()
+
+            if next_due is not None and next_due <= now:
+                await _process_due_broadcasts()
+                _, more_due = await _process_due_batch()
+                if more_due:
+                    # a purpose filled its share -> there is probably more due work
+                    continue
+                waker.pop_due(now)
+                continue
+
+            # sleep exactly until the next due job (or the next resync / wake check)
+            delay = min(next_resync, next_wake_check) - loop.time()
+            if next_due is not None:
+                delay = min(delay, (next_due - now).total_seconds())
+            await waker.wait(delay)
+        except Exception as e:
+            log.exception("Error in notification_loop: %r", e)
+            await asyncio.sleep(min(poll_interval, 5))
+
+    waker.unbind()
+    # drained: the last batch's statuses are stored, let FCM calls finish
+    if _send_executor is not None:
+        _send_executor.shutdown(wait=True)
+        _send_executor = None
+    log.info("[notifications] worker stopped")
 
 
 def start_worker(interval_seconds: int = POLL_INTERVAL_SECONDS) -> None:
-  """
-  Called from main.py in a background thread/process.
-  """
-  log.info(
-      "[notifications] background worker starting (interval=%s)",
-      interval_seconds,
-  )
-  loop = asyncio.new_event_loop()
-  asyncio.set_event_loop(loop)
-  loop.run_until_complete(notification_loop(interval_seconds))
+    """
+    Called from main.py in a background thread/process.
+    """
+    log.info(
+        "[notifications] background worker starting (resync interval=%s)",
+        interval_seconds,
+    )
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(notification_loop(interval_seconds))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Standalone worker process:
+        python -m server.notification_worker [--batch-size N] [--concurrency N]
+    SIGTERM / SIGINT drain the batch in flight and exit.
+    """
+    global BATCH_SIZE, SEND_CONCURRENCY, SEND_CHUNK_SIZE
+
+    parser = argparse.ArgumentParser(description="Mendly notification worker")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=SEND_CONCURRENCY)
+    parser.add_argument("--chunk-size", type=int, default=SEND_CHUNK_SIZE)
+    parser.add_argument("--resync", type=int, default=POLL_INTERVAL_SECONDS)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT)
+    parser.add_argument("--metrics-host", default=METRICS_HOST, help="0.0.0.0 exposes it (no auth)")
+    args = parser.parse_args(argv)
+
+    BATCH_SIZE = max(1, args.batch_size)
+    SEND_CONCURRENCY = max(1, args.concurrency)
+    SEND_CHUNK_SIZE = max(1, min(500, args.chunk_size))
+
+    logging.basicConfig(level=logging.INFO)
+    start_metrics_server(args.metrics_port, args.metrics_host)
+
+    def _on_signal(signum, frame) -> None:
+        log.info("[notifications] signal %s received, draining", signum)
+        stop_worker()
+
+    signal.signal(signal.SIGINT, _on_signal)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, _on_signal)
+
+    log.info(
+        "[notifications] worker %s starting (batch=%s, concurrency=%s, chunk=%s)",
+        WORKER_ID,
+        BATCH_SIZE,
+        SEND_CONCURRENCY,
+        SEND_CHUNK_SIZE,
+    )
+    asyncio.run(notification_loop(args.resync))
+
+
+if __name__ == "__main__":
+    main()
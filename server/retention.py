@@ -0,0 +1,312 @@
+# server/retention.py
+# Retention for the append-only tables: finished NotificationQueue jobs
+# (with their NotificationDeliveries), finished BroadcastQueue rows and
+# AuditLogs entries older than N days are moved to the *Archive tables
+# (RETENTION_MODE=archive, default) or deleted (RETENTION_MODE=delete).
+#
+# Rows go in small batches (RETENTION_BATCH_SIZE, well under SQL Server's
+# 5000-lock escalation threshold), each picked in index order and
+# committed on its own. Between batches the pass sleeps at least as long
+# as the batch took (and at least RETENTION_PAUSE_MS), so it never uses
+# more than about half of the DB time, and it stops after
+# RETENTION_MAX_SECONDS; the next pass continues where it left off.
+#
+# Finished dbo.EmailOutbox rows are always deleted (never archived: they
+# only hold addresses and blanked bodies) after EMAIL_RETENTION_DAYS.
+#
+# Runs inside the scheduler process (python -m server.checkin_scheduler)
+# every RETENTION_INTERVAL_SEC, or on its own:
+#     python -m server.retention [--mode delete] [--days 30]
+import os
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from .db import SessionLocal
+from .email_outbox import EMAIL_DONE_STATUSES
+
+log = logging.getLogger("mendly.retention")
+
+RETENTION_MODE = (os.getenv("RETENTION_MODE") or "archive").lower().strip()
+NOTIF_RETENTION_DAYS = int(os.getenv("NOTIF_RETENTION_DAYS", "30"))
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "365"))
+EMAIL_RETENTION_DAYS = int(os.getenv("EMAIL_RETENTION_DAYS", "7"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_PAUSE_MS = int(os.getenv("RETENTION_PAUSE_MS", "200"))
+RETENTION_MAX_SECONDS = int(os.getenv("RETENTION_MAX_SECONDS", "300"))
+RETENTION_INTERVAL_SEC = int(os.getenv("RETENTION_INTERVAL_SEC", "86400"))
+
+# statuses a job / broadcast never leaves
+QUEUE_DONE_STATUSES = ("sent", "coalesced", "failed", "dead", "no_device", "expired", "capped")
+BROADCAST_DONE_STATUSES = ("sent", "dead", "expired")
+
+_QUEUE_COLUMNS = (
+    "job_id, user_id, token_id, purpose, template_id, params_json, payload_json, "
+    "scheduled_at, sent_at, status, error, attempts, slot, fire_date"
+)
+_DELIVERY_COLUMNS = "job_id, token_id, status, error_code, message_id, attempted_at"
+_BROADCAST_COLUMNS = (
+    "broadcast_id, topic, purpose, template_id, params_json, payload_json, "
+    "scheduled_at, sent_at, status, error, message_id, attempts"
+)
+_AUDIT_COLUMNS = "audit_id, user_id, actor, action, resource, ts"
+
+
+def _deleted(columns: str) -> str:
+    return ", ".join(f"deleted.{c.strip()}" for c in columns.split(","))
+
+
+def _queue_sql(archive: bool) -> str:
+    # ids first (IX_NotificationQueue_Status_Sched order), then deliveries,
+    # then the jobs themselves: the FK cascade has nothing left to do
+    archive_deliveries = (
+        f"""
+        INSERT INTO dbo.NotificationDeliveriesArchive ({_DELIVERY_COLUMNS})
+        SELECT {", ".join("d." + c.strip() for c in _DELIVERY_COLUMNS.split(","))}
+        FROM dbo.NotificationDeliveries d
+        JOIN @ids i ON i.job_id = d.job_id;
+        """
+        if archive
+        else ""
+    )
+    output = (
+        f"OUTPUT {_deleted(_QUEUE_COLUMNS)} INTO dbo.NotificationQueueArchive ({_QUEUE_COLUMNS})"
+        if archive
+        else ""
+    )
+    return f"""
+        SET NOCOUNT ON;
+        DECLARE @ids TABLE (job_id UNIQUEIDENTIFIER PRIMARY KEY);
+
+        INSERT INTO @ids (job_id)
+        SELECT TOP (:n) job_id
+        FROM dbo.NotificationQueue WITH (READPAST)
+        WHERE status = :status AND scheduled_at < :cutoff
+        ORDER BY scheduled_at;
+        {archive_deliveries}
+        DELETE d
+        FROM dbo.NotificationDeliveries d
+        JOIN @ids i ON i.job_id = d.job_id;
+
+        DELETE q
+        {output}
+        FROM dbo.NotificationQueue q
+        JOIN @ids i ON i.job_id = q.job_id;
+
+        SELECT COUNT(*) AS n FROM @ids;
+    """
+
+
+def _broadcast_sql(archive: bool) -> str:
+    output = (
+        f"OUTPUT {_deleted(_BROADCAST_COLUMNS)} INTO dbo.BroadcastQueueArchive ({_BROADCAST_COLUMNS})"
+        if archive
+        else ""
+    )
+    return f"""
+        SET NOCOUNT ON;
+        DECLARE @ids TABLE (broadcast_id UNIQUEIDENTIFIER PRIMARY KEY);
+
+        INSERT INTO @ids (broadcast_id)
+        SELECT TOP (:n) broadcast_id
+        FROM dbo.BroadcastQueue WITH (READPAST)
+        WHERE status = :status AND scheduled_at < :cutoff
+        ORDER BY scheduled_at;
+
+        DELETE b
+        {output}
+        FROM dbo.BroadcastQueue b
+        JOIN @ids i ON i.broadcast_id = b.broadcast_id;
+
+        SELECT COUNT(*) AS n FROM @ids;
+    """
+
+
+def _audit_sql(archive: bool) -> str:
+    # audit_id is the clustered key and grows with ts: the oldest rows are
+    # at the front of the index
+    output = (
+        f"OUTPUT {_deleted(_AUDIT_COLUMNS)} INTO dbo.AuditLogsArchive ({_AUDIT_COLUMNS})"
+        if archive
+        else ""
+    )
+    return f"""
+        SET NOCOUNT ON;
+        DECLARE @ids TABLE (audit_id BIGINT PRIMARY KEY);
+
+        INSERT INTO @ids (audit_id)
+        SELECT TOP (:n) audit_id
+        FROM dbo.AuditLogs WITH (READPAST)
+        WHERE ts < :cutoff
+        ORDER BY audit_id;
+
+        DELETE a
+        {output}
+        FROM dbo.AuditLogs a
+        JOIN @ids i ON i.audit_id = a.audit_id;
+
+        SELECT COUNT(*) AS n FROM @ids;
+    """
+
+
+def _email_sql() -> str:
+    return """
+        SET NOCOUNT ON;
+        DECLARE @ids TABLE (email_id UNIQUEIDENTIFIER PRIMARY KEY);
+
+        INSERT INTO @ids (email_id)
+        SELECT TOP (:n) email_id
+        FROM dbo.EmailOutbox WITH (READPAST)
+        WHERE status = :status AND scheduled_at < :cutoff
+        ORDER BY scheduled_at;
+
+        DELETE e
+        FROM dbo.EmailOutbox e
+        JOIN @ids i ON i.email_id = e.email_id;
+
+        SELECT COUNT(*) AS n FROM @ids;
+    """
+
+
+class _Budget:
+    """
+    Pass-wide time budget and pacing between batches.
+    """
+
+    def __init__(self, max_seconds: float, pause_ms: int) -> None:
+        self.deadline = time.monotonic() + max_seconds
+        self.pause = pause_ms / 1000.0
+        self.exhausted = False
+
+    def out_of_time(self) -> bool:
+        if time.monotonic() >= self.deadline:
+            self.exhausted = True
+        return self.exhausted
+
+    def pace(self, batch_seconds: float) -> bool:
+        """
+        Sleep after a batch; False once the budget is used up.
+        """
+        if self.out_of_time():
+            return False
+        time.sleep(max(self.pause, batch_seconds))
+        return True
+
+
+def _drain(
+    name: str,
+    sql: str,
+    params: Dict[str, object],
+    batch_size: int,
+    budget: _Budget,
+    stats: Dict[str, Dict[str, float]],
+) -> None:
+    entry = stats.setdefault(name, {"rows": 0, "batches": 0, "db_sec": 0.0})
+    with SessionLocal() as db:
+        while not budget.exhausted:
+            t0 = time.perf_counter()
+            n = int(db.execute(text(sql), {**params, "n": batch_size}).scalar() or 0)
+            db.commit()
+            took = time.perf_counter() - t0
+            entry["rows"] += n
+            entry["batches"] += 1
+            entry["db_sec"] = round(entry["db_sec"] + took, 3)
+            if n < batch_size or not budget.pace(took):
+                return
+
+
+def run_retention_pass(
+    mode: str = RETENTION_MODE,
+    notif_days: int = NOTIF_RETENTION_DAYS,
+    audit_days: int = AUDIT_RETENTION_DAYS,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    pause_ms: int = RETENTION_PAUSE_MS,
+    max_seconds: float = RETENTION_MAX_SECONDS,
+    email_days: int = EMAIL_RETENTION_DAYS,
+) -> Dict[str, object]:
+    """
+    Archive / delete everything past retention, within the time budget.
+    A days value <= 0 keeps that table forever. Returns per-table stats.
+    """
+    archive = mode != "delete"
+    now = datetime.now(timezone.utc)
+    budget = _Budget(max_seconds, pause_ms)
+    stats: Dict[str, Dict[str, float]] = {}
+    t0 = time.perf_counter()
+
+    steps: List[Callable[[], None]] = []
+    if notif_days > 0:
+        cutoff = now - timedelta(days=notif_days)
+        for status in QUEUE_DONE_STATUSES:
+            steps.append(
+                lambda s=status: _drain(
+                    "NotificationQueue", _queue_sql(archive), {"status": s, "cutoff": cutoff},
+                    batch_size, budget, stats,
+                )
+            )
+        for status in BROADCAST_DONE_STATUSES:
+            steps.append(
+                lambda s=status: _drain(
+                    "BroadcastQueue", _broadcast_sql(archive), {"status": s, "cutoff": cutoff},
+                    batch_size, budget, stats,
+                )
+            )
+    if email_days > 0:
+        email_cutoff = now - timedelta(days=email_days)
+        for status in EMAIL_DONE_STATUSES:
+            steps.append(
+                lambda s=status: _drain(
+                    "EmailOutbox", _email_sql(), {"status": s, "cutoff": email_cutoff},
+                    batch_size, budget, stats,
+                )
+            )
+    if audit_days > 0:
+        audit_cutoff = now - timedelta(days=audit_days)
+        steps.append(
+            lambda: _drain("AuditLogs", _audit_sql(archive), {"cutoff": audit_cutoff}, batch_size, budget, stats)
+        )
+
+    for step in steps:
+        if budget.out_of_time():
+            break
+        step()
+
+    result: Dict[str, object] = {
+        "mode": "archive" if archive else "delete",
+        "tables": stats,
+        "complete": not budget.exhausted,
+        "elapsed_sec": round(time.perf_counter() - t0, 3),
+    }
+    log.info("[retention] pass finished: %s", result)
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Mendly queue / audit log retention")
+    parser.add_argument("--mode", choices=("archive", "delete"), default=RETENTION_MODE)
+    parser.add_argument("--days", type=int, default=NOTIF_RETENTION_DAYS, help="notification queues")
+    parser.add_argument("--audit-days", type=int, default=AUDIT_RETENTION_DAYS)
+    parser.add_argument("--email-days", type=int, default=EMAIL_RETENTION_DAYS)
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--pause-ms", type=int, default=RETENTION_PAUSE_MS)
+    parser.add_argument("--max-seconds", type=float, default=RETENTION_MAX_SECONDS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    run_retention_pass(
+        mode=args.mode,
+        notif_days=args.days,
+        audit_days=args.audit_days,
+        email_days=args.email_days,
+        batch_size=max(1, args.batch_size),
+        pause_ms=max(0, args.pause_ms),
+        max_seconds=args.max_seconds,
+    )
+
+
+if __name__ == "__main__":
+    main()
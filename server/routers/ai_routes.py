@@ -1,15 +1,26 @@
 # server/routers/ai_routes.py
 
-from typing import List, Literal
+import asyncio
+import json
+import os
+import re
+from functools import lru_cache
+from typing import AsyncIterator, Iterator, List, Literal, Optional, Tuple
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTasks as StarletteBackgroundTasks
 
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
 from ..deps import get_db
-from ..auth import get_current_user
+from ..auth import get_current_admin, get_current_user
 from ..models import User
+from ..mood_snapshots import snapshot_buffer
+from ..conversations import ConversationState, conversation_store
+from ..ai_backends import load_backend
+from ..sentiment import mood_score
 
 router = APIRouter(prefix="/ai", tags=["ai-chat"])
 
@@ -23,10 +34,17 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+    # Server-held conversation: send only the id + the new message.
+    # Omit both conversation_id and history to start a new conversation.
+    conversation_id: Optional[str] = None
+    # Legacy: client re-uploads prior turns (ignored if conversation_id is set)
     history: List[ChatMessage] = []
 
 class ChatResponse(BaseModel):
+    # Delta only: the new assistant turn. The client appends it locally.
     reply: str
+    conversation_id: Optional[str] = None
+    turn: Optional[int] = None  # turns stored server-side after this reply
 
 # ============================
 # Emotion & scoring helpers
@@ -37,36 +55,10 @@ def normalize(s: str) -> str:
 
 def estimate_mood_score(text: str) -> int:
     """
-    Super basic sentiment → score (0..10).
-    You can refine later; this is good enough to feed the Journey page.
+    Sentiment → score (0..10) via the shared lexicon engine
+    (negation/intensifier aware); neutral 5 when nothing matches.
     """
-    lower = normalize(text)
-    score = 5  # neutral baseline
-
-    # strong positive first
-    if any(w in lower for w in ["very happy", "amazing", "fantastic", "wonderful", "ecstatic"]):
-        score = 9
-    elif any(w in lower for w in ["happy", "good", "great", "excited", "grateful", "proud"]):
-        score = 7
-    # strong negatives
-    elif any(w in lower for w in ["depressed", "terrible", "awful", "hopeless", "miserable"]):
-        score = 1
-    elif any(w in lower for w in ["angry", "furious", "mad", "rage", "frustrated"]):
-        score = 2
-    elif any(w in lower for w in ["anxious", "anxiety", "worried", "panic", "stressed", "overwhelmed"]):
-        score = 4
-    elif any(w in lower for w in ["sad", "down", "unhappy", "low", "lonely"]):
-        score = 3
-    elif any(w in lower for w in ["tired", "exhausted", "burnt out", "burned out", "fatigued"]):
-        score = 4
-    elif any(w in lower for w in ["sick", "ill", "fever", "pain", "hurts"]):
-        score = 3
-    elif any(w in lower for w in ["bored", "meh", "nothing to do"]):
-        score = 5
-    elif any(w in lower for w in ["confused", "lost", "don’t know", "don't know"]):
-        score = 4
-
-    return max(0, min(10, score))
+    return mood_score(text)
 
 def mood_label_from_score(score: int) -> str:
     if score >= 8:
@@ -79,107 +71,234 @@ def mood_label_from_score(score: int) -> str:
         return "Low / sad"
     return "Very low"
 
+# (intent, keywords, tip) – first match wins, same order as before
+TIP_RULES = [
+    ("angry", ["angry", "furious", "mad", "frustrated"],
+     "Try a 90-second reset: slow inhale 4s, hold 4s, long exhale 6–8s. Shake out the shoulders."),
+    ("anxious", ["anxious", "anxiety", "worried", "panic", "stressed", "overwhelmed"],
+     "Grounding tip: name 5 things you can see, 4 you can feel, 3 you can hear, 2 you can smell, 1 you can taste."),
+    ("sad", ["sad", "down", "unhappy", "low", "lonely"],
+     "Tiny lift: step outside for 2 minutes of fresh air or light; message someone you trust one sentence."),
+    ("tired", ["tired", "exhausted", "burnt out", "burned out", "fatigued"],
+     "Micro-recharge: 20-minute break with phone away, drink water, blink slowly 10 times."),
+    ("sick", ["sick", "ill", "fever", "pain", "hurts"],
+     "Be gentle today—hydrate, rest if you can, and consider a quick check-in with a clinician if symptoms persist."),
+    ("bored", ["bored", "meh"],
+     "Pick a 10-minute task with a clear finish—then reward yourself. Momentum beats motivation."),
+    ("confused", ["confused", "lost"],
+     "Write 3 bullet points: what you know, what you don’t, and one next step."),
+    ("positive", ["proud", "grateful", "happy", "excited", "great", "good"],
+     "Awesome—savor this! Take a breath and note one specific detail you appreciate right now."),
+]
+DEFAULT_TIP = "Small steps count. Pick one doable action for the next 10 minutes—then come back and we’ll reflect."
+TIPS = {intent: tip for intent, _, tip in TIP_RULES}
+
+def _tip_intent(lower: str) -> str:
+    for intent, words, _ in TIP_RULES:
+        if any(w in lower for w in words):
+            return intent
+    return "default"
+
 def pick_motivation_for_text(text: str) -> str:
     """
     A tiny library of supportive, actionable, *very short* tips
     tailored to the user's likely state.
     """
-    lower = normalize(text)
-
-    if any(w in lower for w in ["angry", "furious", "mad", "frustrated"]):
-        return "Try a 90-second reset: slow inhale 4s, hold 4s, long exhale 6–8s. Shake out the shoulders."
-    if any(w in lower for w in ["anxious", "anxiety", "worried", "panic", "stressed", "overwhelmed"]):
-        return "Grounding tip: name 5 things you can see, 4 you can feel, 3 you can hear, 2 you can smell, 1 you can taste."
-    if any(w in lower for w in ["sad", "down", "unhappy", "low", "lonely"]):
-        return "Tiny lift: step outside for 2 minutes of fresh air or light; message someone you trust one sentence."
-    if any(w in lower for w in ["tired", "exhausted", "burnt out", "burned out", "fatigued"]):
-        return "Micro-recharge: 20-minute break with phone away, drink water, blink slowly 10 times."
-    if any(w in lower for w in ["sick", "ill", "fever", "pain", "hurts"]):
-        return "Be gentle today—hydrate, rest if you can, and consider a quick check-in with a clinician if symptoms persist."
-    if any(w in lower for w in ["bored", "meh"]):
-        return "Pick a 10-minute task with a clear finish—then reward yourself. Momentum beats motivation."
-    if any(w in lower for w in ["confused", "lost"]):
-        return "Write 3 bullet points: what you know, what you don’t, and one next step."
-    if any(w in lower for w in ["proud", "grateful", "happy", "excited", "great", "good"]):
-        return "Awesome—savor this! Take a breath and note one specific detail you appreciate right now."
-
-    return "Small steps count. Pick one doable action for the next 10 minutes—then come back and we’ll reflect."
+    return TIPS.get(_tip_intent(normalize(text)), DEFAULT_TIP)
 
 # ============================
 # Empathetic “local AI” reply
 # ============================
 
+# (intent, keywords, base reply) – first match wins
+BASE_RULES = [
+    ("sad", ["sad", "down", "depressed", "low", "lonely"],
+     "I'm really sorry you're feeling low. It's okay to have days like this. "
+     "Do you want to share what made today feel heavy?"),
+    ("anxious", ["anxious", "anxiety", "worried", "nervous", "stressed", "overwhelmed"],
+     "Anxiety and stress can feel intense. Let’s slow things down for a moment. "
+     "What thought or situation is most in front of you right now?"),
+    ("angry", ["angry", "mad", "frustrated", "furious"],
+     "It sounds like you're really frustrated or angry. Those feelings are valid. "
+     "What happened just before the anger showed up?"),
+    ("tired", ["tired", "exhausted", "burnt out", "burned out", "fatigued"],
+     "You sound drained. Fatigue can make everything feel harder. "
+     "Is it mental load, lack of sleep, or something specific today?"),
+    ("sick", ["sick", "ill", "fever", "pain", "hurts"],
+     "Not feeling well is rough. How are your symptoms right now, and do you have support if you need it?"),
+    ("confused", ["confused", "lost", "stuck"],
+     "Feeling stuck or confused is normal when things are complex. "
+     "Tell me the goal in one sentence—then we’ll map a next step."),
+    ("bored", ["bored", "meh", "nothing to do"],
+     "Boredom can hide behind low energy. What’s one tiny, doable activity you wouldn’t hate for 10 minutes?"),
+    ("positive", ["proud", "grateful", "happy", "good", "great", "excited"],
+     "I love hearing that. What exactly made you feel this way? Let’s highlight it so you can revisit it later."),
+    ("thanks", ["thank"],
+     "You're welcome—I'm here anytime. Is there anything else you want to explore right now?"),
+    ("help", ["help", "advice", "tips", "tip"],
+     "I’ll do my best to help. Can you describe the situation in a few bullet points so we can get specific?"),
+]
+DEFAULT_BASE = (
+    "Thank you for sharing. I’m here to listen and support you without judgment. "
+    "What feels most important to talk about next?"
+)
+BASES = {intent: base for intent, _, base in BASE_RULES}
+
+def _base_intent(lower: str) -> str:
+    for intent, words, _ in BASE_RULES:
+        if any(w in lower for w in words):
+            return intent
+    return "default"
+
+# ---- reply memoization ----
+# "I'm sad", "sad" and "sad!!" all classify the same way, so the rule scan
+# runs once per fingerprint and the reply text once per (intent, tip) pair.
+
+REPLY_CACHE_SIZE = int(os.getenv("AI_REPLY_CACHE_SIZE", "4096"))
+# longer messages are nearly always unique – don't let them churn the cache
+REPLY_CACHE_MAX_KEY_LEN = 200
+
+_FILLER_WORDS = {
+    "i", "im", "i'm", "am", "feel", "feeling", "so", "very", "really",
+    "just", "kinda", "pretty", "quite", "right", "now",
+}
+_NON_WORD_RE = re.compile(r"[^a-z0-9' ]+")
+
+def message_fingerprint(text: str) -> str:
+    words = _NON_WORD_RE.sub(" ", normalize(text).replace("’", "'")).split()
+    return " ".join(w for w in words if w not in _FILLER_WORDS)
+
+def _classify(lower: str) -> Tuple[str, str]:
+    return _base_intent(lower), _tip_intent(lower)
+
+_classify_cached = lru_cache(maxsize=REPLY_CACHE_SIZE)(_classify)
+
+@lru_cache(maxsize=256)
+def _compose_reply(base_intent: str, tip_intent: str) -> str:
+    base = BASES.get(base_intent, DEFAULT_BASE)
+    tip = TIPS.get(tip_intent, DEFAULT_TIP)
+    return f"{base}\n\n💡 Tip: {tip}"
+
+def reply_cache_stats() -> dict:
+    info = _classify_cached.cache_info()
+    total = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": round(info.hits / total, 4) if total else 0.0,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+    }
+
 def generate_reply(message: str, history: List[ChatMessage]) -> str:
     """
     Rule-based reply with an empathetic core and a short, tailored
     motivation tip appended. No external APIs required.
     """
-    text_in = message.strip()
-    lower = normalize(text_in)
+    fingerprint = message_fingerprint(message)
+    if len(fingerprint) <= REPLY_CACHE_MAX_KEY_LEN:
+        intents = _classify_cached(fingerprint)
+    else:
+        intents = _classify(fingerprint)
+    reply = _compose_reply(*intents)
 
     # Avoid repeating the exact last assistant message verbatim
     last_assistant = next((m.content for m in reversed(history) if m.role == "assistant"), "")
+    if last_assistant and last_assistant.strip() == reply.strip():
+        reply += "\n\nIf you’d like, we can try a different angle—what outcome would feel 10% better?"
 
-    # Core empathy block
-    if any(w in lower for w in ["sad", "down", "depressed", "low", "lonely"]):
-        base = (
-            "I'm really sorry you're feeling low. It's okay to have days like this. "
-            "Do you want to share what made today feel heavy?"
-        )
-    elif any(w in lower for w in ["anxious", "anxiety", "worried", "nervous", "stressed", "overwhelmed"]):
-        base = (
-            "Anxiety and stress can feel intense. Let’s slow things down for a moment. "
-            "What thought or situation is most in front of you right now?"
-        )
-    elif any(w in lower for w in ["angry", "mad", "frustrated", "furious"]):
-        base = (
-            "It sounds like you're really frustrated or angry. Those feelings are valid. "
-            "What happened just before the anger showed up?"
-        )
-    elif any(w in lower for w in ["tired", "exhausted", "burnt out", "burned out", "fatigued"]):
-        base = (
-            "You sound drained. Fatigue can make everything feel harder. "
-            "Is it mental load, lack of sleep, or something specific today?"
-        )
-    elif any(w in lower for w in ["sick", "ill", "fever", "pain", "hurts"]):
-        base = (
-            "Not feeling well is rough. How are your symptoms right now, and do you have support if you need it?"
-        )
-    elif any(w in lower for w in ["confused", "lost", "stuck"]):
-        base = (
-            "Feeling stuck or confused is normal when things are complex. "
-            "Tell me the goal in one sentence—then we’ll map a next step."
-        )
-    elif any(w in lower for w in ["bored", "meh", "nothing to do"]):
-        base = (
-            "Boredom can hide behind low energy. What’s one tiny, doable activity you wouldn’t hate for 10 minutes?"
-        )
-    elif any(w in lower for w in ["proud", "grateful", "happy", "good", "great", "excited"]):
-        base = (
-            "I love hearing that. What exactly made you feel this way? Let’s highlight it so you can revisit it later."
-        )
-    elif "thank" in lower:
-        base = (
-            "You're welcome—I'm here anytime. Is there anything else you want to explore right now?"
-        )
-    elif any(w in lower for w in ["help", "advice", "tips", "tip"]):
-        base = (
-            "I’ll do my best to help. Can you describe the situation in a few bullet points so we can get specific?"
+    return reply
+
+# Rule engine by default; AI_BACKEND=model plugs in a local model that
+# falls back to generate_reply on timeout / overload / no answer.
+reply_backend = load_backend(generate_reply)
+
+# ============================
+# Mood snapshot persistence
+# ============================
+
+def _recent_user_note(message: str, history: List[ChatMessage]) -> str:
+    user_texts = [m.content for m in history if m.role == "user"]
+    user_texts.append(message)
+    # Save only the most recent ~10 user messages as the "note"
+    return "\n".join(user_texts[-10:]).strip()
+
+
+def submit_mood_snapshot(user_id: str, note: str) -> None:
+    """
+    Hand the recent user text to the background snapshot buffer, which
+    coalesces per user and writes MoodEntries (checkin_slot=NULL) in
+    batches. Never raises – chat must not break because of a snapshot.
+    """
+    if not note:
+        return
+
+    try:
+        mood_score = estimate_mood_score(note)
+        snapshot_buffer.submit(
+            user_id=str(user_id),
+            score=mood_score,
+            label=mood_label_from_score(mood_score),
+            note=note,
         )
+    except Exception as e:
+        print("[AI] Failed to queue mood snapshot from AI chat:", e)
+
+# ============================
+# SSE helpers
+# ============================
+
+# sentence-ish pieces; trailing whitespace/newlines stay attached so that
+# joining all chunks gives back the exact reply
+_CHUNK_RE = re.compile(r"[^.!?\n]*[.!?]?\s*")
+
+def iter_reply_chunks(reply: str) -> Iterator[str]:
+    for piece in _CHUNK_RE.findall(reply):
+        if piece:
+            yield piece
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# ============================
+# Conversation state
+# ============================
+
+def _resolve_conversation(
+    req: ChatRequest,
+    db: Session,
+    user_id: str,
+) -> Tuple[Optional[ConversationState], List[ChatMessage]]:
+    """
+    Return (state, bounded history) for this request.
+    state is None for legacy requests that still upload their history.
+    """
+    if req.conversation_id:
+        state = conversation_store.get(db, req.conversation_id, user_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+    elif req.history:
+        # Keep only the last 30 turns total (user+assistant)
+        return None, req.history[-30:]
     else:
-        base = (
-            "Thank you for sharing. I’m here to listen and support you without judgment. "
-            "What feels most important to talk about next?"
-        )
+        state = conversation_store.create(user_id)
 
-    # Motivation tip
-    tip = pick_motivation_for_text(text_in)
-    reply = f"{base}\n\n💡 Tip: {tip}"
+    # turns come from our own store – no need to re-validate them
+    history = [ChatMessage.model_construct(role=r, content=c) for r, c in conversation_store.history(state)]
+    return state, history
 
-    if last_assistant and last_assistant.strip() == reply.strip():
-        reply += "\n\nIf you’d like, we can try a different angle—what outcome would feel 10% better?"
 
-    return reply
+async def _record_turns(state: Optional[ConversationState], message: str, reply: str) -> None:
+    """
+    Store the new user/assistant turns before the reply goes out, so a
+    turn the client saw is never missing from the conversation.
+    """
+    if state is None:
+        return
+    await asyncio.to_thread(
+        conversation_store.record, state, [("user", message), ("assistant", reply)]
+    )
 
 # ============================
 # FastAPI route
@@ -192,65 +311,123 @@ async def chat_with_ai(
     current_user: User = Depends(get_current_user),
 ) -> ChatResponse:
     """
-    1) Build a bounded 'recent history' (so chats can go on indefinitely).
+    1) Load the bounded 'recent history' (server-held conversation, or legacy upload).
     2) Generate an empathetic reply with a tailored motivation tip.
-    3) Estimate mood & save a MoodEntries record (checkin_slot=NULL).
+    3) Store the new turns (a failure is returned as 503, not lost).
+    4) Estimate mood & queue a coalesced MoodEntries snapshot (checkin_slot=NULL).
     """
 
-    # ---- 1) Bound history length to keep requests light (unlimited turns over time)
-    # Keep only the last 30 turns total (user+assistant)
-    bounded_history = req.history[-30:] if req.history else []
+    # ---- 1) Conversation history (bounded, so chats can go on indefinitely)
+    state, bounded_history = _resolve_conversation(req, db, current_user.user_id)
 
     # ---- 2) Generate reply
     try:
-        reply = generate_reply(req.message, bounded_history)
+        reply = await reply_backend.generate(req.message, bounded_history)
     except Exception as e:
-        print("[AI] local generate_reply error:", e)
+        print("[AI] reply backend error:", e)
         raise HTTPException(status_code=500, detail="Local AI error. Please try again.")
 
-    # ---- 3) Save mood snapshot based on the most recent user text (last ~10 user msgs)
+    # ---- 3) Keep conversation state server-side
     try:
-        user_texts = [m.content for m in bounded_history if m.role == "user"]
-        user_texts.append(req.message)
-        # Save only the most recent ~10 user messages as the "note"
-        recent_user_note = "\n".join(user_texts[-10:]).strip()
-
-        if recent_user_note:
-            mood_score = estimate_mood_score(recent_user_note)
-            label = mood_label_from_score(mood_score)
-
-            db.execute(
-                text(
-                    """
-                    INSERT INTO dbo.MoodEntries
-                        (user_id, checkin_slot, score, label,
-                         text_note_encrypted, emojis_json,
-                         captured_at, created_at)
-                    VALUES
-                        (
-                            :uid,
-                            :slot,
-                            :score,
-                            :label,
-                            CONVERT(VARBINARY(MAX), :note),
-                            :emojis,
-                            SYSDATETIMEOFFSET(),
-                            SYSDATETIMEOFFSET()
-                        )
-                    """
-                ),
-                {
-                    "uid": current_user.user_id,
-                    "slot": None,         # NULL to satisfy your CHECK constraint
-                    "score": mood_score,
-                    "label": label,
-                    "note": recent_user_note,
-                    "emojis": None,
-                },
-            )
-            db.commit()
+        await _record_turns(state, req.message, reply)
     except Exception as e:
-        # Never block the chat if saving fails
-        print("[AI] Failed to save mood entry from AI chat:", e)
+        print("[AI] failed to store conversation turns:", e)
+        raise HTTPException(status_code=503, detail="Could not save the conversation. Please try again.")
+
+    # ---- 4) Queue mood snapshot based on the most recent user text (last ~10 user msgs)
+    submit_mood_snapshot(
+        current_user.user_id,
+        _recent_user_note(req.message, bounded_history),
+    )
+
+    return ChatResponse(
+        reply=reply,
+        conversation_id=state.conversation_id if state else None,
+        turn=state.turn_count if state else None,
+    )
 
-    return ChatResponse(reply=reply)
+
+@router.post("/chat/stream")
+async def chat_with_ai_stream(
+    req: ChatRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> StreamingResponse:
+    """
+    Same as /ai/chat, but streamed as Server-Sent Events:
+
+        event: chunk  data: {"text": "..."}   (one or more)
+        event: done   data: {"reply": "<full reply>", "conversation_id": ..., "turn": ...}
+        event: error  data: {"detail": "..."} (instead of chunks/done)
+
+    The conversation turns are stored before the first chunk; the mood
+    snapshot is handed off after the stream has closed, and only when a
+    reply was produced (not after an error event).
+    """
+    state, bounded_history = _resolve_conversation(req, db, current_user.user_id)
+    note = _recent_user_note(req.message, bounded_history)
+    # set once a reply was generated and stored; a failed turn records no mood
+    replied = False
+
+    async def event_stream() -> AsyncIterator[str]:
+        nonlocal replied
+        try:
+            reply = await reply_backend.generate(req.message, bounded_history)
+        except Exception as e:
+            print("[AI] reply backend error:", e)
+            yield _sse_event("error", {"detail": "Local AI error. Please try again."})
+            return
+
+        try:
+            await _record_turns(state, req.message, reply)
+        except Exception as e:
+            print("[AI] failed to store conversation turns:", e)
+            yield _sse_event("error", {"detail": "Could not save the conversation. Please try again."})
+            return
+
+        replied = True
+
+        for chunk in iter_reply_chunks(reply):
+            yield _sse_event("chunk", {"text": chunk})
+            # let the server flush each chunk to the client
+            await asyncio.sleep(0)
+
+        yield _sse_event(
+            "done",
+            {
+                "reply": reply,
+                "conversation_id": state.conversation_id if state else None,
+                "turn": state.turn_count if state else None,
+            },
+        )
+
+    def _submit_snapshot() -> None:
+        if replied:
+            submit_mood_snapshot(current_user.user_id, note)
+
+    background = StarletteBackgroundTasks()
+    background.add_task(_submit_snapshot)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # disable proxy buffering (nginx)
+        },
+        background=background,
+    )
+
+
+@router.get("/cache-stats")
+def ai_cache_stats(_admin=Depends(get_current_admin)) -> dict:
+    """
+    Admin-only: reply memoization counters (and model backend stats if any).
+    """
+    return {
+        "reply_cache": reply_cache_stats(),
+        "backend": {
+            "name": reply_backend.name,
+            "stats": getattr(reply_backend, "stats", {}),
+        },
+    }
@@ -3,10 +3,10 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 from pydantic import BaseModel
 from typing import Optional, List, Any, Dict
-from server.utils.email import send_email
 import json
 
 from ..deps import get_db
+from ..email_outbox import email_sender, enqueue_email
 from .auth_routes import _user_id_from_authorization
 
 router = APIRouter(prefix="/appointments", tags=["appointments"])
@@ -345,7 +345,10 @@ Best regards,
 Mendly Team
 """
 
-        send_email(row.client_email, subject, body)
+        # queued, not sent inline: the click never waits on SMTP
+        enqueue_email(db, row.client_email, subject, body)
+        db.commit()
+        email_sender.notify()
 
     return AppointmentPublic(
         appointment_id=str(row.appointment_id),
@@ -1,10 +1,8 @@
 # server/routers/auth_routes.py
 import os
-import smtplib
 import secrets
 import string
 from datetime import datetime, timedelta, timezone
-from email.message import EmailMessage
 from typing import Dict
 
 # server/routers/auth_routes.py
@@ -19,6 +17,7 @@ from sqlalchemy.orm import Session
 from ..schemas import PsychologistCreate
 
 from ..deps import get_db
+from ..email_outbox import email_sender, enqueue_email
 from ..auth import (
     hash_password,
     verify_password,
@@ -247,31 +246,21 @@ def generate_reset_code() -> str:
     return "".join(secrets.choice(string.digits) for _ in range(6))
 
 
-def send_reset_email(to_email: str, code: str) -> None:
-    email_user = os.getenv("EMAIL")
-    email_pass = os.getenv("EMAILPASSWORD")
-
-    if not email_user or not email_pass:
-        print("[email] EMAIL or EMAILPASSWORD missing in .env")
-        return
-
-    msg = EmailMessage()
-    msg["Subject"] = "Mendly – Password Reset Code"
-    msg["From"] = email_user
-    msg["To"] = to_email
-    msg.set_content(
+def send_reset_email(db: Session, to_email: str, code: str, expires_at: datetime) -> None:
+    """
+    Queue the reset code email (server/email_outbox.py). It is dropped
+    instead of sent once the code has expired.
+    """
+    enqueue_email(
+        db,
+        to_email,
+        "Mendly – Password Reset Code",
         f"Your Mendly password reset code is: {code}\n\n"
-        "This code is valid for 10 minutes."
+        "This code is valid for 10 minutes.",
+        expires_at=expires_at,
     )
-
-    try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(email_user, email_pass)
-            server.send_message(msg)
-        print(f"[email] Reset code sent to {to_email}")
-    except Exception as e:
-        print("[email] Failed to send email:", e)
+    db.commit()
+    email_sender.notify()
 
 
 @router.post("/forgot-password/start")
@@ -300,7 +289,7 @@ def forgot_password_start(
     expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
     RESET_CODES[email] = {"code": code, "expires_at": expires_at}
 
-    send_reset_email(email, code)
+    send_reset_email(db, email, code, expires_at)
 
     return {"ok": True, "message": "If this email is registered, a code was sent."}
 
@@ -8,6 +8,7 @@ from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from ..deps import get_db
+from ..sentiment import score_text
 from .auth_routes import _user_id_from_authorization
 
 router = APIRouter(prefix="/checkin", tags=["checkin"])
@@ -39,48 +40,15 @@ LABEL_SCORES = {
     "happy": 10,
 }
 
-# keyword rules for free-text "note" (you can extend this list any time)
-# first match wins – order from strongest negative to strongest positive
-KEYWORD_RULES = [
-    # very low mood
-    (["depressed", "miserable", "hopeless", "suicidal"], 1),
-    # low / sad
-    (["very sad", "so sad", "really sad"], 2),
-    (["sad", "down", "crying", "lonely", "unhappy"], 3),
-    # anxiety / stress
-    (["panic attack", "panic"], 2),
-    (["very anxious", "super anxious"], 2),
-    (["anxious", "anxiety", "worried", "stressed", "overwhelmed"], 3),
-    # tired / meh
-    (["exhausted", "burnt out", "burned out"], 3),
-    (["tired", "drained", "no energy"], 4),
-    (["meh", "bored"], 5),
-    # okay / calm
-    (["fine", "okay", "ok", "calm"], 7),
-    # positive
-    (["good day", "feeling good"], 7),
-    (["happy", "better", "grateful", "relieved"], 9),
-    (["amazing", "fantastic", "great", "awesome", "wonderful"], 10),
-]
-
-def _normalize_text(s: Optional[str]) -> str:
-  return (s or "").strip().lower()
-
-
 def estimate_score_from_text(note: Optional[str]) -> Optional[int]:
     """
-    Look for known keywords inside the note and return a score 1..10.
-    If nothing matches, return None and let caller decide a default.
+    Score the free-text note 0..10 with the shared lexicon engine.
+    If no known word is found, return None and let caller decide a default.
     """
-    text = _normalize_text(note)
-    if not text:
+    score = score_text(note)
+    if score is None:
         return None
-
-    for keywords, score in KEYWORD_RULES:
-        if any(k in text for k in keywords):
-            return score
-
-    return None  # no keyword matched
+    return int(round(score))
 
 
 def compute_final_score(payload: CheckinPayload) -> int:
@@ -101,7 +69,7 @@ def compute_final_score(payload: CheckinPayload) -> int:
         if lbl in LABEL_SCORES:
             return LABEL_SCORES[lbl]
 
-    # 3) free text – try to infer from keywords
+    # 3) free text – try to infer from the note
     inferred = estimate_score_from_text(payload.note)
     if inferred is not None:
         return inferred
@@ -1,8 +1,11 @@
 # server/routers/device_routes.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
 
 from .. import models, schemas, deps, auth
+from ..tip_topics import sync_user_tip_topics
 
 router = APIRouter(prefix="/devices", tags=["devices"])
 
@@ -10,6 +13,7 @@ router = APIRouter(prefix="/devices", tags=["devices"])
 @router.post("/register", response_model=dict)
 def register_device(
     payload: schemas.DeviceRegister,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(deps.get_db),
     current_user: models.User = Depends(auth.get_current_user),
 ):
@@ -21,27 +25,45 @@ def register_device(
     if payload.platform not in ("android", "ios"):
         raise HTTPException(status_code=400, detail="Invalid platform")
 
-    # Check if token exists already
-    existing = (
-        db.query(models.UserDeviceToken)
-        .filter(models.UserDeviceToken.fcm_token == payload.fcm_token)
-        .first()
-    )
-
-    if existing:
-        existing.user_id = current_user.user_id
-        existing.platform = payload.platform
-        existing.app_version = payload.app_version
-        existing.is_active = True
-    else:
-        new_token = models.UserDeviceToken(
-            user_id=current_user.user_id,
-            platform=payload.platform,
-            fcm_token=payload.fcm_token,
-            app_version=payload.app_version,
-            is_active=True,
+    # fcm_token is UNIQUE, so re-registering the same token (app restart,
+    # account switch on the same phone) updates the row instead of adding
+    # a second one that would get every push twice.
+    for _ in range(2):
+        existing = (
+            db.query(models.UserDeviceToken)
+            .filter(models.UserDeviceToken.fcm_token == payload.fcm_token)
+            .first()
         )
-        db.add(new_token)
 
-    db.commit()
+        if existing:
+            existing.user_id = current_user.user_id
+            existing.platform = payload.platform
+            existing.app_version = payload.app_version
+            if payload.language:
+                existing.language = payload.language[:10]
+            existing.is_active = True
+            # keeps the token out of the stale-token sweep
+            existing.last_seen = func.sysdatetimeoffset()
+        else:
+            new_token = models.UserDeviceToken(
+                user_id=current_user.user_id,
+                platform=payload.platform,
+                fcm_token=payload.fcm_token,
+                app_version=payload.app_version,
+                language=payload.language[:10] if payload.language else None,
+                is_active=True,
+            )
+            db.add(new_token)
+
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            # a concurrent request registered the same token first -> update it
+            db.rollback()
+    else:
+        raise HTTPException(status_code=409, detail="Device registration conflict")
+
+    # FCM topic (un)subscribe calls happen after the response
+    background_tasks.add_task(sync_user_tip_topics, str(current_user.user_id))
     return {"ok": True}
@@ -1,11 +1,14 @@
 # server/routers/positive_notifications_routes.py
-from fastapi import APIRouter, Depends
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from pydantic import BaseModel, Field, field_validator
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-import json
 
 from ..deps import get_db
+from ..notification_templates import PARAMS_JSON_MAX_LENGTH, dump_params, params_fit
+from ..notification_worker import notify_enqueued, signal_enqueued
+from ..tip_topics import sync_user_tip_topics
+from ..utils.timezones import is_valid_zone
 from .auth_routes import _user_id_from_authorization
 
 router = APIRouter(
@@ -26,11 +29,40 @@ class PositiveNotificationSettings(BaseModel):
         le=1440 * 7,  # up to one week
         description="Interval between notifications in minutes",
     )
+    # opt-in delivery policy (notification_policies); null -> server default
+    quiet_start_hour: int | None = Field(
+        None, ge=0, le=23, description="Local hour from which no pushes are sent"
+    )
+    quiet_end_hour: int | None = Field(
+        None, ge=0, le=23, description="Local hour at which pushes resume"
+    )
+    max_pushes_per_day: int | None = Field(
+        None, ge=0, le=255, description="Pushes per 24 hours (0: no cap)"
+    )
+    # local time for quiet hours and check-in reminders; null -> server default
+    timezone: str | None = Field(
+        None, max_length=64, description="IANA timezone, e.g. 'Asia/Jerusalem'"
+    )
+
+    @field_validator("timezone")
+    @classmethod
+    def _known_timezone(cls, v: str | None) -> str | None:
+        if v is None:
+            return None
+        v = v.strip()
+        if not is_valid_zone(v):
+            raise ValueError("unknown timezone")
+        return v
+
+
+# optional fields: only the ones the client sent are changed on save, so
+# an app version that doesn't know them never clears them
+_OPTIONAL_COLUMNS = ("quiet_start_hour", "quiet_end_hour", "max_pushes_per_day", "timezone")
 
 
 class TestPositiveNotification(BaseModel):
-    # optional custom body for test push
-    body: str | None = None
+    # optional custom body for test push (must fit params_json once serialized)
+    body: str | None = Field(default=None, max_length=300)
 
 
 # ---------- Helpers ----------
@@ -54,91 +86,137 @@ def _row_to_settings(row) -> PositiveNotificationSettings:
         else 60
     )
 
-    return PositiveNotificationSettings(enabled=enabled, frequency_minutes=freq)
-
+    return PositiveNotificationSettings(
+        enabled=enabled,
+        frequency_minutes=freq,
+        quiet_start_hour=row.quiet_start_hour,
+        quiet_end_hour=row.quiet_end_hour,
+        max_pushes_per_day=row.max_pushes_per_day,
+        timezone=row.timezone,
+    )
 
-# ---------- Routes ----------
 
-@router.get("/settings", response_model=PositiveNotificationSettings)
-def get_positive_notifications_settings(
-    user_id: str = Depends(_user_id_from_authorization),
-    db: Session = Depends(get_db),
-):
-    """
-    Return the positive notification settings for the current user.
-    Falls back to sensible defaults if missing.
-    """
+def _load_settings(db: Session, user_id: str) -> PositiveNotificationSettings:
     row = db.execute(
         text(
             """
             SELECT TOP 1
                 positive_notif_enabled,
-                positive_notif_interval_minutes
+                positive_notif_interval_minutes,
+                quiet_start_hour,
+                quiet_end_hour,
+                max_pushes_per_day,
+                timezone
             FROM dbo.UserSettings
             WHERE user_id = :uid
             """
         ),
         {"uid": user_id},
     ).fetchone()
-
     return _row_to_settings(row)
 
 
+# ---------- Routes ----------
+
+@router.get("/settings", response_model=PositiveNotificationSettings)
+def get_positive_notifications_settings(
+    user_id: str = Depends(_user_id_from_authorization),
+    db: Session = Depends(get_db),
+):
+    """
+    Return the positive notification settings for the current user.
+    Falls back to sensible defaults if missing.
+    """
+    return _load_settings(db, user_id)
+
+
 @router.post("/settings", response_model=PositiveNotificationSettings)
 def update_positive_notifications_settings(
     payload: PositiveNotificationSettings,
+    background_tasks: BackgroundTasks,
     user_id: str = Depends(_user_id_from_authorization),
     db: Session = Depends(get_db),
 ):
     """
     Update (or create) the positive notification settings for this user
-    in dbo.UserSettings.
+    in dbo.UserSettings. A new timezone resets the user's check-in
+    reminder times (CheckinSchedule.next_fire_at), which the scheduler
+    then recomputes.
     """
 
+    optional = {
+        col: getattr(payload, col)
+        for col in _OPTIONAL_COLUMNS
+        if col in payload.model_fields_set
+    }
+    params = {
+        "uid": user_id,
+        "enabled": 1 if payload.enabled else 0,
+        "freq": payload.frequency_minutes,
+        **optional,
+    }
+
     # First try to update an existing row
-    result = db.execute(
+    updated = db.execute(
         text(
-            """
+            f"""
             UPDATE dbo.UserSettings
             SET
                 positive_notif_enabled = :enabled,
-                positive_notif_interval_minutes = :freq
+                positive_notif_interval_minutes = :freq,
+                {"".join(f"{col} = :{col}, " for col in optional)}
+                -- restart the tip cadence from now (NULL while disabled)
+                next_positive_at = CASE WHEN :enabled = 1
+                    THEN DATEADD(MINUTE, :freq, SYSDATETIMEOFFSET()) END
+            OUTPUT deleted.timezone AS old_tz, inserted.timezone AS new_tz
             WHERE user_id = :uid
             """
         ),
-        {
-            "uid": user_id,
-            "enabled": 1 if payload.enabled else 0,
-            "freq": payload.frequency_minutes,
-        },
-    )
+        params,
+    ).fetchall()
 
     # If no row was updated, insert a new one with basic defaults
-    if result.rowcount == 0:
+    if not updated:
         db.execute(
             text(
-                """
+                f"""
                 INSERT INTO dbo.UserSettings
                     (user_id,
                      checkin_frequency,
                      motivation_enabled,
                      positive_notif_enabled,
-                     positive_notif_interval_minutes)
+                     positive_notif_interval_minutes,
+                     {"".join(f"{col}, " for col in optional)}
+                     next_positive_at)
                 VALUES
-                    (:uid, :checkin_freq, :motivation_on, :enabled, :freq)
+                    (:uid, :checkin_freq, :motivation_on, :enabled, :freq,
+                     {"".join(f":{col}, " for col in optional)}
+                     CASE WHEN :enabled = 1
+                         THEN DATEADD(MINUTE, :freq, SYSDATETIMEOFFSET()) END)
                 """
             ),
             {
-                "uid": user_id,
+                **params,
                 "checkin_freq": 1,        # default check-in frequency
                 "motivation_on": 1,       # default motivation enabled
-                "enabled": 1 if payload.enabled else 0,
-                "freq": payload.frequency_minutes,
             },
         )
+        tz_changed = optional.get("timezone") is not None
+    else:
+        tz_changed = updated[0].old_tz != updated[0].new_tz
+
+    if tz_changed:
+        # check-in reminders fire at local times: recompute them in the new zone
+        db.execute(
+            text("UPDATE dbo.CheckinSchedule SET next_fire_at = NULL WHERE user_id = :uid"),
+            {"uid": user_id},
+        )
 
     db.commit()
-    return payload
+    # move the user's devices to the tip topic for the new frequency
+    # (or off the topics, when they now have their own quiet hours / cap)
+    background_tasks.add_task(sync_user_tip_topics, user_id)
+    return _load_settings(db, user_id)
 
 
 # ---------- Test notification ----------
@@ -150,61 +228,42 @@ def send_test_positive_notification(
     db: Session = Depends(get_db),
 ):
     """
-    Enqueue a single test positive notification for this user.
-
-    IMPORTANT:
-    We use purpose='checkin_reminder' because the existing
-    notification_worker already knows how to process that purpose.
+    Enqueue a single test positive notification (purpose='tip') for this user.
     """
     # 1) Optional custom message body
     message_body = (
         payload.body
         or "This is a test positive notification from Mendly 🌱"
     )
+    # quotes, backslashes and emoji take more room once serialized
+    params = dump_params({"body": message_body})
+    if not params_fit(params):
+        raise HTTPException(
+            status_code=422,
+            detail=f"Message too long (max {PARAMS_JSON_MAX_LENGTH} characters once encoded)",
+        )
 
-    # 2) Pick latest active device token from UserDeviceTokens
-    #    (your columns: token_id, user_id, platform, fcm_token, last_seen, is_active)
-    token_row = db.execute(
-        text(
-            """
-            SELECT TOP 1 token_id
-            FROM dbo.UserDeviceTokens
-            WHERE user_id = :uid AND is_active = 1
-            ORDER BY last_seen DESC
-            """
-        ),
-        {"uid": user_id},
-    ).fetchone()
-
-    token_id = token_row.token_id if token_row is not None else None
-
-    # 3) Build payload json – worker will send title/body from this
-    payload_json = json.dumps(
-        {
-            "title": "Mendly • Test positive message",
-            "body": message_body,
-            "kind": "test_positive",
-        }
-    )
-
-    # 4) Insert into NotificationQueue with purpose that worker already handles
+    # 2) Insert into NotificationQueue: only the template id and its params,
+    #    the worker renders the text at send time.
+    #    token_id stays NULL: the worker fans out to all active devices.
     db.execute(
         text(
             """
             INSERT INTO dbo.NotificationQueue
-                (user_id, token_id, purpose, payload_json, scheduled_at, status)
+                (user_id, token_id, purpose, template_id, params_json, scheduled_at, status)
             VALUES
-                (:uid, :token_id, N'checkin_reminder', :payload_json,
-                 SYSDATETIMEOFFSET(), N'pending')
+                (:uid, NULL, N'tip', N'test_positive', :params, SYSDATETIMEOFFSET(), N'pending')
             """
         ),
         {
             "uid": user_id,
-            "token_id": token_id,          # can be NULL – same as older rows
-            "payload_json": payload_json,
+            "params": params,
         },
     )
 
+    # wakes a standalone worker too, not only one in this process
+    signal_enqueued(db)
     db.commit()
+    notify_enqueued()
     # 204 No Content
     return
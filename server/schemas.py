@@ -90,6 +90,7 @@ class DeviceRegister(BaseModel):
     fcm_token: str
     platform: str  # 'android' or 'ios'
     app_version: Optional[str] = None
+    language: Optional[str] = None  # app locale, e.g. 'en' / 'he-IL'
 
 class PsychologistCreate(BaseModel):
     username: UsernameStr  # type: ignore
@@ -0,0 +1,275 @@
+# server/sentiment.py
+# Lexicon-based mood scoring shared by the check-in and AI chat routers.
+#
+# Text is tokenized once (whole words, so "good" no longer matches inside
+# "goodbye"); multi-word phrases are matched first, then negators ("not",
+# "never", "don't", "dont", ...) flip and dampen the next few sentiment words and
+# intensifiers ("very", "so", "slightly", ...) scale them. The result is the
+# mean valence of all hits mapped onto the 0..10 mood scale.
+#
+# score_texts() is the batch API used by backfills / exports: it reuses the
+# compiled regex and lexicon tables for every text, so rescoring historical
+# notes runs at tens of thousands of notes per second in pure Python.
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text as sql_text
+from sqlalchemy.orm import Session
+
+NEUTRAL_SCORE = 5.0
+
+# valence relative to neutral (5): -5 .. +5
+LEXICON: Dict[str, float] = {
+    # very low mood
+    "suicidal": -5.0,
+    "hopeless": -4.5,
+    "depressed": -4.0,
+    "miserable": -4.0,
+    "terrible": -4.0,
+    "awful": -4.0,
+    # anger
+    "furious": -3.5,
+    "rage": -3.0,
+    "angry": -3.0,
+    "mad": -2.5,
+    "frustrated": -2.5,
+    # sad
+    "crying": -2.5,
+    "unhappy": -2.5,
+    "sad": -2.0,
+    "lonely": -2.0,
+    "down": -1.5,
+    "low": -1.5,
+    # anxiety / stress
+    "panic attack": -3.5,
+    "panic": -3.0,
+    "overwhelmed": -2.5,
+    "anxious": -2.0,
+    "anxiety": -2.0,
+    "worried": -2.0,
+    "stressed": -2.0,
+    "nervous": -1.5,
+    # tired
+    "burnt out": -2.5,
+    "burned out": -2.5,
+    "exhausted": -2.0,
+    "drained": -1.5,
+    "fatigued": -1.5,
+    "no energy": -1.5,
+    "tired": -1.0,
+    # sick
+    "sick": -2.0,
+    "ill": -2.0,
+    "fever": -2.0,
+    "pain": -2.0,
+    "hurts": -2.0,
+    # confused / stuck / bored
+    "confused": -1.0,
+    "lost": -1.0,
+    "stuck": -1.0,
+    "don't know": -1.0,
+    "dont know": -1.0,
+    "bored": -0.5,
+    "meh": -0.5,
+    "nothing to do": -0.5,
+    # okay / calm
+    "fine": 1.5,
+    "okay": 1.5,
+    "ok": 1.5,
+    "calm": 2.0,
+    # positive
+    "good": 2.0,
+    "good day": 2.5,
+    "better": 2.5,
+    "relieved": 3.0,
+    "proud": 3.0,
+    "happy": 3.5,
+    "grateful": 3.5,
+    "excited": 3.5,
+    # very positive
+    "great": 4.0,
+    "amazing": 4.5,
+    "fantastic": 4.5,
+    "awesome": 4.5,
+    "wonderful": 4.5,
+    "ecstatic": 5.0,
+}
+
+NEGATORS = {
+    "not", "no", "never", "nor", "neither", "without", "hardly",
+    "cannot", "nothing", "nobody",
+    # contractions typed without the apostrophe ("n't" forms match by suffix)
+    "dont", "doesnt", "didnt", "cant", "couldnt", "wont", "wouldnt",
+    "shouldnt", "isnt", "arent", "wasnt", "werent", "havent", "hasnt",
+    "hadnt", "aint", "mustnt", "neednt",
+}
+
+INTENSIFIERS: Dict[str, float] = {
+    "very": 1.3,
+    "so": 1.3,
+    "really": 1.3,
+    "too": 1.2,
+    "totally": 1.2,
+    "super": 1.4,
+    "extremely": 1.5,
+    "incredibly": 1.5,
+    # dampeners
+    "slightly": 0.6,
+    "somewhat": 0.7,
+    "kinda": 0.7,
+    "bit": 0.7,
+    "little": 0.7,
+}
+
+# a negator affects at most this many following tokens, and never past a
+# clause break
+NEGATION_SCOPE = 3
+NEGATION_FACTOR = -0.5
+CLAUSE_BREAKS = {".", ",", "!", "?", ";", "but"}
+
+_TOKEN_RE = re.compile(r"[a-z]+(?:'[a-z]+)?|[.,!?;]")
+
+# phrases indexed by their first token, longest first
+_PHRASES: Dict[str, List[Tuple[Tuple[str, ...], float]]] = {}
+for _term, _val in LEXICON.items():
+    _words = tuple(_term.split())
+    if len(_words) > 1:
+        _PHRASES.setdefault(_words[0], []).append((_words, _val))
+for _lst in _PHRASES.values():
+    _lst.sort(key=lambda p: -len(p[0]))
+
+
+def tokenize(s: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall((s or "").lower().replace("’", "'"))
+
+
+def _is_negator(tok: str) -> bool:
+    return tok in NEGATORS or tok.endswith("n't")
+
+
+def _valences(tokens: List[str]) -> List[float]:
+    hits: List[float] = []
+    negate_left = 0
+    boost = 1.0
+    boost_left = 0
+
+    i = 0
+    n = len(tokens)
+    while i < n:
+        tok = tokens[i]
+
+        if tok in CLAUSE_BREAKS:
+            negate_left = 0
+            boost_left = 0
+            i += 1
+            continue
+
+        # 1) phrases first ("no energy", "burnt out", "don't know", ...)
+        matched = None
+        for words, val in _PHRASES.get(tok, ()):
+            if tuple(tokens[i : i + len(words)]) == words:
+                matched = (len(words), val)
+                break
+
+        if matched is None and tok in LEXICON:
+            matched = (1, LEXICON[tok])
+
+        if matched is not None:
+            width, val = matched
+            if boost_left > 0:
+                val *= boost
+            if negate_left > 0:
+                val *= NEGATION_FACTOR
+            hits.append(val)
+            negate_left = 0
+            boost_left = 0
+            i += width
+            continue
+
+        # 2) modifiers for the next sentiment word
+        if _is_negator(tok):
+            negate_left = NEGATION_SCOPE
+        elif tok in INTENSIFIERS:
+            boost = INTENSIFIERS[tok]
+            boost_left = 2
+        else:
+            negate_left = max(0, negate_left - 1)
+            boost_left = max(0, boost_left - 1)
+        i += 1
+
+    return hits
+
+
+def score_tokens(tokens: List[str]) -> Optional[float]:
+    """
+    Mood score 0..10 for an already tokenized text,
+    or None if no lexicon word was found.
+    """
+    hits = _valences(tokens)
+    if not hits:
+        return None
+    score = NEUTRAL_SCORE + sum(hits) / len(hits)
+    return max(0.0, min(10.0, score))
+
+
+def score_text(s: Optional[str]) -> Optional[float]:
+    return score_tokens(tokenize(s))
+
+
+def score_texts(texts: Iterable[Optional[str]]) -> List[Optional[float]]:
+    """
+    Batch API: score many texts in one call (None where nothing matched).
+    """
+    return [score_tokens(_TOKEN_RE.findall((t or "").lower().replace("’", "'"))) for t in texts]
+
+
+def mood_score(s: Optional[str], default: int = int(NEUTRAL_SCORE)) -> int:
+    """
+    Integer 0..10 score for storing in dbo.MoodEntries.score.
+    """
+    score = score_text(s)
+    return default if score is None else int(round(score))
+
+
+def rescore_mood_entries(
+    db: Session,
+    batch_size: int = 5000,
+    user_id: Optional[str] = None,
+) -> Iterator[List[Tuple[str, int, Optional[int]]]]:
+    """
+    Walk dbo.MoodEntries that have a text note in keyset-paged batches and
+    yield [(mood_id, stored_score, new_score), ...] per page. Read-only:
+    callers (backfills, exports, analytics) decide what to write.
+    """
+    last_id = None
+    while True:
+        rows = db.execute(
+            sql_text(
+                """
+                SELECT TOP (:n)
+                    mood_id,
+                    score,
+                    CONVERT(NVARCHAR(MAX), text_note_encrypted) AS note
+                FROM dbo.MoodEntries
+                WHERE text_note_encrypted IS NOT NULL
+                  AND (:uid IS NULL OR user_id = :uid)
+                  AND (:last_id IS NULL OR mood_id > :last_id)
+                ORDER BY mood_id
+                """
+            ),
+            {"n": batch_size, "uid": user_id, "last_id": last_id},
+        ).fetchall()
+
+        if not rows:
+            return
+
+        scores = score_texts(r.note for r in rows)
+        yield [
+            (
+                str(r.mood_id),
+                int(r.score),
+                None if s is None else int(round(s)),
+            )
+            for r, s in zip(rows, scores)
+        ]
+        last_id = rows[-1].mood_id
@@ -0,0 +1,232 @@
+# server/tip_scheduler.py
+# Positive-notification ("tip") scheduler (replaces
+# dbo.EnqueuePositiveNotifications, which sent at most one tip a day).
+#
+# UserSettings.next_positive_at holds each user's next tip time. A pass
+# claims only the users due within TIP_LOOKAHEAD_MIN (filtered index on
+# next_positive_at), enqueues their tips in bulk and advances
+# next_positive_at by positive_notif_interval_minutes, all in one
+# transaction per chunk. Work per tick is proportional to due users.
+#
+# With TIP_DELIVERY=topic (default) tips are broadcast instead: one
+# dbo.BroadcastQueue row per segment topic (see tip_topics.py) and fire
+# time, fired on interval boundaries, so queue writes and FCM calls scale
+# with the number of segments, not users. Users with their own quiet hours
+# or daily cap still get direct tips, so the worker can apply them, and so
+# do users none of whose devices is on a tip topic yet (subscription failed
+# or pending, FCM disabled / HTTP stand-in transport).
+#
+# Runs inside the scheduler process (python -m server.checkin_scheduler).
+import os
+import json
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from .db import SessionLocal
+from .tip_topics import own_policy_sql, parse_tip_topic, sync_pending_users, topic_delivery_enabled
+
+log = logging.getLogger("mendly.tip_scheduler")
+
+TIP_CHUNK_SIZE = int(os.getenv("TIP_CHUNK_SIZE", "2000"))
+TIP_LOOKAHEAD_MIN = int(os.getenv("TIP_LOOKAHEAD_MIN", "10"))
+# topic mode: users whose devices still need a topic subscription, per pass
+TIP_TOPIC_SYNC_PER_PASS = int(os.getenv("TIP_TOPIC_SYNC_PER_PASS", "500"))
+
+def _direct_filter(direct_only: bool) -> str:
+    # topic mode: users topic delivery leaves out, i.e. their own policy
+    # or no active device with a confirmed tip topic subscription
+    if not direct_only:
+        return ""
+    return f"""
+        AND ({own_policy_sql('')}
+             OR NOT EXISTS (
+                 SELECT 1 FROM dbo.UserDeviceTokens t
+                 WHERE t.user_id = dbo.UserSettings.user_id
+                   AND t.is_active = 1
+                   AND t.tip_topic IS NOT NULL))
+    """
+
+
+def _init_unset(db, n: int, direct_only: bool = False) -> int:
+    """
+    First tip for users who just enabled tips / never had one scheduled:
+    one interval from now.
+    """
+    res = db.execute(
+        text(
+            f"""
+            UPDATE TOP (:n) dbo.UserSettings
+            SET next_positive_at = DATEADD(MINUTE, positive_notif_interval_minutes, SYSDATETIMEOFFSET())
+            WHERE positive_notif_enabled = 1
+              AND next_positive_at IS NULL
+              {_direct_filter(direct_only)}
+            """
+        ),
+        {"n": n},
+    )
+    db.commit()
+    return res.rowcount or 0
+
+
+def _claim_and_enqueue(db, horizon: datetime, n: int, direct_only: bool = False) -> int:
+    """
+    Advance next_positive_at for up to n due users and enqueue one tip
+    each at its fire time. A fire time that is already more than one
+    interval in the past (scheduler was down) restarts from now instead
+    of sending a burst of catch-up tips. direct_only limits it to the
+    users topic delivery leaves out (see _direct_filter).
+    """
+    due = db.execute(
+        text(
+            f"""
+            WITH due AS (
+                SELECT TOP (:n) user_id, next_positive_at, positive_notif_interval_minutes
+                FROM dbo.UserSettings WITH (ROWLOCK, READPAST, UPDLOCK)
+                WHERE positive_notif_enabled = 1
+                  AND next_positive_at <= :horizon
+                  {_direct_filter(direct_only)}
+                ORDER BY next_positive_at
+            )
+            UPDATE due
+            SET next_positive_at = CASE
+                    WHEN DATEADD(MINUTE, positive_notif_interval_minutes, next_positive_at) > SYSDATETIMEOFFSET()
+                        THEN DATEADD(MINUTE, positive_notif_interval_minutes, next_positive_at)
+                    ELSE DATEADD(MINUTE, positive_notif_interval_minutes, SYSDATETIMEOFFSET())
+                END
+            OUTPUT inserted.user_id, deleted.next_positive_at AS fire_at
+            """
+        ),
+        {"n": n, "horizon": horizon},
+    ).fetchall()
+
+    if due:
+        db.execute(
+            text(
+                """
+                INSERT INTO dbo.NotificationQueue
+                    (user_id, token_id, purpose, template_id, scheduled_at, status)
+                SELECT j.user_id, NULL, N'tip', N'tip',
+                       CASE WHEN j.fire_at > SYSDATETIMEOFFSET() THEN j.fire_at ELSE SYSDATETIMEOFFSET() END,
+                       N'pending'
+                FROM OPENJSON(:due) WITH (
+                        user_id UNIQUEIDENTIFIER '$.user_id',
+                        fire_at DATETIMEOFFSET   '$.fire_at'
+                     ) j
+                JOIN dbo.Users u ON u.user_id = j.user_id AND u.is_deleted = 0
+                """
+            ),
+            {
+                "due": json.dumps(
+                    [
+                        {"user_id": str(r.user_id), "fire_at": r.fire_at.isoformat()}
+                        for r in due
+                    ]
+                ),
+            },
+        )
+    db.commit()
+    return len(due)
+
+
+def _broadcast_fire_times(interval_minutes: int, now: datetime, horizon: datetime) -> List[datetime]:
+    # interval boundaries counted from the epoch: every scheduler computes
+    # the same times, and the unique (topic, scheduled_at) key dedupes them
+    step = max(1, interval_minutes) * 60
+    t = -(-int(now.timestamp()) // step) * step
+    out = []
+    while t <= horizon.timestamp():
+        out.append(datetime.fromtimestamp(t, timezone.utc))
+        t += step
+    return out
+
+
+def _enqueue_broadcasts(db, now: datetime, horizon: datetime) -> int:
+    topics = db.execute(
+        text(
+            """
+            SELECT DISTINCT tip_topic
+            FROM dbo.UserDeviceTokens
+            WHERE is_active = 1 AND tip_topic IS NOT NULL
+            """
+        )
+    ).fetchall()
+
+    rows = []
+    for r in topics:
+        parsed = parse_tip_topic(r.tip_topic)
+        if parsed is None:
+            continue
+        for fire in _broadcast_fire_times(parsed[1], now, horizon):
+            rows.append({"topic": r.tip_topic, "scheduled_at": fire.isoformat()})
+    if not rows:
+        return 0
+
+    insert = text(
+        """
+        INSERT INTO dbo.BroadcastQueue (topic, purpose, template_id, scheduled_at)
+        SELECT b.topic, N'tip', N'tip', b.scheduled_at
+        FROM OPENJSON(:rows) WITH (
+                topic        NVARCHAR(200)  '$.topic',
+                scheduled_at DATETIMEOFFSET '$.scheduled_at'
+             ) b
+        WHERE NOT EXISTS (
+                SELECT 1 FROM dbo.BroadcastQueue q
+                WHERE q.topic = b.topic AND q.scheduled_at = b.scheduled_at
+        )
+        """
+    )
+    for attempt in range(2):
+        try:
+            res = db.execute(insert, {"rows": json.dumps(rows)})
+            db.commit()
+            return res.rowcount or 0
+        except IntegrityError as e:
+            # another scheduler inserted the same (topic, fire time) first;
+            # the NOT EXISTS guard skips it on the retry
+            db.rollback()
+            log.warning("Duplicate broadcast while enqueueing tips (attempt %s): %r", attempt + 1, e)
+    return 0
+
+
+def run_tip_pass(chunk_size: int = TIP_CHUNK_SIZE, lookahead_min: int = TIP_LOOKAHEAD_MIN) -> Dict[str, float]:
+    """
+    Enqueue every tip due before now + lookahead. Returns metrics.
+    """
+    t0 = time.perf_counter()
+    horizon = datetime.now(timezone.utc) + timedelta(minutes=lookahead_min)
+    stats: Dict[str, float] = {"initialized": 0, "enqueued": 0, "chunks": 0}
+
+    # topic mode: broadcasts for the segments, direct tips only for users
+    # with their own quiet hours / cap or without a tip topic
+    direct_only = topic_delivery_enabled()
+    if direct_only:
+        with SessionLocal() as db:
+            stats["topic_synced_users"] = sync_pending_users(db, TIP_TOPIC_SYNC_PER_PASS)
+            stats["broadcasts"] = _enqueue_broadcasts(db, datetime.now(timezone.utc), horizon)
+
+    with SessionLocal() as db:
+        while True:
+            changed = _init_unset(db, chunk_size, direct_only)
+            stats["initialized"] += changed
+            if changed < chunk_size:
+                break
+
+        # a user with an interval shorter than the lookahead comes back
+        # within the horizon and gets one tip per interval, each at its
+        # own fire time
+        while True:
+            n = _claim_and_enqueue(db, horizon, chunk_size, direct_only)
+            stats["enqueued"] += n
+            if n:
+                stats["chunks"] += 1
+            if n < chunk_size:
+                break
+
+    stats["elapsed_sec"] = round(time.perf_counter() - t0, 3)
+    log.info("[tip_scheduler] pass finished: %s", stats)
+    return stats
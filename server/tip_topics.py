@@ -0,0 +1,226 @@
+# server/tip_topics.py
+# FCM topic subscriptions for broadcast tips.
+#
+# Tips carry the same content for everyone, so instead of one queue row and
+# one FCM request per user, each device is subscribed to a segment topic
+#     tips_<language>_<interval>m     e.g. tips_en_60m
+# and tip_scheduler enqueues one dbo.BroadcastQueue row per segment and
+# fire time. UserDeviceTokens.tip_topic records the current subscription so
+# a settings change only touches the devices whose segment changed.
+#
+# Failed (un)subscribe calls are retried by the scheduler with exponential
+# backoff per device (tip_sync_failures / tip_sync_retry_at), so devices
+# that keep failing don't crowd out the rest.
+#
+# A topic message reaches the whole segment at once, so it cannot honour a
+# user's own quiet hours or daily cap (notification_policies). Users who set
+# either stay off the tip topics and tip_scheduler sends them direct pushes.
+import os
+import re
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from .db import SessionLocal
+from .firebase_client import subscribe_to_topic, unsubscribe_from_topic
+
+log = logging.getLogger("mendly.tip_topics")
+
+# TIP_DELIVERY=topic (segment broadcasts) | direct (one queue row per user)
+TIP_DELIVERY = (os.getenv("TIP_DELIVERY") or "topic").lower().strip()
+TIP_DEFAULT_LANGUAGE = os.getenv("TIP_DEFAULT_LANGUAGE", "en")
+# defaults of positive_notifications_routes._row_to_settings
+DEFAULT_INTERVAL_MINUTES = 60
+# backoff of a device whose topic (un)subscribe failed: base * 2^failures
+TIP_TOPIC_RETRY_BASE_SECONDS = int(os.getenv("TIP_TOPIC_RETRY_BASE_SEC", "300"))
+TIP_TOPIC_RETRY_MAX_SECONDS = int(os.getenv("TIP_TOPIC_RETRY_MAX_SEC", "86400"))
+
+_TOPIC_RE = re.compile(r"^tips_([a-z]{2,8})_(\d+)m$")
+
+
+def topic_delivery_enabled() -> bool:
+    return TIP_DELIVERY == "topic"
+
+
+def own_policy_sql(alias: str = "s") -> str:
+    """
+    SQL condition on a UserSettings alias: the user set their own quiet
+    hours or daily cap and needs direct tips.
+    """
+    a = f"{alias}." if alias else ""
+    return (
+        f"(({a}quiet_start_hour IS NOT NULL AND {a}quiet_end_hour IS NOT NULL"
+        f" AND {a}quiet_start_hour <> {a}quiet_end_hour)"
+        f" OR {a}max_pushes_per_day IS NOT NULL)"
+    )
+
+
+def _language(lang: Optional[str]) -> str:
+    # "en-US" / "he_IL" -> "en" / "he"
+    base = re.split(r"[-_]", (lang or "").strip().lower())[0]
+    return base if re.fullmatch(r"[a-z]{2,8}", base) else TIP_DEFAULT_LANGUAGE
+
+
+def tip_topic(language: Optional[str], interval_minutes: int) -> str:
+    return f"tips_{_language(language)}_{int(interval_minutes)}m"
+
+
+def parse_tip_topic(topic: str) -> Optional[Tuple[str, int]]:
+    """
+    (language, interval_minutes) for a tip topic, None if it isn't one.
+    """
+    m = _TOPIC_RE.match(topic or "")
+    return (m.group(1), int(m.group(2))) if m else None
+
+
+def sync_user_tip_topics(user_id: str) -> None:
+    """
+    Bring the user's active devices onto the topic matching their current
+    tip settings (or off all tip topics when tips are disabled).
+    Meant to run as a background task after registration / settings saves.
+    """
+    if not topic_delivery_enabled():
+        return
+    try:
+        with SessionLocal() as db:
+            _sync_user(db, user_id)
+    except Exception as e:
+        log.warning("Failed to sync tip topics for user %s: %r", user_id, e)
+
+
+def _sync_user(db, user_id: str) -> int:
+    settings = db.execute(
+        text(
+            f"""
+            SELECT positive_notif_enabled, positive_notif_interval_minutes,
+                   CASE WHEN {own_policy_sql("")} THEN 1 ELSE 0 END AS own_policy
+            FROM dbo.UserSettings
+            WHERE user_id = :uid
+            """
+        ),
+        {"uid": user_id},
+    ).fetchone()
+    # off all topics when tips are off or go out directly (own policy)
+    on_topics = settings is None or (
+        bool(settings.positive_notif_enabled) and not settings.own_policy
+    )
+    interval = (
+        DEFAULT_INTERVAL_MINUTES
+        if settings is None or settings.positive_notif_interval_minutes is None
+        else int(settings.positive_notif_interval_minutes)
+    )
+
+    tokens = db.execute(
+        text(
+            """
+            SELECT token_id, fcm_token, language, tip_topic,
+                   tip_sync_failures, tip_sync_retry_at
+            FROM dbo.UserDeviceTokens
+            WHERE user_id = :uid AND is_active = 1
+            """
+        ),
+        {"uid": user_id},
+    ).fetchall()
+
+    subscribe: Dict[str, List] = defaultdict(list)
+    unsubscribe: Dict[str, List] = defaultdict(list)
+    # token_id -> topic to store; devices with a pending retry are written
+    # back even when nothing changed, which clears their backoff
+    stored: Dict[str, Optional[str]] = {}
+    for t in tokens:
+        want = tip_topic(t.language, interval) if on_topics else None
+        if want == t.tip_topic:
+            if t.tip_sync_retry_at is not None:
+                stored[str(t.token_id)] = t.tip_topic
+            continue
+        stored[str(t.token_id)] = t.tip_topic
+        if t.tip_topic:
+            unsubscribe[t.tip_topic].append(t)
+        if want:
+            subscribe[want].append(t)
+
+    failed = set()
+    for topic, rows in unsubscribe.items():
+        ok = unsubscribe_from_topic([r.fcm_token for r in rows], topic) == 0
+        for r in rows:
+            if ok:
+                stored[str(r.token_id)] = None
+            else:
+                failed.add(str(r.token_id))
+    for topic, rows in subscribe.items():
+        ok = subscribe_to_topic([r.fcm_token for r in rows], topic) == 0
+        for r in rows:
+            if ok:
+                stored[str(r.token_id)] = topic
+            else:
+                failed.add(str(r.token_id))
+
+    if stored:
+        failures = {str(t.token_id): int(t.tip_sync_failures or 0) for t in tokens}
+        db.execute(
+            text(
+                """
+                UPDATE dbo.UserDeviceTokens
+                SET tip_topic = :topic,
+                    tip_sync_failures = CASE
+                        WHEN :retry_in IS NULL THEN 0
+                        WHEN tip_sync_failures < 255 THEN tip_sync_failures + 1
+                        ELSE 255 END,
+                    tip_sync_retry_at = CASE WHEN :retry_in IS NOT NULL
+                        THEN DATEADD(SECOND, :retry_in, SYSDATETIMEOFFSET()) END
+                WHERE token_id = :tid
+                """
+            ),
+            [
+                {
+                    "tid": tid,
+                    "topic": topic,
+                    "retry_in": _retry_delay(failures[tid]) if tid in failed else None,
+                }
+                for tid, topic in stored.items()
+            ],
+        )
+        db.commit()
+    return len(stored) - len(failed)
+
+
+def _retry_delay(failures: int) -> int:
+    return min(TIP_TOPIC_RETRY_MAX_SECONDS, TIP_TOPIC_RETRY_BASE_SECONDS * 2 ** min(failures, 16))
+
+
+def sync_pending_users(db, limit: int) -> int:
+    """
+    Subscribe devices that have tips enabled but no topic yet (devices
+    registered before topic delivery) and retry failed (un)subscriptions
+    whose backoff has passed. Devices that never failed go first, then
+    the longest-waiting ones. Returns the number of users synced.
+    """
+    rows = db.execute(
+        text(
+            f"""
+            SELECT TOP (:n) t.user_id
+            FROM dbo.UserDeviceTokens t
+            LEFT JOIN dbo.UserSettings s ON s.user_id = t.user_id
+            WHERE t.is_active = 1
+              AND (
+                    (t.tip_sync_retry_at IS NULL
+                     AND t.tip_topic IS NULL
+                     AND ISNULL(s.positive_notif_enabled, 1) = 1
+                     AND NOT {own_policy_sql("s")})
+                 OR t.tip_sync_retry_at <= SYSDATETIMEOFFSET()
+              )
+            GROUP BY t.user_id
+            ORDER BY MIN(t.tip_sync_failures), MIN(ISNULL(t.tip_sync_retry_at, t.last_seen))
+            """
+        ),
+        {"n": limit},
+    ).fetchall()
+    for r in rows:
+        try:
+            _sync_user(db, str(r.user_id))
+        except Exception as e:
+            db.rollback()
+            log.warning("Failed to sync tip topics for user %s: %r", r.user_id, e)
+    return len(rows)
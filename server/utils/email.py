@@ -1,27 +1,115 @@
 import os
+import time
+import logging
 import smtplib
+from typing import Optional
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+log = logging.getLogger("mendly.email")
+
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 
 # استخدمي نفس الأسماء اللي عندك بالـ .env
 SMTP_USER = os.getenv("EMAIL", "")
 SMTP_PASS = os.getenv("EMAILPASSWORD", "").replace(" ", "")
+EMAIL_FROM = os.getenv("EMAIL_FROM") or SMTP_USER
+
+# local stand-ins (server/fake_smtp.py) speak plain SMTP without auth:
+#     SMTP_HOST=127.0.0.1 SMTP_PORT=8025 SMTP_STARTTLS=0 SMTP_LOGIN=0
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_LOGIN = os.getenv("SMTP_LOGIN", "1") == "1"
+SMTP_TIMEOUT_SEC = float(os.getenv("SMTP_TIMEOUT_SEC", "20"))
+# an idle session is checked with NOOP before reuse; servers drop idle
+# clients after a few minutes anyway
+SMTP_IDLE_CHECK_SEC = float(os.getenv("SMTP_IDLE_CHECK_SEC", "30"))
+
 
-def send_email(to_email: str, subject: str, body: str) -> None:
-    if not SMTP_USER or not SMTP_PASS:
-        print("[email] EMAIL/EMAILPASSWORD missing. Skipping send.")
-        return
+def smtp_configured() -> bool:
+    return not SMTP_LOGIN or bool(SMTP_USER and SMTP_PASS)
 
+
+def build_message(to_email: str, subject: str, body: str) -> MIMEMultipart:
     msg = MIMEMultipart()
-    msg["From"] = SMTP_USER
+    msg["From"] = EMAIL_FROM or "no-reply@mendly.local"
     msg["To"] = to_email
     msg["Subject"] = subject
     msg.attach(MIMEText(body, "plain", "utf-8"))
+    return msg
+
+
+class SmtpConnection:
+    """
+    One SMTP session (connect, STARTTLS, login) reused for many messages.
+    Reconnects transparently when the server dropped the idle session.
+    Not thread-safe: one instance per sending thread.
+    """
+
+    def __init__(
+        self,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        user: str = SMTP_USER,
+        password: str = SMTP_PASS,
+        starttls: bool = SMTP_STARTTLS,
+        login: bool = SMTP_LOGIN,
+        timeout: float = SMTP_TIMEOUT_SEC,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.login = login
+        self.timeout = timeout
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            if self.login:
+                smtp.login(self.user, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.connects += 1
+        return smtp
+
+    def _session(self) -> smtplib.SMTP:
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_CHECK_SEC:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self.close()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+        if self._smtp is None:
+            self._smtp = self._connect()
+        return self._smtp
+
+    def send(self, msg: MIMEMultipart) -> None:
+        """
+        Send one message; raises smtplib / socket errors to the caller.
+        A session the server closed in between is reopened once.
+        """
+        try:
+            self._session().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self._session().send_message(msg)
+        self._last_used = time.monotonic()
 
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASS)
-        server.send_message(msg)
+    def close(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
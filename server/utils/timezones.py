@@ -0,0 +1,39 @@
+# server/utils/timezones.py
+# User timezones (UserSettings.timezone, IANA names such as 'Asia/Jerusalem').
+# Shared by the check-in scheduler, the notification policies and the
+# settings routes, so none of them imports another just for this.
+import os
+import logging
+from typing import Dict, Optional
+from datetime import tzinfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+log = logging.getLogger("mendly.timezones")
+
+SCHEDULER_DEFAULT_TZ = os.getenv("SCHEDULER_DEFAULT_TZ", "UTC")
+
+_tz_cache: Dict[str, tzinfo] = {}
+
+
+def is_valid_zone(name: str) -> bool:
+    try:
+        ZoneInfo(name.strip())
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def user_zone(name: Optional[str]) -> tzinfo:
+    """
+    The user's zone; SCHEDULER_DEFAULT_TZ when unset or unknown.
+    """
+    key = (name or SCHEDULER_DEFAULT_TZ).strip()
+    tz = _tz_cache.get(key)
+    if tz is None:
+        try:
+            tz = ZoneInfo(key)
+        except (ZoneInfoNotFoundError, ValueError):
+            log.warning("Unknown timezone %r, using %s", key, SCHEDULER_DEFAULT_TZ)
+            tz = ZoneInfo(SCHEDULER_DEFAULT_TZ)
+        _tz_cache[key] = tz
+    return tz
@@ -0,0 +1,276 @@
+# server/weekly_summaries.py
+# Weekly AI summary batch job.
+#
+# For every active user (mood entries in the last 7 days, no summary in the
+# last SUMMARY_DEDUPE_DAYS) it writes one dbo.AIInteractions row with
+# purpose='summary' (read by journey_routes.get_journey_overview) and
+# enqueues a 'weekly_summary' push in dbo.NotificationQueue.
+#
+# Users are processed in keyset-paged chunks; each chunk costs one query for
+# the week of MoodEntries, one executemany for the summaries and one for the
+# notifications. Summaries are generated in a process pool.
+#
+# Run from the project root (e.g. weekly from cron / Task Scheduler):
+#     python -m server.weekly_summaries
+import os
+import json
+import time
+import logging
+from collections import Counter, defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+from .db import SessionLocal
+
+log = logging.getLogger("mendly.weekly_summaries")
+
+SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", "500"))  # < 2100 SQL Server params
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+SUMMARY_DEDUPE_DAYS = int(os.getenv("SUMMARY_DEDUPE_DAYS", "6"))
+SUMMARY_WINDOW_DAYS = 7
+
+# (captured_at, score, label, checkin_slot); checkin_slot is NULL for the
+# mood snapshots written from AI chats (mood_snapshots.py)
+Entry = Tuple[datetime, int, Optional[str], Optional[str]]
+
+
+# ---------- summary text (runs in worker processes) ----------
+
+def _trend_sentence(scores_by_day: Dict[Any, List[int]]) -> str:
+    days = sorted(scores_by_day)
+    if len(days) < 2:
+        return ""
+    half = len(days) // 2
+    first = [s for d in days[:half] for s in scores_by_day[d]]
+    second = [s for d in days[half:] for s in scores_by_day[d]]
+    delta = sum(second) / len(second) - sum(first) / len(first)
+    if delta >= 1:
+        return "Your mood improved as the week went on."
+    if delta <= -1:
+        return "The second half of the week felt heavier than the first."
+    return "Your mood stayed fairly steady through the week."
+
+
+def build_summary(entries: List[Entry]) -> str:
+    """
+    Short, supportive plain-text summary of one user's week.
+    """
+    scores = [int(score) for _, score, _, _ in entries]
+    avg = sum(scores) / len(scores)
+
+    by_day: Dict[Any, List[int]] = defaultdict(list)
+    checkin_days = set()
+    for captured_at, score, _, slot in entries:
+        day = captured_at.date() if hasattr(captured_at, "date") else captured_at
+        by_day[day].append(int(score))
+        if slot is not None:
+            checkin_days.add(day)
+
+    day_avgs = {d: sum(v) / len(v) for d, v in by_day.items()}
+    best_day = max(day_avgs, key=lambda d: day_avgs[d])
+
+    labels = Counter(lbl for _, _, lbl, _ in entries if lbl)
+
+    # mood, trend and feelings use every entry; only slot entries are check-ins
+    checkins = sum(1 for e in entries if e[3] is not None)
+    from_chat = len(entries) - checkins
+    if checkins:
+        parts = [
+            f"This week you checked in {checkins} time{'s' if checkins != 1 else ''} "
+            f"on {len(checkin_days)} day{'s' if len(checkin_days) != 1 else ''}, "
+            f"with an average mood of {avg:.1f}/10."
+        ]
+        if from_chat:
+            parts.append(
+                f"Your chats added {from_chat} more mood reading{'s' if from_chat != 1 else ''}."
+            )
+    else:
+        parts = [
+            f"This week you shared your mood in chat {from_chat} time{'s' if from_chat != 1 else ''} "
+            f"on {len(by_day)} day{'s' if len(by_day) != 1 else ''}, "
+            f"with an average mood of {avg:.1f}/10."
+        ]
+    trend = _trend_sentence(by_day)
+    if trend:
+        parts.append(trend)
+    if len(by_day) > 1:
+        parts.append(f"Your brightest day was {best_day:%A}.")
+    if labels:
+        top = ", ".join(lbl for lbl, _ in labels.most_common(2))
+        parts.append(f"Most common feelings: {top}.")
+
+    if avg < 4:
+        parts.append("It has been a tough week – be gentle with yourself, and reach out if you need support.")
+    elif avg < 7:
+        parts.append("Small steps count. Keep checking in – it helps you notice what lifts you.")
+    else:
+        parts.append("Great work – take a moment to notice what helped this week.")
+
+    return " ".join(parts)
+
+
+def _build_summaries(items: List[Tuple[str, List[Entry]]]) -> List[Tuple[str, str, int]]:
+    # one task per chunk keeps the pickling overhead per user tiny
+    return [(uid, build_summary(entries), len(entries)) for uid, entries in items]
+
+
+# ---------- DB side ----------
+
+def _next_user_chunk(db, last_uid: Optional[str], start: datetime, dedupe_since: datetime, n: int) -> List[str]:
+    rows = db.execute(
+        text(
+            """
+            SELECT TOP (:n) u.user_id
+            FROM dbo.Users u
+            WHERE u.is_deleted = 0
+              AND (:last_uid IS NULL OR u.user_id > :last_uid)
+              AND EXISTS (
+                    SELECT 1 FROM dbo.MoodEntries m
+                    WHERE m.user_id = u.user_id AND m.captured_at >= :start
+              )
+              AND NOT EXISTS (
+                    SELECT 1 FROM dbo.AIInteractions a
+                    WHERE a.user_id = u.user_id
+                      AND a.purpose = N'summary'
+                      AND a.created_at >= :dedupe_since
+              )
+            ORDER BY u.user_id
+            """
+        ),
+        {"n": n, "last_uid": last_uid, "start": start, "dedupe_since": dedupe_since},
+    ).fetchall()
+    return [r.user_id for r in rows]
+
+
+def _load_week(db, user_ids: List[str], start: datetime) -> Dict[str, List[Entry]]:
+    rows = db.execute(
+        text(
+            """
+            SELECT user_id, captured_at, score, label, checkin_slot
+            FROM dbo.MoodEntries
+            WHERE user_id IN :uids
+              AND captured_at >= :start
+            ORDER BY user_id, captured_at
+            """
+        ).bindparams(bindparam("uids", expanding=True)),
+        {"uids": user_ids, "start": start},
+    ).fetchall()
+
+    week: Dict[str, List[Entry]] = defaultdict(list)
+    for r in rows:
+        week[str(r.user_id)].append((r.captured_at, int(r.score), r.label, r.checkin_slot))
+    return week
+
+
+def _store_chunk(db, summaries: List[Tuple[str, str, int]]) -> None:
+    db.execute(
+        text(
+            """
+            INSERT INTO dbo.AIInteractions (user_id, purpose, input_refs_json, output_text)
+            VALUES (:uid, N'summary', :refs, :out)
+            """
+        ),
+        [
+            {
+                "uid": uid,
+                "refs": json.dumps({"window_days": SUMMARY_WINDOW_DAYS, "entries": n}),
+                "out": summary,
+            }
+            for uid, summary, n in summaries
+        ],
+    )
+
+    db.execute(
+        text(
+            """
+            INSERT INTO dbo.NotificationQueue
+                (user_id, token_id, purpose, template_id, scheduled_at, status)
+            VALUES
+                (:uid, NULL, N'weekly_summary', N'weekly_summary', SYSDATETIMEOFFSET(), N'pending')
+            """
+        ),
+        [{"uid": uid} for uid, _, _ in summaries],
+    )
+    db.commit()
+
+
+def run_weekly_summaries(
+    chunk_size: int = SUMMARY_CHUNK_SIZE,
+    workers: int = SUMMARY_WORKERS,
+    executor: Optional[Executor] = None,
+) -> Dict[str, float]:
+    """
+    Generate summaries for all active users. Returns run metrics.
+    """
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=SUMMARY_WINDOW_DAYS)
+    dedupe_since = now - timedelta(days=SUMMARY_DEDUPE_DAYS)
+
+    stats: Dict[str, float] = {"users": 0, "entries": 0, "chunks": 0, "failed_chunks": 0}
+    t0 = time.perf_counter()
+    t_db = 0.0
+    t_gen = 0.0
+
+    own_executor = executor is None
+    pool = executor or ProcessPoolExecutor(max_workers=max(1, workers))
+    try:
+        last_uid: Optional[str] = None
+        with SessionLocal() as db:
+            while True:
+                t = time.perf_counter()
+                user_ids = _next_user_chunk(db, last_uid, start, dedupe_since, chunk_size)
+                if not user_ids:
+                    break
+                last_uid = user_ids[-1]
+                week = _load_week(db, user_ids, start)
+                t_db += time.perf_counter() - t
+
+                # split the chunk across the pool
+                items = [(uid, entries) for uid, entries in week.items() if entries]
+                n_parts = max(1, workers)
+                parts = [items[i::n_parts] for i in range(n_parts) if items[i::n_parts]]
+
+                t = time.perf_counter()
+                summaries: List[Tuple[str, str, int]] = []
+                for part in pool.map(_build_summaries, parts):
+                    summaries.extend(part)
+                t_gen += time.perf_counter() - t
+                if not summaries:
+                    continue
+
+                t = time.perf_counter()
+                try:
+                    _store_chunk(db, summaries)
+                except Exception as e:
+                    db.rollback()
+                    stats["failed_chunks"] += 1
+                    log.warning("Failed to store weekly summaries for %s users: %r", len(summaries), e)
+                    continue
+                finally:
+                    t_db += time.perf_counter() - t
+
+                stats["chunks"] += 1
+                stats["users"] += len(summaries)
+                stats["entries"] += sum(n for _, _, n in summaries)
+    finally:
+        if own_executor:
+            pool.shutdown()
+
+    elapsed = time.perf_counter() - t0
+    stats.update(
+        {
+            "elapsed_sec": round(elapsed, 3),
+            "db_sec": round(t_db, 3),
+            "generate_sec": round(t_gen, 3),
+            "users_per_sec": round(stats["users"] / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+    )
+    log.info("[weekly_summaries] run finished: %s", stats)
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_weekly_summaries()
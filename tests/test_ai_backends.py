@@ -0,0 +1,69 @@
+# tests/test_ai_backends.py
+# Run from the project root: python -m pytest tests
+import asyncio
+import os
+from types import SimpleNamespace
+
+from server.ai_backends import ModelBackend, RuleBasedBackend
+
+
+class FakeModel:
+    """
+    Loaded in the worker processes through the entrypoint below.
+    """
+
+    def predict_batch(self, items):
+        if any(item["message"] == "crash" for item in items):
+            os._exit(1)  # a worker dying mid-batch, like an OOM kill
+        return [f"model: {item['message']}" for item in items]
+
+
+def broken_factory():
+    raise RuntimeError("weights not found")
+
+
+def _rules(message, history):
+    return f"rules: {message}"
+
+
+def _backend(factory: str, **kw) -> ModelBackend:
+    return ModelBackend(f"{__name__}:{factory}", fallback=_rules, timeout_sec=10, **kw)
+
+
+def test_rule_backend():
+    backend = RuleBasedBackend(_rules)
+    history = [SimpleNamespace(role="user", content="hi")]
+    assert asyncio.run(backend.generate("hello", history)) == "rules: hello"
+
+
+def test_pool_is_replaced_after_a_worker_dies():
+    backend = _backend("FakeModel")
+
+    async def run():
+        try:
+            assert await backend.generate("hi", []) == "model: hi"
+            assert await backend.generate("crash", []) == "rules: crash"
+            assert await backend.generate("again", []) == "model: again"
+        finally:
+            backend.close()
+
+    asyncio.run(run())
+    assert backend.stats["pool_restarts"] == 1
+    assert backend.stats["model_replies"] == 2
+    assert backend._pool_failures == 0 and not backend.disabled
+
+
+def test_model_is_disabled_after_repeated_pool_failures():
+    backend = _backend("broken_factory", max_pool_failures=2)
+
+    async def run():
+        try:
+            return [await backend.generate(f"m{i}", []) for i in range(4)]
+        finally:
+            backend.close()
+
+    assert asyncio.run(run()) == ["rules: m0", "rules: m1", "rules: m2", "rules: m3"]
+    assert backend.disabled
+    assert backend.stats["pool_restarts"] == 2
+    assert backend.stats["fallback_disabled"] == 2
+    assert backend._pool is None
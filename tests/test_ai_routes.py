@@ -0,0 +1,139 @@
+# tests/test_ai_routes.py
+# Run from the project root: python -m pytest tests
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc", "fastapi", "httpx", "jose"):
+    pytest.importorskip(_mod)
+
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from server.auth import get_current_user  # noqa: E402
+from server.conversations import ConversationState  # noqa: E402
+from server.deps import get_db  # noqa: E402
+from server.routers import ai_routes  # noqa: E402
+
+USER = "5b0e7a51-0000-4000-8000-00000000000a"
+REPLY = "I hear you. Let's slow down.\n\nTip: breathe in for 4s."
+
+
+class _Store:
+    def __init__(self, fail: bool = False) -> None:
+        self.fail, self.recorded = fail, []
+
+    def create(self, user_id):
+        return ConversationState(conversation_id="c0ffee00-0000-4000-8000-000000000001", user_id=user_id)
+
+    def history(self, state):
+        return list(state.turns)
+
+    def record(self, state, turns):
+        if self.fail:
+            raise RuntimeError("db down")
+        self.recorded.extend(turns)
+        state.turns.extend(turns)
+        state.turn_count += len(turns)
+
+
+class _Backend:
+    name = "fake"
+
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+
+    async def generate(self, message, history):
+        if self.fail:
+            raise RuntimeError("model crashed")
+        return REPLY
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    snapshots = []
+    setup = SimpleNamespace(store=_Store(), backend=_Backend(), snapshots=snapshots)
+    monkeypatch.setattr(ai_routes, "conversation_store", setup.store)
+    monkeypatch.setattr(ai_routes, "reply_backend", setup.backend)
+    monkeypatch.setattr(ai_routes, "submit_mood_snapshot", lambda uid, note: snapshots.append((uid, note)))
+
+    app = FastAPI()
+    app.include_router(ai_routes.router)
+    app.dependency_overrides[get_db] = lambda: None
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(user_id=USER)
+    setup.client = TestClient(app)
+    return setup
+
+
+def _events(body: str):
+    out = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        out.append((lines["event"], json.loads(lines["data"])))
+    return out
+
+
+def test_stream_sends_chunks_then_done(chat):
+    resp = chat.client.post("/ai/chat/stream", json={"message": "I'm anxious"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+
+    events = _events(resp.text)
+    *chunks, (last, done) = events
+    assert last == "done"
+    assert chunks and all(name == "chunk" for name, _ in chunks)
+    assert "".join(c["text"] for _, c in chunks) == REPLY == done["reply"]
+    assert done["turn"] == 2 and done["conversation_id"]
+
+    # turns stored before the reply went out, snapshot handed off after
+    assert chat.store.recorded == [("user", "I'm anxious"), ("assistant", REPLY)]
+    assert chat.snapshots == [(USER, "I'm anxious")]
+
+
+def test_stream_backend_error_records_nothing(chat):
+    chat.backend.fail = True
+    events = _events(chat.client.post("/ai/chat/stream", json={"message": "hi"}).text)
+    assert [name for name, _ in events] == ["error"]
+    assert chat.store.recorded == [] and chat.snapshots == []
+
+
+def test_stream_store_failure_skips_the_snapshot(chat):
+    chat.store.fail = True
+    events = _events(chat.client.post("/ai/chat/stream", json={"message": "hi"}).text)
+    assert events == [("error", {"detail": "Could not save the conversation. Please try again."})]
+    assert chat.snapshots == []
+
+
+def test_chat_store_failure_is_a_503(chat):
+    chat.store.fail = True
+    resp = chat.client.post("/ai/chat", json={"message": "hi"})
+    assert resp.status_code == 503
+    assert chat.snapshots == []
+
+
+def test_equivalent_messages_share_one_classification():
+    ai_routes._classify_cached.cache_clear()
+    assert ai_routes.message_fingerprint("I'm SO sad!!") == ai_routes.message_fingerprint("sad") == "sad"
+
+    first = ai_routes.generate_reply("I'm so sad!!", [])
+    assert ai_routes.generate_reply("sad", []) == first
+    stats = ai_routes.reply_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+    assert first == ai_routes._compose_reply("sad", "sad")
+
+
+def test_long_messages_skip_the_cache():
+    ai_routes._classify_cached.cache_clear()
+    message = "worried " * (ai_routes.REPLY_CACHE_MAX_KEY_LEN // 4)
+    assert ai_routes.generate_reply(message, []) == ai_routes._compose_reply("anxious", "anxious")
+    assert ai_routes.reply_cache_stats()["size"] == 0
+
+
+def test_reply_is_not_repeated_verbatim():
+    reply = ai_routes.generate_reply("sad", [])
+    history = [ai_routes.ChatMessage(role="assistant", content=reply)]
+    assert ai_routes.generate_reply("sad", history).startswith(reply + "\n\n")
@@ -0,0 +1,106 @@
+# tests/test_checkin_scheduler.py
+# Run from the project root: python -m pytest tests
+import os
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc", "firebase_admin"):
+    pytest.importorskip(_mod)
+
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from server import checkin_scheduler  # noqa: E402
+from server.checkin_scheduler import _plan, next_fire  # noqa: E402
+
+UTC = timezone.utc
+JERUSALEM = ZoneInfo("Asia/Jerusalem")
+BERLIN = ZoneInfo("Europe/Berlin")
+
+
+def _row(hour, minute, next_fire_at=None, tz="Asia/Jerusalem", slot="morning"):
+    return SimpleNamespace(
+        schedule_id="00000000-0000-0000-0000-000000000001",
+        user_id="00000000-0000-0000-0000-0000000000aa",
+        slot_name=slot,
+        local_hour=hour,
+        local_minute=minute,
+        next_fire_at=next_fire_at,
+        timezone=tz,
+    )
+
+
+def test_next_fire_later_today():
+    # 05:00 UTC = 07:00 in Jerusalem (winter, +02:00)
+    fire, day = next_fire(JERUSALEM, 9, 30, datetime(2026, 1, 10, 5, 0, tzinfo=UTC))
+    assert fire == datetime(2026, 1, 10, 7, 30, tzinfo=UTC)
+    assert day == date(2026, 1, 10)
+
+
+def test_next_fire_is_strictly_after():
+    after = datetime(2026, 1, 10, 7, 30, tzinfo=UTC)
+    fire, day = next_fire(JERUSALEM, 9, 30, after)
+    assert fire == after + timedelta(days=1)
+    assert day == date(2026, 1, 11)
+
+
+def test_next_fire_uses_the_local_date_not_the_utc_one():
+    # 23:00 UTC on the 10th is already 01:00 on the 11th in Jerusalem
+    fire, day = next_fire(JERUSALEM, 8, 0, datetime(2026, 1, 10, 23, 0, tzinfo=UTC))
+    assert fire == datetime(2026, 1, 11, 6, 0, tzinfo=UTC)
+    assert day == date(2026, 1, 11)
+
+
+def test_next_fire_keeps_local_time_across_dst():
+    # Berlin moves to +02:00 on 2026-03-29
+    before, _ = next_fire(BERLIN, 8, 0, datetime(2026, 3, 28, 0, 0, tzinfo=UTC))
+    after, _ = next_fire(BERLIN, 8, 0, before)
+    assert before == datetime(2026, 3, 28, 7, 0, tzinfo=UTC)
+    assert after == datetime(2026, 3, 29, 6, 0, tzinfo=UTC)
+
+
+def test_plan_new_row_enqueues_the_fire_inside_the_window():
+    now = datetime(2026, 1, 10, 7, 10, tzinfo=UTC)
+    jobs, updates = _plan([_row(9, 30)], now, now + timedelta(minutes=30))
+
+    assert [(j["slot"], j["fire_date"], j["scheduled_at"]) for j in jobs] == [
+        ("morning", "2026-01-10", "2026-01-10T07:30:00+00:00")
+    ]
+    assert updates[0]["next_fire_at"] == "2026-01-11T07:30:00+00:00"
+
+
+def test_plan_outside_the_window_only_stores_next_fire():
+    now = datetime(2026, 1, 10, 5, 0, tzinfo=UTC)
+    jobs, updates = _plan([_row(9, 30)], now, now + timedelta(minutes=30))
+
+    assert jobs == []
+    assert updates[0]["next_fire_at"] == "2026-01-10T07:30:00+00:00"
+
+
+def test_plan_skips_fires_missed_beyond_the_grace(monkeypatch):
+    monkeypatch.setattr(checkin_scheduler, "SCHEDULER_MISSED_GRACE_MIN", 30)
+    now = datetime(2026, 1, 10, 12, 0, tzinfo=UTC)
+    # stored fire from two days ago: the scheduler was down
+    stale = datetime(2026, 1, 8, 7, 30, tzinfo=UTC)
+    jobs, updates = _plan([_row(9, 30, next_fire_at=stale)], now, now + timedelta(minutes=30))
+
+    assert jobs == []
+    assert updates[0]["next_fire_at"] == "2026-01-11T07:30:00+00:00"
+
+
+def test_plan_sends_a_recent_miss_within_the_grace(monkeypatch):
+    monkeypatch.setattr(checkin_scheduler, "SCHEDULER_MISSED_GRACE_MIN", 30)
+    now = datetime(2026, 1, 10, 7, 40, tzinfo=UTC)
+    due = datetime(2026, 1, 10, 7, 30, tzinfo=UTC)
+    jobs, _ = _plan([_row(9, 30, next_fire_at=due)], now, now + timedelta(minutes=30))
+
+    assert [j["scheduled_at"] for j in jobs] == ["2026-01-10T07:30:00+00:00"]
+
+
+def test_plan_unknown_timezone_falls_back_to_the_default():
+    now = datetime(2026, 1, 10, 9, 0, tzinfo=UTC)
+    jobs, _ = _plan([_row(9, 30, tz="Not/AZone")], now, now + timedelta(minutes=60))
+
+    assert [j["scheduled_at"] for j in jobs] == ["2026-01-10T09:30:00+00:00"]
@@ -0,0 +1,119 @@
+# tests/test_conversations.py
+# Run from the project root: python -m pytest tests
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc"):
+    pytest.importorskip(_mod)
+
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from server import conversations  # noqa: E402
+from server.conversations import ConversationStore  # noqa: E402
+
+USER = "5b0e7a51-0000-4000-8000-00000000000a"
+OTHER = "5b0e7a51-0000-4000-8000-00000000000b"
+
+
+class _Db:
+    """
+    Allocates turn_no from `next_no`, the way the MAX+1 insert does.
+    """
+
+    def __init__(self, next_no: int = 0, rows=()) -> None:
+        self.next_no, self.rows = next_no, list(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, stmt, params):
+        if "INSERT INTO dbo.AIInteractions" in str(stmt):
+            turns = json.loads(params["turns"])
+            out = [SimpleNamespace(turn_no=self.next_no + t["seq"]) for t in turns]
+            self.next_no += len(turns)
+        else:
+            out = self.rows
+        return SimpleNamespace(fetchall=lambda: out)
+
+    def commit(self) -> None:
+        pass
+
+
+def _record(monkeypatch, store, state, db, turns):
+    monkeypatch.setattr(conversations, "SessionLocal", lambda: db)
+    return store.record(state, turns)
+
+
+def test_record_allocates_turn_numbers_and_keeps_the_cache(monkeypatch):
+    store = ConversationStore()
+    state = store.create(USER)
+    db = _Db()
+
+    assert _record(monkeypatch, store, state, db, [("user", "hi"), ("assistant", "hello")]) == [0, 1]
+    assert _record(monkeypatch, store, state, db, [("user", "again")]) == [2]
+    assert state.turn_count == 3
+    assert store.get(None, state.conversation_id, USER) is state
+
+
+def test_stale_cache_entry_is_dropped(monkeypatch):
+    store = ConversationStore()
+    state = store.create(USER)
+    # another process stored turns 0..3 of this conversation meanwhile
+    db = _Db(next_no=4)
+
+    assert _record(monkeypatch, store, state, db, [("user", "hi")]) == [4]
+    assert state.turn_count == 5
+    assert state.conversation_id not in store._cache
+
+
+def test_failed_record_leaves_the_state_alone(monkeypatch):
+    store = ConversationStore()
+    state = store.create(USER)
+
+    class Broken(_Db):
+        def execute(self, stmt, params):
+            raise RuntimeError("db down")
+
+    with pytest.raises(RuntimeError):
+        _record(monkeypatch, store, state, Broken(), [("user", "hi")])
+    assert (state.turn_count, list(state.turns)) == (0, [])
+
+
+def test_get_checks_the_id_and_the_owner():
+    store = ConversationStore()
+    state = store.create(USER)
+    assert store.get(None, "not-a-uuid", USER) is None
+    assert store.get(None, state.conversation_id, OTHER) is None
+    assert store.get(None, state.conversation_id.upper(), USER) is state
+
+
+def test_cache_miss_reloads_the_latest_turns():
+    store = ConversationStore()
+    cid = "c0ffee00-0000-4000-8000-000000000001"
+    # newest first, as the query orders them
+    db = _Db(
+        rows=[
+            SimpleNamespace(role="assistant", output_text="b", turn_no=7),
+            SimpleNamespace(role="user", output_text="a", turn_no=6),
+        ]
+    )
+
+    state = store.get(db, cid, USER)
+    assert state.turn_count == 8
+    assert store.history(state) == [("user", "a"), ("assistant", "b")]
+    assert store.get(_Db(), cid, USER) is state
+
+
+def test_lru_evicts_the_oldest_conversation():
+    store = ConversationStore(cache_size=2)
+    a, b = store.create(USER), store.create(USER)
+    store.get(None, a.conversation_id, USER)  # a is now the most recent
+    store.create(USER)
+    assert a.conversation_id in store._cache
+    assert b.conversation_id not in store._cache
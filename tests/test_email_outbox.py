@@ -0,0 +1,119 @@
+# tests/test_email_outbox.py
+# Run from the project root: python -m pytest tests
+import os
+import smtplib
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc"):
+    pytest.importorskip(_mod)
+
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from server import email_outbox  # noqa: E402
+from server.email_outbox import EMAIL_MAX_ATTEMPTS, EmailOutboxSender  # noqa: E402
+
+NOW = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _row(n: int = 1, attempts: int = 1, expires_at=None, to: str = "a@example.invalid"):
+    return SimpleNamespace(
+        email_id=f"e0000000-0000-4000-8000-{n:012d}",
+        to_email=to,
+        subject="Mendly",
+        body="code 123456",
+        expires_at=expires_at,
+        attempts=attempts,
+    )
+
+
+@pytest.mark.parametrize(
+    "exc, permanent",
+    [
+        (smtplib.SMTPRecipientsRefused({"a@x": (550, b"no such user")}), True),
+        (smtplib.SMTPRecipientsRefused({"a@x": (550, b"no"), "b@x": (451, b"later")}), False),
+        (smtplib.SMTPDataError(554, b"rejected"), True),
+        (smtplib.SMTPDataError(421, b"try later"), False),
+        (smtplib.SMTPAuthenticationError(535, b"bad credentials"), False),
+        (smtplib.SMTPServerDisconnected("gone"), False),
+        (TimeoutError("timed out"), False),
+    ],
+)
+def test_permanent(exc, permanent):
+    assert email_outbox._permanent(exc) is permanent
+
+
+def test_failure_retries_until_max_attempts():
+    retry = email_outbox._failure(_row(attempts=1), TimeoutError("timed out"))
+    assert retry.status == "pending" and retry.retry_in >= 1
+    assert retry.error == "TimeoutError: timed out"
+
+    last = email_outbox._failure(_row(attempts=EMAIL_MAX_ATTEMPTS), TimeoutError("timed out"))
+    assert (last.status, last.retry_in) == ("dead", None)
+
+    rejected = email_outbox._failure(_row(attempts=1), smtplib.SMTPDataError(554, b"rejected"))
+    assert (rejected.status, rejected.retry_in) == ("dead", None)
+
+
+def test_session_broken():
+    assert email_outbox._session_broken(smtplib.SMTPServerDisconnected("gone"))
+    assert email_outbox._session_broken(ConnectionResetError())
+    assert not email_outbox._session_broken(smtplib.SMTPDataError(421, b"try later"))
+
+
+def test_expired_accepts_naive_and_aware_times():
+    assert not email_outbox._expired(_row(), NOW)
+    assert email_outbox._expired(_row(expires_at=NOW), NOW)
+    assert email_outbox._expired(_row(expires_at=(NOW - timedelta(seconds=1)).replace(tzinfo=None)), NOW)
+    assert not email_outbox._expired(_row(expires_at=NOW + timedelta(minutes=5)), NOW)
+
+
+class _Smtp:
+    def __init__(self, fail_for=()) -> None:
+        self.fail_for, self.sent, self.closed = dict(fail_for), [], 0
+
+    def send(self, msg) -> None:
+        exc = self.fail_for.get(msg["To"])
+        if exc is not None:
+            raise exc
+        self.sent.append(msg["To"])
+
+    def close(self) -> None:
+        self.closed += 1
+
+
+class _SessionFactory:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    state = SimpleNamespace(rows=[], stored=[])
+    monkeypatch.setattr(email_outbox, "SessionLocal", _SessionFactory)
+    monkeypatch.setattr(email_outbox, "_claim", lambda db, n: state.rows[:n])
+    monkeypatch.setattr(email_outbox, "_store", lambda db, updates: state.stored.extend(updates))
+    return state
+
+
+def test_batch_marks_expired_and_stops_on_a_broken_session(outbox):
+    sender = EmailOutboxSender(enabled=False)
+    sender._smtp = _Smtp(fail_for={"b@example.invalid": smtplib.SMTPServerDisconnected("gone")})
+    outbox.rows = [
+        _row(1, expires_at=datetime.now(timezone.utc) - timedelta(minutes=1)),
+        _row(2, to="ok@example.invalid"),
+        _row(3, to="b@example.invalid"),
+        _row(4, to="never-tried@example.invalid"),
+    ]
+
+    assert sender.process_batch() == 4
+
+    assert [u.status for u in outbox.stored] == ["expired", "sent", "pending", "pending"]
+    assert sender._smtp.sent == ["ok@example.invalid"]
+    assert sender._smtp.closed == 1
+    assert (sender.sent, sender.expired, sender.failed) == (1, 1, 2)
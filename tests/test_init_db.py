@@ -0,0 +1,58 @@
+# tests/test_init_db.py
+# Run from the project root: python -m pytest tests
+import re
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy"):
+    pytest.importorskip(_mod)
+
+from server import init_db  # noqa: E402
+
+
+class _RecordingConn:
+    def __init__(self) -> None:
+        self.batches = []
+
+    def exec_driver_sql(self, stmt: str) -> None:
+        self.batches.append(stmt)
+
+
+def _upgrade_sql() -> str:
+    return init_db.UPGRADE_FILE.read_text(encoding="utf-8")
+
+
+def test_upgrade_file_splits_into_batches():
+    conn = _RecordingConn()
+    init_db._run_sql_with_go(conn, _upgrade_sql())
+
+    assert len(conn.batches) > 10
+    assert not any(re.search(r"^\s*GO\s*$", b, re.IGNORECASE | re.MULTILINE) for b in conn.batches)
+
+
+def test_every_added_column_is_guarded_and_in_the_schema():
+    sql = _upgrade_sql()
+    schema = init_db.SCHEMA_FILE.read_text(encoding="utf-8")
+    added = re.findall(r"ALTER TABLE (dbo\.\w+) ADD (?!CONSTRAINT)(\w+) ", sql)
+
+    assert added
+    for table, column in added:
+        assert f"IF COL_LENGTH('{table}','{column}') IS NULL" in sql
+        assert re.search(rf"^\s+{column}\s", schema, re.MULTILINE), column
+
+
+def test_every_created_table_and_index_is_guarded_and_in_the_schema():
+    sql = _upgrade_sql()
+    schema = init_db.SCHEMA_FILE.read_text(encoding="utf-8")
+
+    for table in re.findall(r"CREATE TABLE (dbo\.\w+)", sql):
+        assert f"IF OBJECT_ID('{table}','U') IS NULL" in sql
+        assert f"CREATE TABLE {table} (" in schema
+
+    conn = _RecordingConn()
+    init_db._run_sql_with_go(conn, sql)
+    for batch in conn.batches:
+        for index in re.findall(r"CREATE (?:UNIQUE |CLUSTERED )?INDEX (\w+)", batch):
+            assert f"INDEX {index}" in schema
+            # either its own sys.indexes guard or created with its (guarded) table
+            assert f"WHERE name = '{index}'" in batch or "IS NULL\nBEGIN\n    CREATE TABLE" in batch, index
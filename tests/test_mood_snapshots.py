@@ -0,0 +1,83 @@
+# tests/test_mood_snapshots.py
+# Run from the project root: python -m pytest tests
+import os
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc"):
+    pytest.importorskip(_mod)
+
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from server import mood_snapshots  # noqa: E402
+from server.mood_snapshots import MoodSnapshotBuffer  # noqa: E402
+
+USER_A = "5b0e7a51-0000-4000-8000-00000000000a"
+USER_B = "5b0e7a51-0000-4000-8000-00000000000b"
+
+
+class _Session:
+    def __init__(self, written) -> None:
+        self.written = written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, stmt, rows):
+        self.written.extend(rows)
+
+    def commit(self) -> None:
+        pass
+
+
+@pytest.fixture
+def written(monkeypatch):
+    rows = []
+    monkeypatch.setattr(mood_snapshots, "SessionLocal", lambda: _Session(rows))
+    return rows
+
+
+def _buffer(window: int = 300) -> MoodSnapshotBuffer:
+    buf = MoodSnapshotBuffer(window_seconds=window, flush_interval=60)
+    # no background flusher: the tests flush by hand
+    buf._ensure_started = lambda: None
+    return buf
+
+
+def test_messages_in_a_window_coalesce_into_one_snapshot(written):
+    buf = _buffer()
+    buf.submit(USER_A, 3, "sad", "first")
+    first_seen = buf._pending[USER_A].first_seen
+    buf.submit(USER_A, 7, "good", "first\nsecond")
+
+    assert buf.flush() == 0  # window still open
+    assert buf.flush(force=True) == 1
+    (row,) = written
+    assert (row["uid"], row["score"], row["label"], row["note"]) == (USER_A, 7, "good", "first\nsecond")
+    assert buf.submitted == 2 and buf.written == 1
+    assert first_seen <= row["captured_at"]
+
+
+def test_elapsed_window_is_flushed_per_user(written):
+    buf = _buffer(window=0)
+    buf.submit(USER_A, 3, "sad", "a")
+    buf.submit(USER_B, 8, "happy", "b")
+    buf.submit("", 5, "neutral", "")  # nothing to store
+
+    assert buf.flush() == 2
+    assert sorted(r["uid"] for r in written) == [USER_A, USER_B]
+    assert buf.flush() == 0
+
+
+def test_stop_flushes_pending_snapshots(written):
+    buf = MoodSnapshotBuffer(window_seconds=300, flush_interval=60)
+    buf.submit(USER_A, 4, "low", "note")
+    assert buf._thread is not None and buf._thread.is_alive()
+
+    buf.stop()
+
+    assert not buf._thread.is_alive()
+    assert [r["uid"] for r in written] == [USER_A]
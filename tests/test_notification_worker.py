@@ -0,0 +1,316 @@
+# tests/test_notification_worker.py
+# Run from the project root: python -m pytest tests
+import asyncio
+import os
+from collections import namedtuple
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc", "firebase_admin"):
+    pytest.importorskip(_mod)
+
+# db.py only builds the engine at import; nothing here connects
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from server import notification_purposes as purposes  # noqa: E402
+from server import notification_worker as worker  # noqa: E402
+from server.firebase_client import SendResult  # noqa: E402
+from server.notification_policies import UserPolicy  # noqa: E402
+
+Broadcast = namedtuple(
+    "Broadcast",
+    "broadcast_id topic purpose template_id params_json payload_json scheduled_at attempts",
+)
+
+Job = namedtuple(
+    "Job",
+    "job_id user_id token_id purpose template_id params_json payload_json scheduled_at attempts",
+)
+
+USER = "5b0e7a51-0000-4000-8000-00000000000a"
+UTC = ZoneInfo("UTC")
+
+
+def _job(n: int, purpose: str = "tip", template_id: str = "tip", scheduled_at=None) -> Job:
+    return Job(
+        job_id=f"2d4c6e80-0000-4000-8000-{n:012d}",
+        user_id=USER,
+        token_id=None,
+        purpose=purpose,
+        template_id=template_id,
+        params_json=None,
+        payload_json=None,
+        scheduled_at=scheduled_at or datetime(2026, 3, 1, 21, 0, tzinfo=timezone.utc),
+        attempts=1,
+    )
+
+
+def _policy(quiet_start=None, quiet_end=None, daily_cap=8, sent_recent=0) -> UserPolicy:
+    return UserPolicy(UTC, quiet_start, quiet_end, daily_cap, sent_recent)
+
+
+def _broadcast(attempts: int) -> Broadcast:
+    return Broadcast(
+        broadcast_id="8c9a1f7e-0000-4000-8000-000000000001",
+        topic="tips_en_60m",
+        purpose="tip",
+        template_id="tip",
+        params_json=None,
+        payload_json=None,
+        scheduled_at=datetime.now(timezone.utc),
+        attempts=attempts,
+    )
+
+
+@pytest.fixture
+def failing_broadcast(monkeypatch):
+    rows, stored = [], []
+    monkeypatch.setattr(worker, "_claim_broadcasts", lambda: list(rows))
+    monkeypatch.setattr(worker, "_store_broadcasts", lambda updates: stored.extend(updates))
+    monkeypatch.setattr(
+        worker,
+        "send_push_topic",
+        lambda *a, **kw: SendResult(ok=False, error="backend unavailable", error_code="UNAVAILABLE"),
+    )
+    yield rows, stored
+    worker.waker.replace([])
+
+
+def test_failed_broadcast_is_retried(failing_broadcast):
+    rows, stored = failing_broadcast
+    rows.append(_broadcast(attempts=1))
+
+    assert asyncio.run(worker._process_due_broadcasts()) == 1
+
+    (bid, upd, message_id), = stored
+    assert bid == rows[0].broadcast_id
+    assert upd.job_id == rows[0].broadcast_id
+    assert upd.status == "pending"
+    assert upd.retry_in and upd.retry_in > 0
+    assert upd.error == "backend unavailable"
+    assert message_id is None
+
+
+def test_failed_broadcast_goes_dead_after_max_attempts(failing_broadcast):
+    rows, stored = failing_broadcast
+    rows.append(_broadcast(attempts=worker.MAX_ATTEMPTS))
+
+    asyncio.run(worker._process_due_broadcasts())
+
+    (_, upd, _), = stored
+    assert upd.status == "dead"
+    assert upd.retry_in is None
+
+
+def test_no_quiet_hours_unless_set():
+    now = datetime(2026, 3, 1, 23, 0, tzinfo=timezone.utc)
+    groups, held = worker._plan_pushes([_job(1)], {USER.lower(): _policy()}, now)
+    assert held == []
+    assert [[j.job_id for j in g] for g in groups] == [[_job(1).job_id]]
+
+
+def test_quiet_hours_defer_within_ttl():
+    now = datetime(2026, 3, 1, 7, 50, tzinfo=timezone.utc)
+    job = _job(1, scheduled_at=now)
+    groups, (upd,) = worker._plan_pushes([job], {USER.lower(): _policy(22, 8)}, now)
+    assert groups == []
+    assert (upd.status, upd.retry_in, upd.deferred) == ("pending", 600, True)
+
+
+def test_quiet_hours_expire_past_ttl():
+    # a checkin_reminder (2h TTL) claimed at 22:30 would only go out at 08:00
+    now = datetime(2026, 3, 1, 22, 30, tzinfo=timezone.utc)
+    job = _job(1, purpose="checkin_reminder", template_id="checkin_reminder", scheduled_at=now)
+    groups, (upd,) = worker._plan_pushes([job], {USER.lower(): _policy(22, 8)}, now)
+    assert groups == []
+    assert upd.status == "expired"
+    assert upd.retry_in is None
+
+
+def test_test_push_bypasses_policy():
+    now = datetime(2026, 3, 1, 23, 0, tzinfo=timezone.utc)
+    test_push = _job(1, template_id="test_positive", scheduled_at=now)
+    tip = _job(2, scheduled_at=now)
+    policy = _policy(22, 8, daily_cap=1, sent_recent=5)
+    groups, held = worker._plan_pushes([test_push, tip], {USER.lower(): policy}, now)
+    assert [[j.job_id for j in g] for g in groups] == [[test_push.job_id]]
+    assert [u.job_id for u in held] == [tip.job_id]
+
+
+@pytest.fixture
+def merged_push(monkeypatch):
+    """
+    One user with two due jobs (merged into one push) and one device whose
+    send fails transiently. Yields (set_jobs, stored updates).
+    """
+    state, stored = {"jobs": []}, []
+    device = worker.Device("7f3e0000-0000-4000-8000-000000000001", "fcm-token-1")
+
+    def load_batch():
+        jobs = list(state["jobs"])
+        devices = {str(j.job_id).lower(): [device] for j in jobs}
+        return jobs, devices, set(), {USER.lower(): _policy()}, 0.0, False
+
+    async def send(messages):
+        return [SendResult(ok=False, error="backend unavailable", error_code="UNAVAILABLE") for _ in messages]
+
+    monkeypatch.setattr(worker, "waker", worker.DueTimeWaker())
+    monkeypatch.setattr(worker, "_load_batch", load_batch)
+    monkeypatch.setattr(worker, "_render_group", lambda group: ("title", "body", {}))
+    monkeypatch.setattr(worker, "_send_concurrently", send)
+    monkeypatch.setattr(worker, "_store_statuses", lambda updates, deliveries, invalid: stored.extend(updates))
+    yield lambda *jobs: state.update(jobs=jobs), stored
+
+
+def test_merged_job_on_its_last_attempt_goes_dead_while_the_lead_retries(merged_push):
+    set_jobs, stored = merged_push
+    lead, merged = _job(1), _job(2)._replace(attempts=worker.MAX_ATTEMPTS)
+    set_jobs(lead, merged)
+
+    asyncio.run(worker._process_due_batch())
+
+    by_id = {u.job_id: u for u in stored}
+    assert by_id[lead.job_id].status == "pending"
+    assert by_id[lead.job_id].retry_in > 0
+    assert by_id[merged.job_id].status == "dead"
+    assert by_id[merged.job_id].retry_in is None
+
+
+def test_merged_job_retries_when_the_lead_is_out_of_attempts(merged_push):
+    set_jobs, stored = merged_push
+    lead, merged = _job(1)._replace(attempts=worker.MAX_ATTEMPTS), _job(2)
+    set_jobs(lead, merged)
+
+    asyncio.run(worker._process_due_batch())
+
+    by_id = {u.job_id: u for u in stored}
+    assert by_id[lead.job_id].status == "dead"
+    assert by_id[merged.job_id].status == "pending"
+    assert by_id[merged.job_id].retry_in > 0
+
+
+def test_notify_enqueued_without_worker_loop_keeps_no_state(monkeypatch):
+    waker = worker.DueTimeWaker()
+    monkeypatch.setattr(worker, "waker", waker)
+    assert not waker.bound()
+
+    for _ in range(3):
+        worker.notify_enqueued()
+
+    assert waker.next_due() is None
+
+
+class _DueQueue:
+    """
+    Stands in for the claim query: `due` pending jobs of one purpose.
+    """
+
+    def __init__(self, purpose: str, due: int) -> None:
+        self.purpose, self.due, self.claimed = purpose, due, 0
+
+    def execute(self, stmt, params):
+        n = 0
+        if params["purpose"] == self.purpose:
+            n = min(params["n"], self.due - self.claimed)
+        rows = [_job(self.claimed + i) for i in range(n)]
+        self.claimed += n
+        return SimpleNamespace(fetchall=lambda: rows)
+
+    def commit(self) -> None:
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(purposes, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def _drain(db, clock, cycles: int = 50):
+    """
+    Claim the way notification_loop does: again at once while more is
+    due, otherwise at the throttle's refill time. Returns the waits.
+    """
+    waits = []
+    for _ in range(cycles):
+        _, throttled_for, more_due = worker._claim_due(db)
+        if db.claimed == db.due:
+            break
+        if more_due:
+            continue
+        assert throttled_for > 0, "due jobs left with nothing scheduled"
+        waits.append(throttled_for)
+        clock[0] += throttled_for
+    return waits
+
+
+def test_claim_drains_past_rate_capacity(monkeypatch, clock):
+    tip = purposes.get_purpose("tip")
+    monkeypatch.setattr(tip, "limiter", purposes.RateLimiter(100))
+    db = _DueQueue("tip", due=450)
+
+    jobs, throttled_for, more_due = worker._claim_due(db)
+    # the limiter cut the 200-job share to 100: wait for a refill, not a resync
+    assert (len(jobs), more_due) == (100, False)
+    assert throttled_for == pytest.approx(1.0)
+
+    # the rest goes out in refill-sized rounds at 100/s
+    waits = _drain(db, clock)
+    assert db.claimed == 450
+    assert waits == pytest.approx([1.0] * 4)
+
+
+def test_claim_loops_again_when_batch_cap_is_hit(monkeypatch, clock):
+    tip = purposes.get_purpose("tip")
+    monkeypatch.setattr(tip, "limiter", purposes.RateLimiter(0))
+    db = _DueQueue("tip", due=450)
+
+    jobs, throttled_for, more_due = worker._claim_due(db)
+    assert (len(jobs), throttled_for, more_due) == (tip.batch_size, 0.0, True)
+
+    assert _drain(db, clock) == []
+    assert db.claimed == 450
+
+
+def test_wake_row_bump_reaches_a_standalone_worker_quickly(monkeypatch):
+    # a job enqueued by another process: only the wake row tells us
+    state = {"seq": 7, "upcoming": []}
+    monkeypatch.setattr(worker, "WAKE_POLL_SECONDS", 0.05)
+    monkeypatch.setattr(worker, "waker", worker.DueTimeWaker())
+    monkeypatch.setattr(worker, "_sweep_tokens", lambda: None)
+    monkeypatch.setattr(worker, "_expire_stale_now", lambda: 0)
+    monkeypatch.setattr(worker, "_read_wake_seq", lambda: state["seq"])
+    monkeypatch.setattr(worker, "_load_upcoming_now", lambda: list(state["upcoming"]))
+
+    async def no_broadcasts():
+        return 0
+
+    async def run():
+        sent = asyncio.Event()
+
+        async def batch():
+            sent.set()
+            state["upcoming"] = []
+            return 1, False
+
+        monkeypatch.setattr(worker, "_process_due_broadcasts", no_broadcasts)
+        monkeypatch.setattr(worker, "_process_due_batch", batch)
+        task = asyncio.create_task(worker.notification_loop(poll_interval=60))
+        await asyncio.sleep(0.1)
+
+        state["upcoming"] = [datetime.now(timezone.utc)]
+        state["seq"] += 1
+        t0 = asyncio.get_running_loop().time()
+        await asyncio.wait_for(sent.wait(), timeout=2)
+        latency = asyncio.get_running_loop().time() - t0
+
+        worker.stop_worker()
+        await task
+        return latency
+
+    # well inside the 60s resync
+    assert asyncio.run(run()) < 0.5
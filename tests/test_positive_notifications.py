@@ -0,0 +1,71 @@
+# tests/test_positive_notifications.py
+# Run from the project root: python -m pytest tests
+import os
+from types import SimpleNamespace
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc", "firebase_admin", "fastapi", "httpx", "jose"):
+    pytest.importorskip(_mod)
+
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from server.deps import get_db  # noqa: E402
+from server.notification_templates import PARAMS_JSON_MAX_LENGTH, dump_params, params_fit  # noqa: E402
+from server.routers import positive_notifications_routes as routes  # noqa: E402
+from server.routers.auth_routes import _user_id_from_authorization  # noqa: E402
+
+USER = "5b0e7a51-0000-4000-8000-00000000000a"
+
+
+class _Db:
+    def __init__(self) -> None:
+        self.params, self.commits = [], 0
+
+    def execute(self, stmt, params=None):
+        self.params.append(params)
+        return SimpleNamespace(rowcount=1)
+
+    def commit(self) -> None:
+        self.commits += 1
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db = _Db()
+    monkeypatch.setattr(routes, "notify_enqueued", lambda *a, **kw: None)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[_user_id_from_authorization] = lambda: USER
+    return TestClient(app), db
+
+
+def test_params_fit_counts_utf16_units():
+    assert params_fit(None)
+    assert params_fit("x" * PARAMS_JSON_MAX_LENGTH)
+    assert not params_fit("🌱" * (PARAMS_JSON_MAX_LENGTH // 2 + 1))
+
+
+def test_send_test_stores_the_body(client):
+    http, db = client
+    assert http.post("/positive-notifications/send-test", json={"body": "hi 🌱"}).status_code == 204
+    assert db.params[0]["params"] == dump_params({"body": "hi 🌱"})
+    assert db.commits == 1
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "x" * 301,  # over max_length
+        "🌱" * 200,  # 300 chars, 400 UTF-16 units plus the JSON wrapper
+        '"' * 200,  # every quote gets escaped
+    ],
+)
+def test_send_test_rejects_bodies_that_do_not_fit(client, body):
+    http, db = client
+    assert http.post("/positive-notifications/send-test", json={"body": body}).status_code == 422
+    assert db.commits == 0
@@ -0,0 +1,112 @@
+# tests/test_retention.py
+# Run from the project root: python -m pytest tests
+import os
+from types import SimpleNamespace
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc"):
+    pytest.importorskip(_mod)
+
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from server import retention  # noqa: E402
+
+
+class _Clock:
+    """
+    Fake time: sleeps advance it, each DB batch takes `batch_seconds`.
+    """
+
+    def __init__(self, batch_seconds: float = 0.1) -> None:
+        self.now, self.batch_seconds, self.sleeps = 1000.0, batch_seconds, []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    perf_counter = monotonic
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class _Db:
+    """
+    Every batch moves min(n, what is left) rows of `backlog`.
+    """
+
+    def __init__(self, clock: _Clock, backlog: int) -> None:
+        self.clock, self.backlog, self.statements = clock, backlog, []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, stmt, params):
+        self.statements.append(params)
+        self.clock.now += self.clock.batch_seconds
+        n = min(params["n"], self.backlog)
+        self.backlog -= n
+        return SimpleNamespace(scalar=lambda: n)
+
+    def commit(self) -> None:
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(retention, "time", c)
+    return c
+
+
+def _drain(monkeypatch, clock, backlog, budget, batch_size=100):
+    db = _Db(clock, backlog)
+    monkeypatch.setattr(retention, "SessionLocal", lambda: db)
+    stats = {}
+    retention._drain("T", "SELECT 1", {}, batch_size, budget, stats)
+    return db, stats["T"]
+
+
+def test_pace_sleeps_at_least_as_long_as_the_batch(clock):
+    budget = retention._Budget(max_seconds=10, pause_ms=200)
+    assert budget.pace(0.05)
+    assert budget.pace(0.5)
+    assert clock.sleeps == [0.2, 0.5]
+
+
+def test_budget_runs_out(clock):
+    budget = retention._Budget(max_seconds=1, pause_ms=0)
+    clock.now += 1
+    assert not budget.pace(0.1)
+    assert budget.exhausted and clock.sleeps == []
+
+
+def test_drain_stops_on_a_short_batch(monkeypatch, clock):
+    budget = retention._Budget(max_seconds=60, pause_ms=200)
+    db, entry = _drain(monkeypatch, clock, backlog=250, budget=budget)
+    assert (entry["rows"], entry["batches"]) == (250, 3)
+    assert db.backlog == 0
+    # no pause after the last (short) batch
+    assert clock.sleeps == [0.2, 0.2]
+    assert not budget.exhausted
+
+
+def test_drain_stops_when_the_budget_is_used_up(monkeypatch, clock):
+    budget = retention._Budget(max_seconds=1, pause_ms=200)
+    db, entry = _drain(monkeypatch, clock, backlog=10_000, budget=budget)
+    # 0.1s batch + 0.2s pause per round
+    assert entry["batches"] == 4
+    assert budget.exhausted and db.backlog == 10_000 - 400
+
+
+def test_pass_skips_tables_kept_forever(monkeypatch, clock):
+    db = _Db(clock, backlog=0)
+    monkeypatch.setattr(retention, "SessionLocal", lambda: db)
+    result = retention.run_retention_pass(notif_days=0, audit_days=0, email_days=7, max_seconds=60)
+    assert set(result["tables"]) == {"EmailOutbox"}
+    assert [p["status"] for p in db.statements] == list(retention.EMAIL_DONE_STATUSES)
+    assert result["complete"]
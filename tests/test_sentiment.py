@@ -0,0 +1,55 @@
+# tests/test_sentiment.py
+# Run from the project root: python -m pytest tests
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from server.sentiment import mood_score, score_text, score_texts  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "text, score",
+    [
+        ("great", 9.0),
+        ("I feel great", 9.0),
+        ("very good", 7.6),
+        ("I am so happy!", 9.55),
+        ("slightly sad", 3.8),
+        ("happy and sad", 5.75),
+        ("ok but tired", 5.25),
+        ("suicidal", 0.0),
+        ("extremely hopeless", 0.0),  # clamped at the bottom of the scale
+    ],
+)
+def test_scores(text, score):
+    assert score_text(text) == pytest.approx(score)
+
+
+@pytest.mark.parametrize(
+    "text, score",
+    [
+        ("not happy", 3.25),
+        ("I don't feel good", 4.0),
+        ("not very good", 3.7),
+        # typed without the apostrophe
+        ("dont feel good", 4.0),
+        ("i cant be happy", 3.25),
+        ("wont be fine", 4.25),
+        ("isnt good", 4.0),
+        ("i dont know", 4.0),
+        # a clause break ends the negation
+        ("not today, but happy", 8.5),
+    ],
+)
+def test_negation(text, score):
+    assert score_text(text) == pytest.approx(score)
+
+
+def test_whole_words_only():
+    assert score_text("goodbye") is None
+    assert mood_score("goodbye") == 5
+
+
+def test_batch_matches_single():
+    texts = ["great", None, "dont feel good", "meh"]
+    assert score_texts(texts) == [score_text(t) for t in texts]
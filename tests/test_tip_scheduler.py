@@ -0,0 +1,60 @@
+# tests/test_tip_scheduler.py
+# Run from the project root: python -m pytest tests
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc", "firebase_admin"):
+    pytest.importorskip(_mod)
+
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from sqlalchemy.exc import IntegrityError  # noqa: E402
+
+from server import tip_scheduler  # noqa: E402
+
+NOW = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class _RacingDb:
+    """
+    Topic lookup, then `races` inserts that lose to another scheduler.
+    """
+
+    def __init__(self, races: int) -> None:
+        self.races, self.inserts, self.rollbacks, self.commits = races, 0, 0, 0
+
+    def execute(self, stmt, params=None):
+        if "SELECT DISTINCT tip_topic" in str(stmt):
+            return SimpleNamespace(fetchall=lambda: [SimpleNamespace(tip_topic="tips_en_60m")])
+        self.inserts += 1
+        if self.inserts <= self.races:
+            raise IntegrityError(str(stmt), params, Exception("UQ_BroadcastQueue_Topic_Sched"))
+        return SimpleNamespace(rowcount=1)
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+
+
+def test_broadcast_race_is_retried():
+    db = _RacingDb(races=1)
+    assert tip_scheduler._enqueue_broadcasts(db, NOW, NOW + timedelta(minutes=10)) == 1
+    assert (db.inserts, db.rollbacks, db.commits) == (2, 1, 1)
+
+
+def test_broadcast_race_does_not_abort_the_pass():
+    db = _RacingDb(races=5)
+    assert tip_scheduler._enqueue_broadcasts(db, NOW, NOW + timedelta(minutes=10)) == 0
+    assert db.rollbacks == db.inserts == 2
+
+
+def test_topic_mode_sends_direct_tips_to_users_without_a_topic():
+    sql = tip_scheduler._direct_filter(True)
+    assert "max_pushes_per_day IS NOT NULL" in sql
+    assert "NOT EXISTS" in sql and "tip_topic IS NOT NULL" in sql
+    assert tip_scheduler._direct_filter(False) == ""
@@ -0,0 +1,73 @@
+# tests/test_weekly_summaries.py
+# Run from the project root: python -m pytest tests
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+for _mod in ("dotenv", "sqlalchemy", "pyodbc"):
+    pytest.importorskip(_mod)
+
+os.environ.setdefault("DATABASE_URL_ODBC", "Driver={ODBC Driver 18 for SQL Server};Server=localhost")
+
+from server.weekly_summaries import _load_week, build_summary  # noqa: E402
+
+
+def _at(day: int, hour: int = 9) -> datetime:
+    # 2026-03-02 is a Monday
+    return datetime(2026, 3, day, hour, tzinfo=timezone.utc)
+
+
+def test_chat_snapshots_are_not_counted_as_checkins():
+    entries = [
+        (_at(2), 6, "calm", "morning"),
+        (_at(2, 20), 6, None, "evening"),
+        (_at(3, 14), 2, "anxious", None),
+        (_at(4, 15), 4, "sad", None),
+        (_at(4, 16), 4, "sad", None),
+    ]
+    summary = build_summary(entries)
+
+    assert summary.startswith("This week you checked in 2 times on 1 day, with an average mood of 4.4/10.")
+    assert "Your chats added 3 more mood readings." in summary
+
+
+def test_checkins_only():
+    summary = build_summary([(_at(2), 8, "happy", "morning"), (_at(5), 8, "happy", "noon")])
+
+    assert summary.startswith("This week you checked in 2 times on 2 days, with an average mood of 8.0/10.")
+    assert "chat" not in summary
+    assert "Your brightest day was Monday." in summary
+    assert "Most common feelings: happy." in summary
+
+
+def test_snapshot_only_week_is_worded_as_chat_moods():
+    summary = build_summary([(_at(2), 3, "tired", None)])
+
+    assert summary.startswith("This week you shared your mood in chat 1 time on 1 day, with an average mood of 3.0/10.")
+    assert "checked in" not in summary
+    assert "be gentle with yourself" in summary
+
+
+def test_trend_uses_every_mood_entry():
+    entries = [
+        (_at(2), 2, None, "morning"),
+        (_at(3), 2, None, None),
+        (_at(5), 8, None, None),
+        (_at(6), 8, None, "evening"),
+    ]
+
+    assert "Your mood improved as the week went on." in build_summary(entries)
+
+
+def test_load_week_keeps_the_checkin_slot():
+    rows = [
+        SimpleNamespace(user_id="U1", captured_at=_at(2), score=5, label="ok", checkin_slot="noon"),
+        SimpleNamespace(user_id="U1", captured_at=_at(3), score=4, label=None, checkin_slot=None),
+    ]
+    db = SimpleNamespace(execute=lambda stmt, params: SimpleNamespace(fetchall=lambda: rows))
+
+    week = _load_week(db, ["U1"], _at(1))
+
+    assert week == {"U1": [(_at(2), 5, "ok", "noon"), (_at(3), 4, None, None)]}